@@ -1,11 +1,30 @@
 from aiogram import Router, types, F, Bot
-from aiogram.filters import Command, StateFilter
+from aiogram.filters import Command, CommandObject, StateFilter
+from aiogram.filters.callback_data import CallbackData
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
-from config import ADMINS
-from utils.storage import get_buttons, update_button, add_message_to_button, toggle_button, get_users, save_data, remove_message_from_button, get_receipts, update_receipt_status
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton
+from utils import tenants
+from utils.storage import get_user_registry, snapshot, update_receipt_status, get_stats, get_button_versions, rollback_buttons
+from utils import drafts
+from utils.stats import joins_since
+from utils.outgoing import bulk_priority, scheduler
+from utils.ordering import update_ordering
+from utils.throttling import update_throttling
+from utils.dedup import update_dedup
+from utils.health import watchdog
+from utils.storage import get_health as get_storage_health
+from utils.sharding import submit_broadcast
+from utils.stats import STATUSES
+from utils.formatting import entities_to_html, html_preview
+from utils.scheduled import broadcast_scheduler, parse_schedule, format_interval, run_resumable
+from utils.shutdown import shutdown_coordinator, JobInterrupted
+from utils.subscriptions import subscription_watcher, format_date, plan_title
+import asyncio
+import bisect
+import datetime
 import html
+import os
 
 router = Router()
 
@@ -25,66 +44,46 @@ class AdminStates(StatesGroup):
     check_receipts = State()
     select_receipt = State()
     process_receipt = State()
+    drafts_menu = State()
+    schedule_broadcast = State()
+    scheduled_list = State()
 
-# Функция для преобразования entities в HTML
-def entities_to_html(content: str, entities: list[types.MessageEntity] = None) -> str:
-    if not content or not content.strip():
-        return ""
-    if not entities:
-        return html.escape(content)
-
-    print(f"Debug: Processing entities for text: {content}")  # Отладка
-    print(f"Debug: Entities: {entities}")
-
-    # Создаём список событий (открытие/закрытие тегов)
-    events = []
-    for entity in entities:
-        if entity.type == "bold":
-            tag_open, tag_close = "<b>", "</b>"
-        elif entity.type == "italic":
-            tag_open, tag_close = "<i>", "</i>"
-        elif entity.type == "underline":
-            tag_open, tag_close = "<u>", "</u>"
-        elif entity.type == "strikethrough":
-            tag_open, tag_close = "<s>", "</s>"
-        elif entity.type == "spoiler":
-            tag_open, tag_close = '<span class="tg-spoiler">', "</span>"
-        elif entity.type == "text_link":
-            tag_open, tag_close = f'<a href="{html.escape(entity.url)}">', "</a>"
-        elif entity.type == "blockquote" or entity.type == "expandable_blockquote":
-            tag_open, tag_close = "<blockquote>", "</blockquote>"
-        else:
-            continue
-        events.append((entity.offset, "open", tag_open))
-        events.append((entity.offset + entity.length, "close", tag_close))
-
-    # Сортируем события по позиции и типу (закрывающие теги перед открывающими при равной позиции)
-    events.sort(key=lambda x: (x[0], x[1] == "open"))
-
-    result = []
-    last_pos = 0
-    for pos, event_type, tag in events:
-        # Добавляем текст до текущей позиции
-        if pos > last_pos:
-            result.append(html.escape(content[last_pos:pos]))
-        # Добавляем тег
-        result.append(tag)
-        last_pos = pos
-
-    # Добавляем оставшийся текст
-    if last_pos < len(content):
-        result.append(html.escape(content[last_pos:]))
-
-    final_html = "".join(result)
-    print(f"Debug: Generated HTML: {final_html}")  # Отладка
-    return final_html
+# Списки кнопок и сообщений листаются страницами фиксированного размера:
+# каждая страница — срез индекса черновика, время не зависит от числа кнопок
+BUTTONS_PAGE_SIZE = 8
+MESSAGES_PAGE_SIZE = 5
+# Сколько символов текста или подписи показывать в списке сообщений
+MESSAGE_PREVIEW_LENGTH = 80
+
+# Курсоры inline-клавиатур. rev — ревизия черновика на момент показа страницы
+# (для кнопок — ревизия их списка): если она с тех пор сменилась, номера устарели,
+# и страница просто перерисовывается
+class ButtonListCallback(CallbackData, prefix="abl"):
+    action: str  # page / pick / noop
+    page: int
+    rev: int
+    index: int = 0
+
+class MessageListCallback(CallbackData, prefix="aml"):
+    action: str  # page / del / noop
+    page: int
+    rev: int
+    index: int = 0
 
 def is_admin(user_id: int) -> bool:
-    return user_id in ADMINS
+    return user_id in tenants.admins()
+
+DRAFT_HINT = "📝 Изменение в черновике — пользователи увидят его после публикации."
+SCHEDULE_HELP = (
+    "Когда отправить рассылку?\n"
+    "Формат: <code>25.12.2025 18:00</code> или <code>18:00</code> (ближайшее такое время).\n"
+    "Для повтора добавь период: <code>18:00 1d</code> — каждый день, "
+    "<code>1w</code> — неделя, <code>12h</code> — часы, <code>30m</code> — минуты."
+)
 
 @router.message(Command(commands=["admin", "Admin"]))
 async def admin_panel(message: types.Message, state: FSMContext):
-    print(f"⚡ Команда /admin от {message.from_user.id}, ADMINS: {ADMINS}")
+    print(f"⚡ Команда /admin от {message.from_user.id}, ADMINS: {tenants.admins()}")
     if not is_admin(message.from_user.id):
         print("🚫 Нет доступа")
         return await message.answer("Нет доступа.")
@@ -100,28 +99,83 @@ async def show_main_menu(message: types.Message, state: FSMContext):
             keyboard=[
                 [KeyboardButton(text="✏️ Редактирование кнопок")],
                 [KeyboardButton(text="➕ Создать кнопку")],
-                [KeyboardButton(text="📬 Рассылка")],
+                [KeyboardButton(text="📬 Рассылка"), KeyboardButton(text="🗓 Запланированные")],
                 [KeyboardButton(text="🔍 Проверка чеков")],
+                [KeyboardButton(text="📝 Черновик"), KeyboardButton(text="📊 Статистика")],
                 [KeyboardButton(text="🚪 Выйти"), KeyboardButton(text="❌ Отменить")]
             ],
             resize_keyboard=True
         )
     )
 
-async def show_button_list(message: types.Message, state: FSMContext):
-    buttons = list(get_buttons().keys())
-    if not buttons:
+def page_bounds(total: int, page: int, size: int) -> tuple[int, int, int]:
+    # (страница, всего страниц, первый индекс); номер за пределами прижимается к краю
+    pages = max(1, -(-total // size))
+    page = min(max(page, 0), pages - 1)
+    return page, pages, page * size
+
+def page_navigation(factory, page: int, pages: int, rev: int) -> list[InlineKeyboardButton]:
+    row = []
+    if page > 0:
+        row.append(InlineKeyboardButton(text="◀️", callback_data=factory(action="page", page=page - 1, rev=rev).pack()))
+    row.append(InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data=factory(action="noop", page=page, rev=rev).pack()))
+    if page < pages - 1:
+        row.append(InlineKeyboardButton(text="▶️", callback_data=factory(action="page", page=page + 1, rev=rev).pack()))
+    return row
+
+def button_list_page(admin_id: int, page: int) -> tuple[str, InlineKeyboardMarkup]:
+    names = drafts.button_names(admin_id)
+    rev = drafts.names_revision(admin_id)
+    page, pages, start = page_bounds(len(names), page, BUTTONS_PAGE_SIZE)
+    keyboard = [
+        [InlineKeyboardButton(text=name, callback_data=ButtonListCallback(action="pick", page=page, rev=rev, index=index).pack())]
+        for index, name in enumerate(names[start:start + BUTTONS_PAGE_SIZE], start)
+    ]
+    if pages > 1:
+        keyboard.append(page_navigation(ButtonListCallback, page, pages, rev))
+    return f"Выбери кнопку для редактирования (всего {len(names)}):", InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+async def show_button_list(message: types.Message, state: FSMContext, admin_id: int = None):
+    # Админ редактирует свой черновик, а не опубликованные кнопки.
+    # admin_id передают обработчики inline-кнопок: там message — сообщение бота
+    admin_id = admin_id or message.from_user.id
+    if not drafts.button_names(admin_id):
         await state.clear()
         await message.answer("Нет доступных кнопок.", reply_markup=ReplyKeyboardRemove())
         await show_main_menu(message, state)
         return
     
-    keyboard = [[KeyboardButton(text=btn)] for btn in buttons]
-    keyboard.append([KeyboardButton(text="🔙 Назад"), KeyboardButton(text="❌ Отменить")])
-    markup = ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
-    
     await state.set_state(AdminStates.choose_button)
-    await message.answer("Выбери кнопку для редактирования:", parse_mode="HTML", reply_markup=markup)
+    await message.answer(
+        "✏️ Редактирование кнопок",
+        reply_markup=ReplyKeyboardMarkup(
+            keyboard=[[KeyboardButton(text="🔙 Назад"), KeyboardButton(text="❌ Отменить")]],
+            resize_keyboard=True
+        )
+    )
+    text, markup = button_list_page(admin_id, 0)
+    await message.answer(text, reply_markup=markup)
+
+@router.callback_query(ButtonListCallback.filter())
+async def button_list_callback(callback: types.CallbackQuery, callback_data: ButtonListCallback, state: FSMContext):
+    admin_id = callback.from_user.id
+    if not is_admin(admin_id):
+        return await callback.answer("Нет доступа.")
+    if callback_data.action == "noop":
+        return await callback.answer()
+    if callback_data.rev != drafts.names_revision(admin_id):
+        text, markup = button_list_page(admin_id, callback_data.page)
+        await callback.message.edit_text(text, reply_markup=markup)
+        return await callback.answer("Список кнопок изменился, показываю актуальный.")
+    if callback_data.action == "page":
+        text, markup = button_list_page(admin_id, callback_data.page)
+        await callback.message.edit_text(text, reply_markup=markup)
+        return await callback.answer()
+    if await state.get_state() not in (AdminStates.choose_button.state, AdminStates.choose_action.state):
+        # Старый список, нажатый посреди другого действия, не должен его перебивать
+        return await callback.answer("Этот список устарел.")
+    await callback.answer()
+    await show_button_actions(callback.message, state, drafts.button_names(admin_id)[callback_data.index])
 
 @router.message(Command("cancel"))
 async def cancel_action(message: types.Message, state: FSMContext):
@@ -129,6 +183,118 @@ async def cancel_action(message: types.Message, state: FSMContext):
         return await message.answer("Нет доступа.")
     await cancel_button(message, state)
 
+@router.message(Command("metrics"))
+async def show_metrics(message: types.Message, state: FSMContext):
+    if not is_admin(message.from_user.id):
+        return await message.answer("Нет доступа.")
+    updates = update_ordering.get_metrics()
+    outgoing = scheduler.get_stats()
+    throttling = update_throttling.get_metrics()
+    dedup = update_dedup.get_metrics()
+    loop = watchdog.get_metrics()
+    startup = watchdog.get_startup()
+    storage_health = get_storage_health()
+    flush_age = f"{storage_health['last_flush_age']:.0f} с назад" if storage_health["last_flush_age"] is not None else "ещё не было"
+    first_update = f"{startup['first_update_after']:.2f} с" if startup["first_update_after"] is not None else "ещё не было"
+    dropped = ", ".join(f"{kind}: {count}" for kind, count in throttling["dropped"].items()) or "нет"
+    await message.answer(
+        "📈 <b>Метрики</b>\n"
+        f"Апдейты в очереди: {updates['queue_depth']}, в работе: {updates['active']}/{updates['max_concurrency']}\n"
+        f"Ожидание: среднее {updates['avg_wait'] * 1000:.0f} мс, p95 {updates['p95_wait'] * 1000:.0f} мс, "
+        f"макс {updates['max_wait'] * 1000:.0f} мс\n"
+        f"Обработано апдейтов: {updates['processed']}\n"
+        f"Исходящие в очереди: {outgoing['queue']['interactive']} интерактивных, {outgoing['queue']['bulk']} массовых\n"
+        f"Отброшено флуда: {throttling['dropped_total']} ({dropped})\n"
+        f"Отброшено повторных апдейтов: {dedup['suppressed']}\n"
+        f"Задержка цикла: p95 {loop['p95_lag'] * 1000:.0f} мс, макс {loop['max_lag'] * 1000:.0f} мс, зависаний: {loop['stalls']}\n"
+        f"Хранилище: в очереди {storage_health['queue_depth']}, последняя запись {flush_age}\n"
+        f"Первый апдейт после запуска: {first_update}",
+        parse_mode="HTML"
+    )
+
+@router.message(Command("profile"))
+async def start_profile(message: types.Message, command: CommandObject, state: FSMContext):
+    if not is_admin(message.from_user.id):
+        return await message.answer("Нет доступа.")
+    # Профайлер и экспорт нужны только по команде — при старте их модули не импортируются
+    from utils import profiling
+    duration, mode = profiling.DEFAULT_DURATION, profiling.MODES[0]
+    for arg in (command.args or "").split():
+        if arg.isdigit() and int(arg) > 0:
+            duration = min(int(arg), profiling.MAX_DURATION)
+        elif arg in profiling.MODES:
+            mode = arg
+        else:
+            return await message.answer(
+                f"Использование: /profile [секунд] [{'|'.join(profiling.MODES)}]\n"
+                f"По умолчанию {profiling.DEFAULT_DURATION} с, sample; не больше {profiling.MAX_DURATION} с."
+            )
+    # Сеанс идёт в фоне, чтобы не держать очередь апдейтов этого чата
+    if not profiling.start_session(message.bot, message.chat.id, mode, duration):
+        return await message.answer("⏳ Профилирование уже идёт, дождись результата.")
+    await message.answer(f"🔬 Профилирование ({mode}) запущено на {duration} с. Результат придёт отдельным сообщением.")
+
+EXPORT_USAGE = (
+    "Использование: /export users|receipts|history [csv|jsonl] [с ГГГГ-ММ-ДД] [по ГГГГ-ММ-ДД] [pending|approved|rejected]\n"
+    "Например: /export receipts csv с 2025-06-01 по 2025-06-30 pending"
+)
+
+@router.message(Command("export"))
+async def export_data(message: types.Message, command: CommandObject, state: FSMContext):
+    if not is_admin(message.from_user.id):
+        return await message.answer("Нет доступа.")
+    from utils.export import KINDS, FORMATS, write_export, parse_date
+    args = (command.args or "").split()
+    if not args or args[0] not in KINDS:
+        return await message.answer(EXPORT_USAGE)
+    kind, fmt, status = args[0], "csv", None
+    dates = {"с": None, "по": None}
+    bound = None  # "с"/"по" перед датой; без них первая дата — начало, вторая — конец
+    for arg in args[1:]:
+        if arg.lower() in dates and bound is None:
+            bound = arg.lower()
+        elif bound is None and arg in FORMATS:
+            fmt = arg
+        elif bound is None and arg in STATUSES:
+            status = arg
+        else:
+            try:
+                day = parse_date(arg)
+            except ValueError:
+                return await message.answer(EXPORT_USAGE)
+            bound = bound or ("с" if dates["с"] is None else "по")
+            if dates[bound] is not None:
+                return await message.answer(EXPORT_USAGE)
+            dates[bound], bound = day, None
+    if bound is not None:
+        return await message.answer(EXPORT_USAGE)
+    since = dates["с"]
+    until = dates["по"] + 86400 if dates["по"] is not None else None  # Конечная дата включительно
+    
+    await message.answer("⏳ Готовлю выгрузку...")
+    try:
+        # Выгрузка пишется в рабочем потоке и не держит остальные хендлеры
+        path, count = await asyncio.to_thread(write_export, kind, fmt, since, until, status)
+    except Exception as e:
+        print(f"Ошибка выгрузки {kind}: {e}")
+        return await message.answer("❌ Ошибка при подготовке выгрузки.")
+    try:
+        await message.answer_document(FSInputFile(path, filename=f"{kind}.{fmt}"), caption=f"✅ Выгрузка {kind}: {count} строк")
+    finally:
+        os.remove(path)
+
+@router.message(Command("rollback"))
+async def rollback_version(message: types.Message, command: CommandObject, state: FSMContext):
+    if not is_admin(message.from_user.id):
+        return await message.answer("Нет доступа.")
+    if not command.args or not command.args.strip().isdigit():
+        return await message.answer("Использование: /rollback <номер версии>")
+    version = int(command.args.strip())
+    new_version = await asyncio.to_thread(rollback_buttons, version, message.from_user.id)
+    if new_version is None:
+        return await message.answer("❌ Такой версии нет в истории.")
+    await message.answer(f"⏪ Кнопки возвращены к версии {version} (опубликовано как версия {new_version}).")
+
 @router.message(F.text == "❌ Отменить", StateFilter(*AdminStates))
 async def cancel_button(message: types.Message, state: FSMContext):
     if not is_admin(message.from_user.id):
@@ -181,6 +347,12 @@ async def handle_main_menu(message: types.Message, state: FSMContext):
     elif message.text == "🔍 Проверка чеков":
         await state.set_state(AdminStates.check_receipts)
         await show_receipts_list(message, state)
+    elif message.text == "🗓 Запланированные":
+        await show_scheduled_list(message, state)
+    elif message.text == "📊 Статистика":
+        await show_stats(message, state)
+    elif message.text == "📝 Черновик":
+        await show_drafts_menu(message, state)
     elif message.text == "🚪 Выйти":
         await exit_admin_panel(message, state)
     elif message.text == "❌ Отменить":
@@ -189,9 +361,84 @@ async def handle_main_menu(message: types.Message, state: FSMContext):
         await message.answer("Выбери действие из меню.", reply_markup=ReplyKeyboardRemove())
         await show_main_menu(message, state)
 
+async def show_drafts_menu(message: types.Message, state: FSMContext):
+    changes = drafts.describe_changes(message.from_user.id)
+    if not changes:
+        # Черновик без изменений не держим: он привязан к старой версии и помешал бы публикации
+        drafts.discard(message.from_user.id)
+    versions = get_button_versions()
+    text = "📝 <b>Черновик кнопок</b>\n\n"
+    text += "\n".join(html.escape(change) for change in changes) if changes else "Изменений нет."
+    text += f"\n\nОпубликованная версия: {versions[0].get('version', 0)}"
+    if len(versions) > 1:
+        text += "\nОткат: /rollback &lt;номер&gt;, доступны версии " + ", ".join(str(v.get("version", 0)) for v in versions[1:])
+    await state.set_state(AdminStates.drafts_menu)
+    await message.answer(
+        text,
+        parse_mode="HTML",
+        reply_markup=ReplyKeyboardMarkup(
+            keyboard=[
+                [KeyboardButton(text="📤 Опубликовать")],
+                [KeyboardButton(text="🗑 Сбросить черновик")],
+                [KeyboardButton(text="🔙 Назад"), KeyboardButton(text="❌ Отменить")]
+            ],
+            resize_keyboard=True
+        )
+    )
+
+@router.message(AdminStates.drafts_menu, F.text)
+async def handle_drafts_menu(message: types.Message, state: FSMContext):
+    admin_id = message.from_user.id
+    if message.text == "📤 Опубликовать":
+        if not drafts.describe_changes(admin_id):
+            drafts.discard(admin_id)
+            await message.answer("Нечего публиковать.", reply_markup=ReplyKeyboardRemove())
+        else:
+            version = await asyncio.to_thread(drafts.publish, admin_id)
+            if version is None:
+                await message.answer(
+                    "❌ Кнопки уже изменили после начала черновика. Сбрось черновик и повтори правки.",
+                    reply_markup=ReplyKeyboardRemove()
+                )
+            else:
+                await message.answer(f"✅ Опубликована версия {version}.", reply_markup=ReplyKeyboardRemove())
+        await show_main_menu(message, state)
+    elif message.text == "🗑 Сбросить черновик":
+        drafts.discard(admin_id)
+        await message.answer("Черновик сброшен.", reply_markup=ReplyKeyboardRemove())
+        await show_main_menu(message, state)
+    elif message.text == "🔙 Назад":
+        await show_main_menu(message, state)
+    else:
+        await show_drafts_menu(message, state)
+
+async def show_stats(message: types.Message, state: FSMContext):
+    # Если data.json изменил другой процесс, счётчики перечитываются — не на цикле событий
+    stats = await asyncio.to_thread(get_stats)
+    by_status = stats["receipts_by_status"]
+    approval = stats["approval"]
+    if approval["count"]:
+        avg_minutes = approval["total_seconds"] / approval["count"] / 60
+        approval_text = f"среднее {avg_minutes:.0f} мин, максимум {approval['max_seconds'] / 60:.0f} мин"
+    else:
+        approval_text = "нет данных"
+    await message.answer(
+        "📊 <b>Статистика</b>\n\n"
+        f"👥 Пользователей: {stats['users_total']}\n"
+        f"Новых сегодня: {joins_since(stats, 1)}, за 7 дней: {joins_since(stats, 7)}, за 30 дней: {joins_since(stats, 30)}\n\n"
+        f"🧾 Чеки: ⏳ {by_status.get('pending', 0)} на проверке, ✅ {by_status.get('approved', 0)} одобрено, "
+        f"❌ {by_status.get('rejected', 0)} отклонено\n"
+        f"⏱ Время одобрения: {approval_text}",
+        parse_mode="HTML"
+    )
+
+def collect_pending_receipts() -> list[dict]:
+    # Чеки на проверку из одного снимка хранилища; в FSM уходят обычные словари
+    return [receipt.thaw() for receipt in snapshot().get("receipts", []) if receipt["status"] == "pending"]
+
 async def show_receipts_list(message: types.Message, state: FSMContext):
-    receipts = get_receipts()
-    pending_receipts = [r for r in receipts if r["status"] == "pending"]
+    # Проход по всем чекам идёт в рабочем потоке и не держит цикл событий
+    pending_receipts = await asyncio.to_thread(collect_pending_receipts)
     if not pending_receipts:
         await state.clear()
         await message.answer("Нет чеков на проверку.", reply_markup=ReplyKeyboardRemove())
@@ -200,7 +447,9 @@ async def show_receipts_list(message: types.Message, state: FSMContext):
     
     text = "Чеки на проверку:\n"
     for i, receipt in enumerate(pending_receipts):
-        text += f"{i + 1}. Пользователь {receipt['user_id']} (Тип: {receipt['type']})\n"
+        mark = " ⚠️ повтор" if receipt.get("duplicate_of") else ""
+        plan = f", {plan_title(receipt['plan'])}" if receipt.get("plan") else ""
+        text += f"{i + 1}. Пользователь {receipt['user_id']} (Тип: {receipt['type']}{plan}){mark}\n"
     text += "\nВведи номер чека для обработки (например, 1):"
     
     await state.update_data(receipts=pending_receipts)
@@ -236,6 +485,7 @@ async def select_receipt(message: types.Message, state: FSMContext):
         print(f"Выбран чек: {receipt}")  # Отладочный вывод
         await message.answer(
             f"Чек от пользователя {receipt['user_id']} (Тип: {receipt['type']})."
+            + (f"\nПлан: {plan_title(receipt['plan'])}" if receipt.get("plan") else "")
         )
         if receipt["type"] == "photo":
             await message.bot.send_photo(message.chat.id, receipt["file_id"])
@@ -287,14 +537,19 @@ async def process_receipt_action(message: types.Message, state: FSMContext, bot:
         return
 
     if message.text == "✅ Одобрить":
-        update_receipt_status(receipt["user_id"], receipt["file_id"], "approved")
-        await message.answer(f"✅ Чек от пользователя {receipt['user_id']} одобрен.")
+        await asyncio.to_thread(update_receipt_status, receipt["user_id"], receipt["file_id"], "approved")
+        # Одобренный чек плана продлевает подписку
+        subscription = await subscription_watcher.activate(receipt["user_id"], receipt.get("plan"))
+        until = ""
+        if subscription and subscription.get("expires"):
+            until = f"\nПодписка «{plan_title(subscription['plan'])}» действует до {format_date(subscription['expires'])}."
+        await message.answer(f"✅ Чек от пользователя {receipt['user_id']} одобрен.{until}")
         try:
-            await bot.send_message(receipt["user_id"], "Ваш чек одобрен! Добро пожаловать в отряд свободы!")
+            await bot.send_message(receipt["user_id"], f"Ваш чек одобрен! Добро пожаловать в отряд свободы!{until}")
         except Exception as e:
             print(f"Ошибка уведомления пользователя {receipt['user_id']}: {e}")
     elif message.text == "❌ Отклонить":
-        update_receipt_status(receipt["user_id"], receipt["file_id"], "rejected")
+        await asyncio.to_thread(update_receipt_status, receipt["user_id"], receipt["file_id"], "rejected")
         await message.answer(f"❌ Чек от пользователя {receipt['user_id']} отклонён.")
         try:
             await bot.send_message(receipt["user_id"], "Ваш чек отклонён. Пожалуйста, проверьте данные и попробуйте снова.")
@@ -313,11 +568,14 @@ async def choose_action(message: types.Message, state: FSMContext):
     if btn_name == "❌ Отменить":
         await cancel_button(message, state)
         return
-    if btn_name not in get_buttons():
+    if btn_name not in drafts.get_draft_buttons(message.from_user.id):
         await state.clear()
         await message.answer("Такой кнопки нет.", reply_markup=ReplyKeyboardRemove())
         await show_button_list(message, state)
         return
+    await show_button_actions(message, state, btn_name)
+
+async def show_button_actions(message: types.Message, state: FSMContext, btn_name: str):
     await state.update_data(button=btn_name)
     await state.set_state(AdminStates.choose_action)
     await message.answer(
@@ -355,13 +613,11 @@ async def finish_rename(message: types.Message, state: FSMContext):
         return await message.answer("❌ Название слишком длинное или пустое. Попробуй снова.")
     data = await state.get_data()
     old_name = data.get("button")
-    buttons = get_buttons()
-    if new_name in buttons:
+    if new_name in drafts.get_draft_buttons(message.from_user.id):
         return await message.answer("❌ Кнопка с таким названием уже существует.")
-    buttons[new_name] = buttons.pop(old_name)
-    save_data({"buttons": buttons, "users": get_users(), "receipts": get_receipts()})
+    drafts.rename_button(message.from_user.id, old_name, new_name)
     await state.clear()
-    await message.answer(f"✅ Кнопка переименована в <b>{new_name}</b>.", parse_mode="HTML", reply_markup=ReplyKeyboardRemove())
+    await message.answer(f"✅ Кнопка переименована в <b>{new_name}</b>.\n{DRAFT_HINT}", parse_mode="HTML", reply_markup=ReplyKeyboardRemove())
     await show_button_list(message, state)
 
 @router.message(F.text == "🧾 Добавить сообщение", AdminStates.choose_action)
@@ -385,17 +641,15 @@ async def create_new_button(message: types.Message, state: FSMContext):
     new_name = message.text.strip()
     if len(new_name) > 50 or not new_name:
         return await message.answer("❌ Название слишком длинное или пустое. Попробуй снова.")
-    buttons = get_buttons()
-    if new_name in buttons:
+    if new_name in drafts.get_draft_buttons(message.from_user.id):
         return await message.answer("❌ Кнопка с таким названием уже существует.")
     
-    update_button(new_name, {"messages": [], "active": True})
-    save_data({"buttons": get_buttons(), "users": get_users(), "receipts": get_receipts()})
+    drafts.create_button(message.from_user.id, new_name)
     
     await state.update_data(button=new_name)
     await state.set_state(AdminStates.add_message)
     await message.answer(
-        f"✅ Кнопка <b>{new_name}</b> создана.\n"
+        f"✅ Кнопка <b>{new_name}</b> создана в черновике.\n"
         "Отправь текст, голосовое, кружок, фото или видео для кнопки.\n"
         "Стилизуй текст прямо в Telegram (жирный, курсив, ссылки и т.д.).",
         parse_mode="HTML",
@@ -523,8 +777,8 @@ async def handle_message_preview(message: types.Message, state: FSMContext):
         if caption:
             message_data["caption"] = caption
         
-        add_message_to_button(button_name, message_data)
-        await message.answer(f"✅ {msg_type.capitalize()} добавлено {'с подписью' if caption else 'без подписи'}.", reply_markup=ReplyKeyboardRemove())
+        drafts.add_message(message.from_user.id, button_name, message_data)
+        await message.answer(f"✅ {msg_type.capitalize()} добавлено {'с подписью' if caption else 'без подписи'}.\n{DRAFT_HINT}", reply_markup=ReplyKeyboardRemove())
         await state.clear()
         await show_button_list(message, state)
 
@@ -573,8 +827,8 @@ async def confirm_text_message(message: types.Message, state: FSMContext):
     content = data.get("text_content")
     
     if content:
-        add_message_to_button(button_name, {"type": "text", "content": content})
-        await message.answer("✅ Текст добавлен.", reply_markup=ReplyKeyboardRemove())
+        drafts.add_message(message.from_user.id, button_name, {"type": "text", "content": content})
+        await message.answer(f"✅ Текст добавлен.\n{DRAFT_HINT}", reply_markup=ReplyKeyboardRemove())
     else:
         await message.answer("❌ Ошибка: текст не найден.", reply_markup=ReplyKeyboardRemove())
     
@@ -596,7 +850,7 @@ async def handle_invalid_message(message: types.Message, state: FSMContext):
 async def start_delete_message(message: types.Message, state: FSMContext):
     data = await state.get_data()
     button_name = data["button"]
-    buttons = get_buttons()
+    buttons = drafts.get_draft_buttons(message.from_user.id)
     messages = buttons.get(button_name, {}).get("messages", [])
     
     if not messages:
@@ -605,30 +859,77 @@ async def start_delete_message(message: types.Message, state: FSMContext):
         await show_button_list(message, state)
         return
     
-    text = f"Сообщения для кнопки <b>{button_name}</b>:\n"
-    for i, msg in enumerate(messages):
-        msg_type = msg.get("type")
-        if msg_type == "text":
-            content = msg.get("content", "Без текста")
-        elif msg_type in ["voice", "video_note", "photo", "video"]:
-            content = f"{msg_type.capitalize()} (ID: {msg.get('file_id', 'N/A')})"
-        else:
-            content = "Неизвестный тип"
-        caption = msg.get("caption", "")
-        if caption:
-            content += f"\nПодпись: {caption}"
-        text += f"{i + 1}. {content}\n"
-    text += "\nВведи номер сообщения для удаления (например, 1):"
-    
     await state.set_state(AdminStates.delete_message)
     await message.answer(
-        text,
+        f"🗑️ Удаление сообщений кнопки <b>{button_name}</b>",
         parse_mode="HTML",
         reply_markup=ReplyKeyboardMarkup(
             keyboard=[[KeyboardButton(text="❌ Отменить")]],
             resize_keyboard=True
         )
     )
+    text, markup = message_list_page(message.from_user.id, button_name, 0)
+    await message.answer(text, parse_mode="HTML", reply_markup=markup)
+
+def describe_message(msg: dict) -> str:
+    msg_type = msg.get("type")
+    if msg_type == "text":
+        content = html_preview(msg.get("content"), MESSAGE_PREVIEW_LENGTH) or "Без текста"
+    elif msg_type in ["voice", "video_note", "photo", "video"]:
+        content = f"{msg_type.capitalize()} (ID: {msg.get('file_id', 'N/A')})"
+    else:
+        content = "Неизвестный тип"
+    caption = msg.get("caption", "")
+    if caption:
+        content += f"\nПодпись: {html_preview(caption, MESSAGE_PREVIEW_LENGTH)}"
+    return content
+
+def message_list_page(admin_id: int, button_name: str, page: int) -> tuple[str, InlineKeyboardMarkup]:
+    messages = drafts.get_draft_buttons(admin_id).get(button_name, {}).get("messages", [])
+    rev = drafts.revision(admin_id)
+    page, pages, start = page_bounds(len(messages), page, MESSAGES_PAGE_SIZE)
+    text = f"Сообщения кнопки <b>{button_name}</b> (всего {len(messages)}):\n"
+    delete_row = []
+    for index, msg in enumerate(messages[start:start + MESSAGES_PAGE_SIZE], start):
+        text += f"{index + 1}. {describe_message(msg)}\n"
+        delete_row.append(InlineKeyboardButton(
+            text=f"🗑 {index + 1}",
+            callback_data=MessageListCallback(action="del", page=page, rev=rev, index=index).pack()
+        ))
+    text += "\nНажми 🗑 с номером или введи номер сообщения для удаления:"
+    keyboard = [delete_row]
+    if pages > 1:
+        keyboard.append(page_navigation(MessageListCallback, page, pages, rev))
+    return text, InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+@router.callback_query(MessageListCallback.filter())
+async def message_list_callback(callback: types.CallbackQuery, callback_data: MessageListCallback, state: FSMContext):
+    admin_id = callback.from_user.id
+    if not is_admin(admin_id):
+        return await callback.answer("Нет доступа.")
+    if await state.get_state() != AdminStates.delete_message.state:
+        # Клавиатура от прошлого захода: кнопка, к которой она относится, уже не выбрана
+        return await callback.answer("Этот список устарел.")
+    if callback_data.action == "noop":
+        return await callback.answer()
+    button_name = (await state.get_data())["button"]
+    if callback_data.rev != drafts.revision(admin_id):
+        text, markup = message_list_page(admin_id, button_name, callback_data.page)
+        await callback.message.edit_text(text, parse_mode="HTML", reply_markup=markup)
+        return await callback.answer("Список сообщений изменился, показываю актуальный.")
+    if callback_data.action == "del":
+        drafts.remove_message(admin_id, button_name, callback_data.index)
+        if not drafts.get_draft_buttons(admin_id).get(button_name, {}).get("messages"):
+            await callback.message.edit_text(f"✅ Удалено последнее сообщение кнопки <b>{button_name}</b>.\n{DRAFT_HINT}", parse_mode="HTML")
+            await callback.answer()
+            await state.clear()
+            await show_button_list(callback.message, state, admin_id)
+            return
+        await callback.answer(f"✅ Сообщение удалено.\n{DRAFT_HINT}")
+    else:
+        await callback.answer()
+    text, markup = message_list_page(admin_id, button_name, callback_data.page)
+    await callback.message.edit_text(text, parse_mode="HTML", reply_markup=markup)
 
 @router.message(AdminStates.delete_message)
 async def finish_delete_message(message: types.Message, state: FSMContext):
@@ -637,14 +938,14 @@ async def finish_delete_message(message: types.Message, state: FSMContext):
         return
     data = await state.get_data()
     button_name = data["button"]
-    buttons = get_buttons()
+    buttons = drafts.get_draft_buttons(message.from_user.id)
     messages = buttons.get(button_name, {}).get("messages", [])
     
     try:
         index = int(message.text) - 1
         if 0 <= index < len(messages):
-            remove_message_from_button(button_name, index)
-            await message.answer(f"✅ Сообщение удалено из кнопки <b>{button_name}</b>.", parse_mode="HTML", reply_markup=ReplyKeyboardRemove())
+            drafts.remove_message(message.from_user.id, button_name, index)
+            await message.answer(f"✅ Сообщение удалено из кнопки <b>{button_name}</b>.\n{DRAFT_HINT}", parse_mode="HTML", reply_markup=ReplyKeyboardRemove())
         else:
             await message.answer("❌ Неверный номер сообщения. Попробуй снова.", reply_markup=ReplyKeyboardMarkup(
                 keyboard=[[KeyboardButton(text="❌ Отменить")]],
@@ -663,17 +964,17 @@ async def finish_delete_message(message: types.Message, state: FSMContext):
 @router.message(F.text == "✅ Включить кнопку", AdminStates.choose_action)
 async def enable_button(message: types.Message, state: FSMContext):
     data = await state.get_data()
-    toggle_button(data["button"], True)
+    drafts.set_active(message.from_user.id, data["button"], True)
     await state.clear()
-    await message.answer("Кнопка включена.", reply_markup=ReplyKeyboardRemove())
+    await message.answer(f"Кнопка включена.\n{DRAFT_HINT}", reply_markup=ReplyKeyboardRemove())
     await show_button_list(message, state)
 
 @router.message(F.text == "🚫 Отключить кнопку", AdminStates.choose_action)
 async def disable_button(message: types.Message, state: FSMContext):
     data = await state.get_data()
-    toggle_button(data["button"], False)
+    drafts.set_active(message.from_user.id, data["button"], False)
     await state.clear()
-    await message.answer("Кнопка отключена.", reply_markup=ReplyKeyboardRemove())
+    await message.answer(f"Кнопка отключена.\n{DRAFT_HINT}", reply_markup=ReplyKeyboardRemove())
     await show_button_list(message, state)
 
 @router.message(AdminStates.confirm_broadcast, F.text | F.voice | F.video_note | F.photo | F.video)
@@ -734,72 +1035,179 @@ async def prepare_broadcast_preview(message: types.Message, state: FSMContext):
         reply_markup=ReplyKeyboardMarkup(
             keyboard=[
                 [KeyboardButton(text="✅ Подтвердить")],
+                [KeyboardButton(text="🕒 Запланировать")],
                 [KeyboardButton(text="❌ Отменить")]
             ],
             resize_keyboard=True
         )
     )
 
+# Отправка рассылки всем пользователям, возвращает число успешных отправок
+async def run_broadcast(bot: Bot, broadcast_data: dict, resume_after: int = None) -> int:
+    # Получатели идут по возрастанию id: прерванную рассылку продолжаем с resume_after
+    users = (await asyncio.to_thread(get_user_registry)).ids()
+    if resume_after is not None:
+        users = users[bisect.bisect_right(users, resume_after):]
+    success = 0
+    last_user = resume_after
+    
+    # Рассылка идёт массовым приоритетом, чтобы не задерживать ответы пользователям
+    with bulk_priority():
+        for user_id in users:
+            if shutdown_coordinator.stopping:
+                raise JobInterrupted(success, last_user)
+            last_user = user_id
+            try:
+                if broadcast_data["type"] == "text":
+                    content = entities_to_html(broadcast_data["text"], broadcast_data["entities"] or [])
+                    await bot.send_message(
+                        user_id,
+                        content,
+                        parse_mode="HTML"
+                    )
+                    success += 1
+                elif broadcast_data["type"] == "voice":
+                    caption = entities_to_html(broadcast_data["caption"] or "", broadcast_data["caption_entities"] or [])
+                    await bot.send_voice(
+                        user_id,
+                        broadcast_data["voice_file_id"],
+                        caption=caption,
+                        parse_mode="HTML" if caption else None
+                    )
+                    success += 1
+                elif broadcast_data["type"] == "video_note":
+                    await bot.send_video_note(user_id, broadcast_data["video_note_file_id"])
+                    if broadcast_data["caption"]:
+                        caption = entities_to_html(broadcast_data["caption"], broadcast_data["caption_entities"] or [])
+                        await bot.send_message(user_id, caption, parse_mode="HTML")
+                    success += 1
+                elif broadcast_data["type"] == "photo":
+                    caption = entities_to_html(broadcast_data["caption"] or "", broadcast_data["caption_entities"] or [])
+                    await bot.send_photo(
+                        user_id,
+                        broadcast_data["photo_file_id"],
+                        caption=caption,
+                        parse_mode="HTML" if caption else None
+                    )
+                    success += 1
+                elif broadcast_data["type"] == "video":
+                    caption = entities_to_html(broadcast_data["caption"] or "", broadcast_data["caption_entities"] or [])
+                    await bot.send_video(
+                        user_id,
+                        broadcast_data["video_file_id"],
+                        caption=caption,
+                        parse_mode="HTML" if caption else None
+                    )
+                    success += 1
+            except Exception as e:
+                print(f"Failed to send message to user {user_id}: {e}")
+                continue
+    return success
+
 @router.message(AdminStates.preview_broadcast, F.text == "✅ Подтвердить")
 async def do_broadcast(message: types.Message, state: FSMContext):
     data = await state.get_data()
     broadcast_data = data.get("broadcast_data", {})
-    users = get_users()
-    success = 0
     
-    for user_id in users:
-        try:
-            if broadcast_data["type"] == "text":
-                content = entities_to_html(broadcast_data["text"], broadcast_data["entities"] or [])
-                await message.bot.send_message(
-                    user_id,
-                    content,
-                    parse_mode="HTML"
-                )
-                success += 1
-            elif broadcast_data["type"] == "voice":
-                caption = entities_to_html(broadcast_data["caption"] or "", broadcast_data["caption_entities"] or [])
-                await message.bot.send_voice(
-                    user_id,
-                    broadcast_data["voice_file_id"],
-                    caption=caption,
-                    parse_mode="HTML" if caption else None
-                )
-                success += 1
-            elif broadcast_data["type"] == "video_note":
-                await message.bot.send_video_note(user_id, broadcast_data["video_note_file_id"])
-                if broadcast_data["caption"]:
-                    caption = entities_to_html(broadcast_data["caption"], broadcast_data["caption_entities"] or [])
-                    await message.bot.send_message(user_id, caption, parse_mode="HTML")
-                success += 1
-            elif broadcast_data["type"] == "photo":
-                caption = entities_to_html(broadcast_data["caption"] or "", broadcast_data["caption_entities"] or [])
-                await message.bot.send_photo(
-                    user_id,
-                    broadcast_data["photo_file_id"],
-                    caption=caption,
-                    parse_mode="HTML" if caption else None
-                )
-                success += 1
-            elif broadcast_data["type"] == "video":
-                caption = entities_to_html(broadcast_data["caption"] or "", broadcast_data["caption_entities"] or [])
-                await message.bot.send_video(
-                    user_id,
-                    broadcast_data["video_file_id"],
-                    caption=caption,
-                    parse_mode="HTML" if caption else None
-                )
-                success += 1
-        except Exception as e:
-            print(f"Failed to send message to user {user_id}: {e}")
-            continue
+    # В шардированном режиме рассылку выполняет ведущий процесс
+    if submit_broadcast(message.chat.id, broadcast_data):
+        await state.clear()
+        await message.answer("📬 Рассылка передана ведущему процессу. Итог придёт отдельным сообщением.", reply_markup=ReplyKeyboardRemove())
+        await show_main_menu(message, state)
+        return
+    
+    # Рассылка идёт фоновой задачей: хендлер не держит очередь чата админа и слот обработки
+    task = asyncio.create_task(broadcast_in_background(message.bot, message.chat.id, broadcast_data))
+    shutdown_coordinator.track(task)
     
     await state.clear()
-    await message.answer(f"✅ Рассылка завершена. Отправлено: {success} сообщений.", reply_markup=ReplyKeyboardRemove())
+    await message.answer("📬 Рассылка запущена. Итог придёт отдельным сообщением.", reply_markup=ReplyKeyboardRemove())
     await show_main_menu(message, state)
 
+async def broadcast_in_background(bot: Bot, chat_id: int, broadcast_data: dict):
+    try:
+        success = await run_resumable(bot, chat_id, broadcast_data)
+        if success is None:
+            return
+        await bot.send_message(chat_id, f"✅ Рассылка завершена. Отправлено: {success} сообщений.")
+    except Exception as e:
+        print(f"Broadcast failed: {e}")
+
 @router.message(AdminStates.preview_broadcast, F.text == "❌ Отменить")
 async def cancel_broadcast(message: types.Message, state: FSMContext):
     await cancel_button(message, state)
 
-print("✅ admin.py загружен")
\ No newline at end of file
+@router.message(AdminStates.preview_broadcast, F.text == "🕒 Запланировать")
+async def ask_broadcast_time(message: types.Message, state: FSMContext):
+    await state.set_state(AdminStates.schedule_broadcast)
+    await message.answer(
+        SCHEDULE_HELP,
+        parse_mode="HTML",
+        reply_markup=ReplyKeyboardMarkup(
+            keyboard=[[KeyboardButton(text="❌ Отменить")]],
+            resize_keyboard=True
+        )
+    )
+
+@router.message(AdminStates.schedule_broadcast, F.text)
+async def schedule_broadcast(message: types.Message, state: FSMContext):
+    try:
+        due, interval = parse_schedule(message.text)
+    except ValueError:
+        await message.answer("❌ Не понял время или оно уже прошло.\n\n" + SCHEDULE_HELP, parse_mode="HTML")
+        return
+    data = await state.get_data()
+    job_id = await broadcast_scheduler.schedule(message.chat.id, data.get("broadcast_data", {}), due, interval)
+    repeat = f", повтор каждые {format_interval(interval)}" if interval else ""
+    await state.clear()
+    await message.answer(
+        f"🗓 Рассылка #{job_id} запланирована на {format_time(due)}{repeat}.",
+        reply_markup=ReplyKeyboardRemove()
+    )
+    await show_main_menu(message, state)
+
+def format_time(timestamp: float) -> str:
+    return datetime.datetime.fromtimestamp(timestamp).strftime("%d.%m.%Y %H:%M")
+
+async def show_scheduled_list(message: types.Message, state: FSMContext):
+    jobs = broadcast_scheduler.jobs()
+    if not jobs:
+        await message.answer("Запланированных рассылок нет.", reply_markup=ReplyKeyboardRemove())
+        await show_main_menu(message, state)
+        return
+
+    text = "🗓 <b>Запланированные рассылки</b>\n"
+    for i, job in enumerate(jobs):
+        repeat = f", каждые {format_interval(job['interval'])}" if job.get("interval") else ""
+        text += f"{i + 1}. #{job['id']} — {format_time(job['due'])}{repeat} (Тип: {job['broadcast'].get('type')})\n"
+    text += "\nВведи номер рассылки, чтобы отменить её:"
+
+    await state.update_data(scheduled_ids=[job["id"] for job in jobs])
+    await state.set_state(AdminStates.scheduled_list)
+    await message.answer(
+        text,
+        parse_mode="HTML",
+        reply_markup=ReplyKeyboardMarkup(
+            keyboard=[[KeyboardButton(text="🔙 Назад"), KeyboardButton(text="❌ Отменить")]],
+            resize_keyboard=True
+        )
+    )
+
+@router.message(AdminStates.scheduled_list, F.text)
+async def cancel_scheduled(message: types.Message, state: FSMContext):
+    if message.text == "🔙 Назад":
+        await show_main_menu(message, state)
+        return
+    if not message.text.isdigit():
+        return  # Игнорируем нечисловой ввод
+
+    index = int(message.text) - 1
+    ids = (await state.get_data()).get("scheduled_ids", [])
+    if not 0 <= index < len(ids):
+        await message.answer("Неверный номер рассылки.")
+        return
+    if await broadcast_scheduler.cancel(ids[index]):
+        await message.answer(f"🗑️ Рассылка #{ids[index]} отменена.", reply_markup=ReplyKeyboardRemove())
+    else:
+        await message.answer("Эта рассылка уже отправлена или отменена.", reply_markup=ReplyKeyboardRemove())
+    await show_scheduled_list(message, state)
\ No newline at end of file
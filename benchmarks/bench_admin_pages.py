@@ -0,0 +1,107 @@
+# Задержка навигации админа по спискам кнопок и сообщений при растущем каталоге.
+# Апдейты идут через Dispatcher без сети:
+#   open — «✏️ Редактирование кнопок» (первый раз строит черновик из data.json)
+#   page — листание списка кнопок inline-кнопкой
+#   pick — выбор кнопки со страницы
+#   messages — «🗑️ Удалить сообщение», первая страница сообщений
+#   messages_page — листание сообщений
+# При постраничной навигации page, pick и messages_page не должны расти с числом кнопок.
+#
+# Запуск из корня проекта:
+#   python -m benchmarks.bench_admin_pages --buttons 10,1000,100000 --messages 50
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.load_test import build_dispatcher, callback_update, message_update, parse_sizes
+
+ACTIONS = ("open", "page", "pick", "messages", "messages_page")
+
+
+def generate_catalog(path: str, buttons: int, messages: int):
+    catalog = {
+        f"Кнопка {i}": {
+            "messages": [{"type": "text", "content": f"<b>Сообщение {j}</b> кнопки {i}"} for j in range(messages)],
+            "active": True,
+        }
+        for i in range(buttons)
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"buttons": catalog, "users": {}}, f, ensure_ascii=False)
+
+
+async def navigate(dp, bot, admin_id: int, rounds: int, rnd: random.Random) -> dict:
+    from handlers.admin import BUTTONS_PAGE_SIZE, MESSAGES_PAGE_SIZE, ButtonListCallback, MessageListCallback
+    from utils import drafts
+
+    latencies = {action: [] for action in ACTIONS}
+
+    async def feed(action: str, update):
+        started = time.perf_counter()
+        await dp.feed_update(bot, update)
+        latencies[action].append(time.perf_counter() - started)
+
+    await dp.feed_update(bot, message_update(admin_id, "/admin"))
+    for _ in range(rounds):
+        await feed("open", message_update(admin_id, "✏️ Редактирование кнопок"))
+        names = drafts.button_names(admin_id)
+        pages = -(-len(names) // BUTTONS_PAGE_SIZE)
+        page = rnd.randrange(pages)
+        rev = drafts.names_revision(admin_id)
+        await feed("page", callback_update(admin_id, ButtonListCallback(action="page", page=page, rev=rev).pack()))
+        index = min(page * BUTTONS_PAGE_SIZE + rnd.randrange(BUTTONS_PAGE_SIZE), len(names) - 1)
+        await feed("pick", callback_update(admin_id, ButtonListCallback(action="pick", page=page, rev=rev, index=index).pack()))
+        await feed("messages", message_update(admin_id, "🗑️ Удалить сообщение"))
+        count = len(drafts.get_draft_buttons(admin_id)[names[index]]["messages"])
+        message_pages = max(1, -(-count // MESSAGES_PAGE_SIZE))
+        await feed("messages_page", callback_update(
+            admin_id, MessageListCallback(action="page", page=rnd.randrange(message_pages), rev=drafts.revision(admin_id)).pack()
+        ))
+        await dp.feed_update(bot, message_update(admin_id, "❌ Отменить"))
+    return latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Задержка постраничной навигации админ-панели")
+    parser.add_argument("--buttons", type=parse_sizes, default=[10, 1000, 10000], help="размер каталога кнопок, через запятую")
+    parser.add_argument("--messages", type=int, default=20, help="сообщений у каждой кнопки")
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    from config import ADMINS
+
+    project_dir = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="otryad-admin-pages-")
+    sys.path.insert(0, project_dir)
+    os.chdir(workdir)
+    try:
+        from utils import drafts, storage
+
+        dp, bot = build_dispatcher()
+        admin_id = ADMINS[0]
+        print(f"сообщений у кнопки: {args.messages}, медиана, мс")
+        print(f"{'кнопок':>8} " + " ".join(f"{action:>13}" for action in ACTIONS))
+        for buttons in args.buttons:
+            generate_catalog("data.json", buttons, args.messages)
+            storage.invalidate_cache()
+            drafts.discard(admin_id)
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                latencies = asyncio.run(navigate(dp, bot, admin_id, args.rounds, random.Random(args.seed)))
+            print(f"{buttons:>8} " + " ".join(f"{statistics.median(latencies[action]) * 1000:13.3f}" for action in ACTIONS))
+    finally:
+        os.chdir(project_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+# Скорость entities_to_html на длинных текстах с эмодзи и большим числом entities.
+# Корректность проверяется в tests/test_entities.py.
+#
+# Запуск из корня проекта:
+#   python -m benchmarks.bench_entities --sizes 1000,10000,100000 --entities 0.05
+import argparse
+import random
+import statistics
+import sys
+import time
+
+from utils.formatting import entities_to_html
+
+ALPHABET = "абвгд abc <&>😀🎉✅\n"
+TYPES = ("bold", "italic", "underline", "strikethrough", "spoiler", "code", "pre", "text_link",
+         "text_mention", "custom_emoji", "blockquote", "expandable_blockquote", "mention", "url")
+
+
+def utf16_len(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def make_case(rng: random.Random, size: int, density: float) -> tuple[str, list[dict]]:
+    text = "".join(rng.choice(ALPHABET) for _ in range(size))
+    total = utf16_len(text)
+    entities = []
+    for _ in range(max(1, int(size * density))):
+        offset = rng.randrange(total)
+        entities.append({
+            "type": rng.choice(TYPES),
+            "offset": offset,
+            "length": rng.randint(1, min(total - offset, 200)),
+            "url": "https://example.org/?a=1&b=2",
+            "user": {"id": rng.randint(1, 10**9)},
+            "custom_emoji_id": str(rng.randint(1, 10**18)),
+            "language": rng.choice((None, "python")),
+        })
+    return text, entities
+
+
+def run_bench(sizes: list[int], density: float, repeat: int, seed: int):
+    rng = random.Random(seed)
+    for size in sizes:
+        text, entities = make_case(rng, size, density)
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            entities_to_html(text, entities)
+            timings.append(time.perf_counter() - started)
+        median = statistics.median(timings)
+        print(
+            f"size={size:<8} entities={len(entities):<6} median={median * 1000:.2f}ms "
+            f"min={min(timings) * 1000:.2f}ms per_char={median / size * 1e9:.0f}ns"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк entities_to_html")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="длины текстов через запятую")
+    parser.add_argument("--entities", type=float, default=0.05, help="entities на символ текста")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    run_bench([int(size) for size in args.sizes.split(",")], args.entities, args.repeat, args.seed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+# Синтетическая нагрузка load_test на стандартном цикле asyncio и на uvloop.
+# Режимы чередуются по раундам, чтобы прогрев и шум делились поровну.
+#
+# Запуск из корня проекта:
+#   python -m benchmarks.bench_loop --users 500 --data-users 10000 --concurrency 50 --rounds 3
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+
+from benchmarks.load_test import build_dispatcher, build_workload, generate_data, run_workload
+from utils import runtime
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сравнение asyncio и uvloop на синтетической нагрузке")
+    parser.add_argument("--users", type=int, default=200, help="число виртуальных пользователей")
+    parser.add_argument("--data-users", type=int, default=1000, help="размер users в data.json")
+    parser.add_argument("--concurrency", type=int, default=50, help="сколько сценариев выполняется одновременно")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--with-ordering", action="store_true", help="подключить упорядочивание апдейтов по чатам")
+    parser.add_argument("--with-scheduler", action="store_true", help="подключить планировщик исходящих сообщений")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    modes = ["asyncio"]
+    if runtime.loop_factory("auto")[1] != "asyncio":
+        modes.append("uvloop")
+    else:
+        print("uvloop не установлен — замер только стандартного цикла")
+
+    from config import ADMINS
+
+    project_dir = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="otryad-loop-")
+    sys.path.insert(0, project_dir)
+    os.chdir(workdir)
+    results = {mode: [] for mode in modes}
+    try:
+        generate_data("data.json", args.data_users, args.data_users // 10, args.seed)
+        dp, bot = build_dispatcher(args.with_scheduler, with_ordering=args.with_ordering)
+        for _ in range(args.rounds):
+            for mode in modes:
+                # Каждый раунд начинается с одинаковых данных
+                generate_data("data.json", args.data_users, args.data_users // 10, args.seed)
+                scenarios = build_workload(args.users, ADMINS, args.seed)
+                result = runtime.run(run_workload(dp, bot, scenarios, args.concurrency), mode=mode, quiet=True)
+                results[mode].append(result)
+    finally:
+        os.chdir(project_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    for mode, runs in results.items():
+        throughput = statistics.median(r["throughput_ups"] for r in runs)
+        baseline = baseline or throughput
+        print(
+            f"{mode:<8} throughput={throughput:.1f} upd/s (x{throughput / baseline:.2f}) "
+            f"p50={statistics.median(r['p50_ms'] for r in runs):.2f}ms "
+            f"p95={statistics.median(r['p95_ms'] for r in runs):.2f}ms "
+            f"p99={statistics.median(r['p99_ms'] for r in runs):.2f}ms "
+            f"errors={sum(r['errors'] for r in runs)}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
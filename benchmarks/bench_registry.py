@@ -0,0 +1,75 @@
+# Память и скорость реестра пользователей на массивах против словаря из data.json.
+#
+# Запуск из корня проекта:
+#   python -m benchmarks.bench_registry --users 1000000
+import argparse
+import gc
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+from utils.registry import UserRegistry
+
+
+def make_users(count: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    now = time.time()
+    ids = rng.sample(range(10**8, 8 * 10**9), count)
+    return {str(user_id): {"joined": now - rng.random() * 365 * 86400} for user_id in ids}
+
+
+def measure(build):
+    # Возвращает (объект, прирост памяти в байтах, время построения)
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    value = build()
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, current, elapsed
+
+
+def timed(action) -> float:
+    started = time.perf_counter()
+    action()
+    return time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк реестра пользователей")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    raw = json.dumps(make_users(args.users, args.seed))
+    print(f"users={args.users} data.json users section={len(raw) / 1e6:.1f} MB")
+
+    users, dict_bytes, dict_time = measure(lambda: json.loads(raw))
+    registry, registry_bytes, registry_time = measure(lambda: UserRegistry.from_users(users))
+    print(f"dict     memory={dict_bytes / 1e6:8.1f} MB ({dict_bytes / args.users:6.1f} B/user) json.loads={dict_time:.2f}s")
+    print(f"registry memory={registry_bytes / 1e6:8.1f} MB ({registry_bytes / args.users:6.1f} B/user) build={registry_time:.2f}s")
+
+    rng = random.Random(args.seed)
+    keys = rng.sample(list(users), min(args.lookups, len(users)))
+    int_keys = [int(key) for key in keys]
+    print(
+        f"iterate  dict+int()={timed(lambda: sum(int(key) for key in users)):.3f}s "
+        f"registry={timed(lambda: sum(registry)):.3f}s"
+    )
+    print(
+        f"lookup x{len(keys)} dict={timed(lambda: [users.get(key) for key in keys]):.3f}s "
+        f"registry={timed(lambda: [registry.get(key) for key in int_keys]):.3f}s"
+    )
+
+    blob, _, dump_time = measure(registry.to_bytes)
+    _, _, load_time = measure(lambda: UserRegistry.from_bytes(blob))
+    print(f"binary   size={len(blob) / 1e6:.1f} MB dump={dump_time:.3f}s load={load_time:.3f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
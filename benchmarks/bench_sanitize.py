@@ -0,0 +1,79 @@
+# Пропускная способность sanitize_html на входах до 1 МБ, включая патологические
+# (тысячи незакрытых "<", глубокая вложенность, длинные атрибуты): время должно
+# расти линейно от длины. Корректность проверяется в tests/test_sanitize.py.
+#
+# Запуск из корня проекта:
+#   python -m benchmarks.bench_sanitize --sizes 1000,100000,1000000
+import argparse
+import random
+import statistics
+import sys
+import time
+
+from utils.formatting import sanitize_html
+
+PIECES = (
+    "текст ", "text ", "😀", "&", "&amp;", ">", "<", "<b>", "</b>", "<i>", "</i>", "</u>",
+    '<a href="https://example.org/?a=1&b=2">', "</a>", "<a href='x' onclick='y'>", "<script>",
+    "</script>", '<span class="tg-spoiler">', "</span>", "<pre>", "</pre>", "<blockquote expandable>",
+    '<tg-emoji emoji-id="5">', "</tg-emoji>", "<a", "<b href", "<", "</", "<<>>",
+)
+
+
+def random_html(rng: random.Random, size: int) -> str:
+    parts = []
+    length = 0
+    while length < size:
+        piece = rng.choice(PIECES)
+        parts.append(piece)
+        length += len(piece)
+    return "".join(parts)[:size]
+
+
+# Патологические входы: каждый бьёт по своему месту наивной реализации
+CASES = {
+    "random": lambda rng, size: random_html(rng, size),
+    "plain": lambda rng, size: ("Обычный текст без разметки. " * (size // 28 + 1))[:size],
+    "unclosed_lt": lambda rng, size: ("<a" * (size // 2 + 1))[:size],
+    "long_tag": lambda rng, size: ("<b " + "x" * size)[:size],
+    "deep_nesting": lambda rng, size: ("<b><i>" * (size // 12) + "x" + "</i></b>" * (size // 12))[:size],
+    "long_href": lambda rng, size: ('<a href="' + "h" * size + '">x</a>')[:size],
+}
+
+
+def run_bench(sizes: list[int], repeat: int, seed: int) -> int:
+    worst_ratio = 1.0
+    for name, make in CASES.items():
+        per_char = []
+        for size in sizes:
+            text = make(random.Random(seed), size)
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                sanitize_html(text, limit=None)
+                timings.append(time.perf_counter() - started)
+            median = statistics.median(timings)
+            per_char.append(median / len(text))
+            print(
+                f"{name:<13} size={len(text):<8} median={median * 1000:8.2f}ms "
+                f"throughput={len(text) / median / 1e6 if median else 0:6.1f} MB/s"
+            )
+        # Рост времени на символ между самым маленьким и самым большим входом
+        ratio = per_char[-1] / per_char[0] if per_char[0] else 1.0
+        worst_ratio = max(worst_ratio, ratio)
+    print(f"худший рост времени на символ: x{worst_ratio:.1f}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк sanitize_html")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000", help="размеры входа через запятую")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    return run_bench([int(size) for size in args.sizes.split(",")], args.repeat, args.seed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+# Масштабирование шардированного режима: один и тот же поток синтетических апдейтов
+# обрабатывается 1..N воркер-процессами с общим data.json.
+#
+# Запуск из корня проекта:
+#   python -m benchmarks.bench_sharding --max-workers 8 --users 2000 --data-users 1000
+import argparse
+import asyncio
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.load_test import build_workload, generate_data
+
+
+def _bench_worker(index: int, workdir: str, inbox, ready, results):
+    os.chdir(workdir)
+    from utils import storage
+    storage.enable_process_lock()
+    from benchmarks.load_test import build_dispatcher
+    from utils.sharding import worker_loop
+
+    dp, bot = build_dispatcher(with_ordering=True)
+    ready.put(index)
+    with open(os.devnull, "w") as devnull:
+        sys.stdout = devnull
+        processed = asyncio.run(worker_loop(dp, bot, inbox))
+        sys.stdout = sys.__stdout__
+    results.put((index, processed, time.time()))
+
+
+def run_once(workers: int, raw_updates: list, workdir: str) -> dict:
+    from utils.sharding import shard_for
+
+    ctx = multiprocessing.get_context("spawn")
+    inboxes = [ctx.Queue() for _ in range(workers)]
+    ready = ctx.Queue()
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=_bench_worker, args=(i, workdir, inboxes[i], ready, results))
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    # Запуск процессов и импорт aiogram в замер не входят
+    for _ in range(workers):
+        ready.get()
+
+    started = time.time()
+    for raw in raw_updates:
+        inboxes[shard_for(raw, workers)].put(raw)
+    for inbox in inboxes:
+        inbox.put(None)
+    finished = [results.get() for _ in range(workers)]
+    elapsed = max(f[2] for f in finished) - started
+    for process in processes:
+        process.join()
+
+    processed = sum(f[1] for f in finished)
+    return {
+        "workers": workers,
+        "updates": processed,
+        "elapsed_s": elapsed,
+        "throughput_ups": processed / elapsed if elapsed else 0.0,
+        "per_worker": sorted((f[0], f[1]) for f in finished),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк шардированного режима")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--users", type=int, default=1000, help="число виртуальных пользователей")
+    parser.add_argument("--data-users", type=int, default=1000, help="размер users в data.json")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    from config import ADMINS
+
+    scenarios = build_workload(args.users, ADMINS, args.seed)
+    raw_updates = [
+        update.model_dump(mode="json", by_alias=True, exclude_none=True)
+        for scenario in scenarios for _, update in scenario
+    ]
+
+    counts = []
+    n = 1
+    while n < args.max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(args.max_workers)
+
+    baseline = None
+    workdir = tempfile.mkdtemp(prefix="otryad-shards-")
+    try:
+        for workers in counts:
+            generate_data(os.path.join(workdir, "data.json"), args.data_users, args.data_users // 10, args.seed)
+            result = run_once(workers, raw_updates, workdir)
+            baseline = baseline or result["throughput_ups"]
+            print(
+                f"workers={workers:<3} updates={result['updates']:<7} elapsed={result['elapsed_s']:.2f}s "
+                f"throughput={result['throughput_ups']:.1f} upd/s speedup=x{result['throughput_ups'] / baseline:.2f}"
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
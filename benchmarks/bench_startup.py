@@ -0,0 +1,105 @@
+# Холодный старт: каждый замер — новый процесс Python.
+#   import_aiogram — импорт aiogram
+#   import_handlers — импорт хендлеров и сборка Dispatcher
+#   first_load — первое чтение data.json (get_buttons)
+#   first_update — первый апдейт (нажатие кнопки меню) через Dispatcher без сети
+#   second_update — такой же апдейт на прогретых кешах, для сравнения
+#
+# Запуск из корня проекта:
+#   python -m benchmarks.bench_startup --data-users 1000,100000 --runs 5
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PHASES = ("import_aiogram", "import_handlers", "first_load", "first_update", "second_update", "total")
+
+
+def child():
+    # Ничего тяжёлого до первой отметки времени
+    started = time.perf_counter()
+    marks = {}
+    from benchmarks import load_test
+    marks["import_aiogram"] = time.perf_counter()
+    dp, bot = load_test.build_dispatcher()
+    marks["import_handlers"] = time.perf_counter()
+    from utils import storage
+    storage.get_buttons()
+    marks["first_load"] = time.perf_counter()
+
+    import asyncio
+    import contextlib
+
+    async def press():
+        update = load_test.message_update(1_000_001, load_test.ENTRY_BUTTON)
+        await dp.feed_update(bot, update)
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        asyncio.run(press())
+        marks["first_update"] = time.perf_counter()
+        asyncio.run(press())
+        marks["second_update"] = time.perf_counter()
+
+    result, previous = {}, started
+    for phase in PHASES[:-1]:
+        result[phase] = marks[phase] - previous
+        previous = marks[phase]
+    # Полное время старта — до ответа на первый апдейт
+    result["total"] = marks["first_update"] - started
+    print(json.dumps(result))
+
+
+def measure(project_dir: str, workdir: str, runs: int) -> list[dict]:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [project_dir, os.environ.get("PYTHONPATH")])))
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_startup", "--child"],
+            cwd=workdir, env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Время холодного старта бота до первого ответа")
+    parser.add_argument("--data-users", default="1000", help="размер users в data.json, через запятую")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="куда записать результаты")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        child()
+        return 0
+
+    from benchmarks.load_test import generate_data
+
+    project_dir = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="otryad-startup-")
+    report = []
+    try:
+        for data_users in (int(x) for x in args.data_users.split(",")):
+            generate_data(os.path.join(workdir, "data.json"), data_users, data_users // 10, args.seed)
+            runs = measure(project_dir, workdir, args.runs)
+            medians = {phase: statistics.median(r[phase] for r in runs) for phase in PHASES}
+            report.append({"data_users": data_users, "runs": args.runs, **medians})
+            print(f"data_users={data_users} (медианы по {args.runs} запускам)")
+            for phase in PHASES:
+                print(f"  {phase:<16} {medians[phase] * 1000:9.1f} ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
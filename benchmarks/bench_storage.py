@@ -0,0 +1,207 @@
+# Микробенчмарк операций хранилища на сгенерированных data.json.
+#
+# Запуск из корня проекта:
+#   python -m benchmarks.bench_storage --sizes 1000,10000,100000 --json storage-main.json
+#   python -m benchmarks.bench_storage --backend utils.storage --label my-branch --json storage-branch.json
+#   python -m benchmarks.bench_storage --compare storage-main.json storage-branch.json
+import argparse
+import importlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Optional
+
+from benchmarks.load_test import generate_data
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+OPERATIONS = ("add_user", "add_receipt", "update_receipt_status", "get_buttons", "clean_receipt_history")
+DEFAULT_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+
+
+def bytes_written() -> Optional[int]:
+    # Сколько байт процесс записал через write(); None, если платформа не даёт счётчик
+    if psutil is not None:
+        counters = psutil.Process().io_counters()
+        return getattr(counters, "write_chars", counters.write_bytes)
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def make_operations(backend, size: int, receipt_owner: int) -> dict[str, Callable[[int], None]]:
+    # Каждая операция получает номер повтора, чтобы не делать одинаковых записей
+    middle_user = 1_000_000 + size // 2
+    middle_receipt = f"file-{size // 2}"
+    return {
+        "add_user": lambda i: backend.add_user(50_000_000 + i),
+        "add_receipt": lambda i: backend.add_receipt(middle_user, f"bench-{i}", "photo"),
+        "update_receipt_status": lambda i: backend.update_receipt_status(
+            receipt_owner, middle_receipt, "approved" if i % 2 else "rejected"),
+        "get_buttons": lambda i: backend.get_buttons(),
+        "clean_receipt_history": lambda i: backend.clean_receipt_history(1_000_000 + i),
+    }
+
+
+def measure(operation: Callable[[int], None], repeat: int, reset: Callable[[], None]) -> dict:
+    timings = []
+    written = []
+    for i in range(repeat):
+        reset()
+        before = bytes_written()
+        started = time.perf_counter()
+        operation(i)
+        timings.append(time.perf_counter() - started)
+        after = bytes_written()
+        if before is not None and after is not None:
+            written.append(after - before)
+
+    # Пик памяти меряем отдельным прогоном: tracemalloc искажает время
+    reset()
+    tracemalloc.start()
+    operation(repeat)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "time_ms_median": statistics.median(timings) * 1000,
+        "time_ms_min": min(timings) * 1000,
+        "time_ms_max": max(timings) * 1000,
+        "peak_mem_mb": peak / 1024 / 1024,
+        "bytes_written": int(statistics.median(written)) if written else None,
+    }
+
+
+def dataset_path(data_dir: str, size: int, seed: int) -> str:
+    path = os.path.join(data_dir, f"dataset-{size}-{seed}.json")
+    if not os.path.exists(path):
+        print(f"Генерация data.json на {size} пользователей и чеков...")
+        generate_data(path, users=size, receipts=size, seed=seed, history=min(size, 1000))
+    return path
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(backend_name: str, sizes: list[int], operations: list[str], repeat: int, data_dir: str, seed: int) -> list[dict]:
+    backend = importlib.import_module(backend_name)
+    workdir = tempfile.mkdtemp(prefix="otryad-storage-")
+    work_file = os.path.join(workdir, "data.json")
+    original_file = backend.DATA_FILE
+    backend.DATA_FILE = work_file
+    results = []
+    try:
+        for size in sizes:
+            source = dataset_path(data_dir, size, seed)
+            # Владельца обновляемого чека ищем один раз, вне замеров
+            with open(source, "r", encoding="utf-8") as f:
+                receipts = json.load(f)["receipts"]
+            receipt_owner = next(r["user_id"] for r in receipts if r["file_id"] == f"file-{size // 2}")
+            del receipts
+
+            def reset():
+                shutil.copyfile(source, work_file)
+                # Файл подменён в обход save_data — кеш хранилища (если он есть) сбрасываем
+                if hasattr(backend, "invalidate_cache"):
+                    backend.invalidate_cache()
+
+            ops = make_operations(backend, size, receipt_owner)
+            for name in operations:
+                result = measure(ops[name], repeat, reset)
+                result.update(operation=name, size=size, file_bytes=os.path.getsize(source))
+                results.append(result)
+                written = result["bytes_written"]
+                print(
+                    f"{name:<22} size={size:<8} median={result['time_ms_median']:9.2f}ms "
+                    f"min={result['time_ms_min']:9.2f}ms peak={result['peak_mem_mb']:8.1f}MB "
+                    f"written={written if written is not None else 'n/a'}"
+                )
+    finally:
+        backend.DATA_FILE = original_file
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old['label']} ({old['backend']}) -> {new['label']} ({new['backend']})")
+    index = {(r["operation"], r["size"]): r for r in old["results"]}
+    for r in new["results"]:
+        base = index.get((r["operation"], r["size"]))
+        if not base:
+            continue
+        ratio = r["time_ms_median"] / base["time_ms_median"] if base["time_ms_median"] else float("inf")
+        mem_ratio = r["peak_mem_mb"] / base["peak_mem_mb"] if base["peak_mem_mb"] else float("inf")
+        print(
+            f"{r['operation']:<22} size={r['size']:<8} time {base['time_ms_median']:9.2f} -> {r['time_ms_median']:9.2f}ms "
+            f"(x{ratio:.2f})  peak {base['peak_mem_mb']:7.1f} -> {r['peak_mem_mb']:7.1f}MB (x{mem_ratio:.2f})"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк операций хранилища")
+    parser.add_argument("--backend", default="utils.storage", help="модуль хранилища с API utils.storage")
+    parser.add_argument("--label", default=None, help="метка версии (по умолчанию — git-ревизия)")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="размеры наборов данных через запятую")
+    parser.add_argument("--operations", default=",".join(OPERATIONS), help="операции через запятую")
+    parser.add_argument("--repeat", type=int, default=5, help="повторов каждой операции")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "otryad-bench-data"),
+                        help="где хранить сгенерированные data.json между запусками")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="куда записать результаты")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="сравнить два файла результатов")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    sizes = [int(x) for x in args.sizes.split(",") if x]
+    operations = [x for x in args.operations.split(",") if x]
+    unknown = set(operations) - set(OPERATIONS)
+    if unknown:
+        parser.error(f"неизвестные операции: {', '.join(sorted(unknown))}")
+
+    results = run(args.backend, sizes, operations, args.repeat, args.data_dir, args.seed)
+    report = {
+        "label": args.label or git_revision(),
+        "backend": args.backend,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.getcwd())
+    sys.exit(main())
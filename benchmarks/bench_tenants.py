@@ -0,0 +1,80 @@
+# Память на каждого дополнительного арендатора в многоарендном режиме.
+# Арендаторы добавляются по одному в один процесс с общими сессией и Dispatcher;
+# каждый получает /start и нажатие кнопки, чтобы прогрелись его хранилище, реестр,
+# раскладка меню и FSM. Для сравнения печатается RSS процесса с одним ботом —
+# столько стоил бы каждый отдельный процесс.
+#
+# Запуск из корня проекта:
+#   python -m benchmarks.bench_tenants --tenants 50 --data-users 1000
+import argparse
+import asyncio
+import contextlib
+import gc
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import tracemalloc
+
+from aiogram import Bot
+
+from benchmarks.load_test import ENTRY_BUTTON, build_dispatcher, generate_data, max_rss_mb, message_update
+
+
+async def touch(dp, bot: Bot, user_id: int):
+    for text in ("/start", ENTRY_BUTTON):
+        await dp.feed_update(bot, message_update(user_id, text))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Память на арендатора в одном процессе")
+    parser.add_argument("--tenants", type=int, default=20)
+    parser.add_argument("--data-users", type=int, default=1000, help="размер users в data.json каждого арендатора")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    project_dir = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="otryad-tenants-")
+    sys.path.insert(0, project_dir)
+    os.chdir(workdir)
+    try:
+        from utils import tenants
+
+        dp, bot = build_dispatcher()
+        dp.update.outer_middleware(tenants.tenant_context)
+        deltas = []
+        single_rss = None
+        tracemalloc.start()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for index in range(args.tenants):
+                directory = os.path.join("tenants", f"t{index}")
+                os.makedirs(directory)
+                generate_data(os.path.join(directory, "data.json"), args.data_users, args.data_users // 10, args.seed)
+                gc.collect()
+                before = tracemalloc.get_traced_memory()[0]
+                tenant = tenants.Tenant(f"t{index}", f"{7_000_000 + index}:BENCH", [], directory)
+                tenants.register(tenant, Bot(token=tenant.token, session=bot.session))
+                asyncio.run(touch(dp, tenant.bot, 1_000_001))
+                gc.collect()
+                deltas.append(tracemalloc.get_traced_memory()[0] - before)
+                if index == 0:
+                    single_rss = max_rss_mb()
+        tracemalloc.stop()
+    finally:
+        os.chdir(project_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    extra = deltas[1:] or deltas
+    print(f"data_users={args.data_users}, арендаторов: {args.tenants}")
+    print(f"  первый арендатор          {deltas[0] / 1024:10.1f} KB")
+    print(f"  каждый следующий, медиана {statistics.median(extra) / 1024:10.1f} KB")
+    print(f"  каждый следующий, макс.   {max(extra) / 1024:10.1f} KB")
+    if single_rss is not None:
+        print(f"  RSS процесса с одним ботом {single_rss:9.1f} MB (цена отдельного процесса)")
+        print(f"  RSS со всеми арендаторами  {max_rss_mb():9.1f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
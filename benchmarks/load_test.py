@@ -0,0 +1,341 @@
+# Нагрузочный тест: прогоняет синтетические апдейты через Dispatcher без сети.
+#
+# Запуск из корня проекта:
+#   python -m benchmarks.load_test --users 100,1000 --data-users 1000,100000 --json results.json
+#   python -m benchmarks.load_test --baseline results.json --max-regression 20
+import argparse
+import asyncio
+import contextlib
+import datetime
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, AsyncGenerator, Optional
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ENTRY_BUTTON = "ВХОД В ОТРЯД СВОБОДЫ🗽"
+BENCH_BUTTONS = {
+    ENTRY_BUTTON: {"messages": [{"type": "text", "content": "<b>Вступление</b>\n\nРеквизиты для оплаты"}], "active": True},
+    "Что это?": {"messages": [{"type": "text", "content": "<i>Описание</i> отряда"}], "active": True},
+    "Тех.Поддержка": {"messages": [{"type": "text", "content": "<b>Поддержка</b>: @support"}], "active": True},
+}
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+class MockedSession(BaseSession):
+    # Сессия без сети: отвечает на методы API заглушками нужного типа
+    def __init__(self):
+        super().__init__()
+        self.requests = 0
+
+    async def close(self):
+        pass
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[TelegramType], timeout: Optional[int] = None) -> TelegramType:
+        self.requests += 1
+        returning = getattr(method, "__returning__", None)
+        if returning is types.Message:
+            chat_id = getattr(method, "chat_id", 0) or 0
+            return types.Message(
+                message_id=next(_message_ids),
+                date=datetime.datetime.now(),
+                chat=types.Chat(id=int(chat_id), type="private"),
+            )
+        return True
+
+    async def stream_content(self, url: str, headers: Optional[dict[str, Any]] = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+
+def make_user(user_id: int) -> types.User:
+    return types.User(id=user_id, is_bot=False, first_name=f"user{user_id}")
+
+
+def make_message(user_id: int, text: str = None, photo_id: str = None) -> types.Message:
+    kwargs = {}
+    if text is not None:
+        kwargs["text"] = text
+    if photo_id is not None:
+        kwargs["photo"] = [types.PhotoSize(file_id=photo_id, file_unique_id=f"u{photo_id}", width=800, height=600)]
+    return types.Message(
+        message_id=next(_message_ids),
+        date=datetime.datetime.now(),
+        chat=types.Chat(id=user_id, type="private"),
+        from_user=make_user(user_id),
+        **kwargs
+    )
+
+
+def message_update(user_id: int, text: str = None, photo_id: str = None) -> types.Update:
+    return types.Update(update_id=next(_update_ids), message=make_message(user_id, text, photo_id))
+
+
+def callback_update(user_id: int, data: str) -> types.Update:
+    return types.Update(
+        update_id=next(_update_ids),
+        callback_query=types.CallbackQuery(
+            id=str(next(_update_ids)),
+            from_user=make_user(user_id),
+            chat_instance=str(user_id),
+            data=data,
+            message=make_message(user_id, text="..."),
+        ),
+    )
+
+
+# Сценарии: последовательность апдейтов одного пользователя
+def user_scenario(user_id: int, rnd: random.Random) -> list[tuple[str, types.Update]]:
+    other = [name for name in BENCH_BUTTONS if name != ENTRY_BUTTON]
+    return [
+        ("start", message_update(user_id, "/start")),
+        ("button", message_update(user_id, rnd.choice(other))),
+        ("button", message_update(user_id, ENTRY_BUTTON)),
+        ("callback", callback_update(user_id, "send_receipt")),
+        ("receipt", message_update(user_id, photo_id=f"photo-{user_id}-{rnd.randrange(1 << 30)}")),
+        ("unknown", message_update(user_id, "привет")),
+    ]
+
+
+def admin_scenario(admin_id: int) -> list[tuple[str, types.Update]]:
+    return [
+        ("admin", message_update(admin_id, "/admin")),
+        ("admin", message_update(admin_id, "🔍 Проверка чеков")),
+        ("admin", message_update(admin_id, "❌ Отменить")),
+        ("admin", message_update(admin_id, "✏️ Редактирование кнопок")),
+        ("admin", message_update(admin_id, "❌ Отменить")),
+    ]
+
+
+def build_workload(users: int, admin_ids: list[int], seed: int = 0) -> list[list[tuple[str, types.Update]]]:
+    rnd = random.Random(seed)
+    scenarios = [user_scenario(10_000_000 + i, rnd) for i in range(users)]
+    # Админские сценарии подмешиваются примерно раз на 50 пользователей
+    for i in range(max(1, users // 50)):
+        scenarios.append(admin_scenario(admin_ids[i % len(admin_ids)]))
+    rnd.shuffle(scenarios)
+    return scenarios
+
+
+def generate_data(path: str, users: int, receipts: int, seed: int = 0, history: int = 0):
+    rnd = random.Random(seed)
+    now = time.time()
+    data = {
+        "buttons": BENCH_BUTTONS,
+        "users": {str(1_000_000 + i): {"joined": now - rnd.random() * 86400 * 365} for i in range(users)},
+        "receipts": [
+            {
+                "user_id": 1_000_000 + rnd.randrange(max(users, 1)),
+                "file_id": f"file-{i}",
+                "type": "photo",
+                "status": rnd.choice(("pending", "approved", "rejected")),
+                "timestamp": now - rnd.random() * 86400 * 30,
+            }
+            for i in range(receipts)
+        ],
+        "receipt_history": {
+            str(1_000_000 + i): [now - rnd.random() * 14400 for _ in range(3)]
+            for i in range(min(history, users))
+        },
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def max_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+def build_dispatcher(with_scheduler: bool = False, rate: float = None, with_ordering: bool = False) -> tuple[Dispatcher, Bot]:
+    # Хендлеры не читают data.json при импорте — кнопки берутся из хранилища на каждое сообщение
+    from handlers import admin, user
+
+    session = MockedSession()
+    if with_scheduler:
+        from utils.outgoing import OutgoingMiddleware, OutgoingScheduler
+        session.middleware(OutgoingMiddleware(OutgoingScheduler(rate=rate) if rate else OutgoingScheduler()))
+    bot = Bot(token="42:LOAD-TEST", session=session)
+    dp = Dispatcher()
+    if with_ordering:
+        from utils.ordering import ChatOrderingMiddleware
+        dp.update.outer_middleware(ChatOrderingMiddleware())
+    dp.include_router(admin.router)
+    dp.include_router(user.router)
+    return dp, bot
+
+
+async def run_workload(dp: Dispatcher, bot: Bot, scenarios: list, concurrency: int = 1,
+                       trace_memory: bool = False) -> dict:
+    latencies: dict[str, list[float]] = {}
+    errors = 0
+
+    async def run_scenario(scenario):
+        nonlocal errors
+        for kind, update in scenario:
+            started = time.perf_counter()
+            try:
+                await dp.feed_update(bot, update)
+            except Exception as e:
+                errors += 1
+                print(f"Error in {kind}: {e}", file=sys.__stderr__)
+            latencies.setdefault(kind, []).append(time.perf_counter() - started)
+
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    queue = list(scenarios)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(scenario):
+        async with semaphore:
+            await run_scenario(scenario)
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        await asyncio.gather(*(limited(s) for s in queue))
+    elapsed = time.perf_counter() - started
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+
+    all_latencies = [v for values in latencies.values() for v in values]
+    result = {
+        "updates": len(all_latencies),
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "throughput_ups": len(all_latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(all_latencies, 50) * 1000,
+        "p95_ms": percentile(all_latencies, 95) * 1000,
+        "p99_ms": percentile(all_latencies, 99) * 1000,
+        "max_rss_mb": max_rss_mb(),
+        "tracemalloc_peak_mb": peak,
+        "by_kind": {
+            kind: {
+                "count": len(values),
+                "p50_ms": percentile(values, 50) * 1000,
+                "p95_ms": percentile(values, 95) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+            }
+            for kind, values in sorted(latencies.items())
+        },
+    }
+    return result
+
+
+def compare(results: list[dict], baseline: list[dict], max_regression: float) -> list[str]:
+    problems = []
+    index = {(r["users"], r["data_users"]): r for r in baseline}
+    for r in results:
+        base = index.get((r["users"], r["data_users"]))
+        if not base:
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            old, new = base[key], r[key]
+            if old > 0 and (new - old) / old * 100 > max_regression:
+                problems.append(f"users={r['users']} data_users={r['data_users']}: {key} {old:.2f} -> {new:.2f} ms")
+        old_tp, new_tp = base["throughput_ups"], r["throughput_ups"]
+        if old_tp > 0 and (old_tp - new_tp) / old_tp * 100 > max_regression:
+            problems.append(f"users={r['users']} data_users={r['data_users']}: throughput {old_tp:.1f} -> {new_tp:.1f} upd/s")
+    return problems
+
+
+def print_result(r: dict):
+    rss = f"{r['max_rss_mb']:.1f}" if r["max_rss_mb"] is not None else "n/a"
+    print(
+        f"users={r['users']:<7} data_users={r['data_users']:<8} updates={r['updates']:<7} "
+        f"p50={r['p50_ms']:.2f}ms p95={r['p95_ms']:.2f}ms p99={r['p99_ms']:.2f}ms "
+        f"throughput={r['throughput_ups']:.1f} upd/s rss={rss}MB errors={r['errors']}"
+    )
+    for kind, stats in r["by_kind"].items():
+        print(f"    {kind:<9} n={stats['count']:<6} p50={stats['p50_ms']:.2f} p95={stats['p95_ms']:.2f} p99={stats['p99_ms']:.2f}")
+
+
+def parse_sizes(value: str) -> list[int]:
+    return [int(x) for x in value.split(",") if x]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест хендлеров бота")
+    parser.add_argument("--users", type=parse_sizes, default=[100], help="число виртуальных пользователей, через запятую")
+    parser.add_argument("--data-users", type=parse_sizes, default=[1000], help="размер users в data.json, через запятую")
+    parser.add_argument("--data-receipts", type=int, default=None, help="число чеков в data.json (по умолчанию = data-users / 10)")
+    parser.add_argument("--concurrency", type=int, default=1, help="сколько сценариев выполняется одновременно")
+    parser.add_argument("--with-scheduler", action="store_true", help="подключить планировщик исходящих сообщений")
+    parser.add_argument("--rate", type=float, default=None, help="лимит планировщика, сообщений в секунду")
+    parser.add_argument("--with-ordering", action="store_true", help="подключить упорядочивание апдейтов по чатам")
+    parser.add_argument("--trace-memory", action="store_true", help="измерять пик памяти через tracemalloc")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="куда записать результаты")
+    parser.add_argument("--baseline", help="файл с прошлыми результатами для сравнения")
+    parser.add_argument("--max-regression", type=float, default=20.0, help="допустимая деградация, %%")
+    args = parser.parse_args(argv)
+
+    from config import ADMINS
+
+    project_dir = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="otryad-load-")
+    sys.path.insert(0, project_dir)
+    os.chdir(workdir)
+    results = []
+    try:
+        generate_data("data.json", args.data_users[0], 0, args.seed)
+        dp, bot = build_dispatcher(args.with_scheduler, args.rate, args.with_ordering)
+        for data_users in args.data_users:
+            for users in args.users:
+                receipts = args.data_receipts if args.data_receipts is not None else data_users // 10
+                generate_data("data.json", data_users, receipts, args.seed)
+                scenarios = build_workload(users, ADMINS, args.seed)
+                result = asyncio.run(run_workload(dp, bot, scenarios, args.concurrency, args.trace_memory))
+                result.update(users=users, data_users=data_users, data_receipts=receipts)
+                results.append(result)
+                print_result(result)
+    finally:
+        os.chdir(project_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            problems = compare(results, json.load(f), args.max_regression)
+        if problems:
+            print("❌ Регрессия производительности:")
+            for problem in problems:
+                print(f"  {problem}")
+            return 1
+        print("✅ Регрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,3 +10,28 @@ TOKEN = "8090133594:AAElVyM5K9ndNJ9TnnokO7kFZw6gqZgeS4s"
 ADMINS = [6255992744, 640705464]
 
 validate_config(TOKEN, ADMINS)
+
+# Цикл событий: "auto" — uvloop, если установлен, иначе стандартный asyncio; "uvloop"; "asyncio"
+EVENT_LOOP = "auto"
+# Отладочный режим asyncio: предупреждения о незавершённых корутинах и медленных колбэках
+LOOP_DEBUG = False
+# В отладочном режиме колбэк дольше этого (секунды) попадает в лог
+SLOW_CALLBACK_DURATION = 0.1
+
+# Локальная проверка здоровья (/health, /ready); None — не запускать HTTP-сервер
+HEALTH_HOST = "127.0.0.1"
+HEALTH_PORT = 8081
+# Зависание цикла событий дольше этого (секунды) печатает стеки
+LAG_THRESHOLD = 1.0
+
+# Остановка: сколько секунд ждать незавершённые апдейты и очередь отправки
+SHUTDOWN_TIMEOUT = 20
+# Отложенная запись data.json: изменения копятся в памяти и пишутся раз в WRITE_BEHIND_INTERVAL секунд
+# и при остановке. Только для запуска одним процессом
+WRITE_BEHIND = False
+WRITE_BEHIND_INTERVAL = 2.0
+
+# Несколько ботов в одном процессе: у каждого свой каталог с data.json и button.json и свои админы,
+# HTTP-сессия и лимит отправок общие. Пустой список — один бот из TOKEN и ADMINS.
+# Пример: [{"name": "club", "token": "123:ABC", "admins": [1, 2], "dir": "tenants/club"}]
+TENANTS = []
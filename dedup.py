@@ -0,0 +1,86 @@
+import json
+import os
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+# Сколько последних update_id помнить. Telegram повторяет апдейт вскоре после первой
+# доставки (ретраи вебхука, переподключение polling), так что окна хватает с запасом.
+DEDUP_WINDOW = 10000
+# Куда сохранять окно между перезапусками; None — только в памяти
+DEDUP_FILE = "update_ids.json"
+
+
+class UpdateDedupMiddleware(BaseMiddleware):
+    # Повторно доставленный апдейт (тот же update_id) пропускается до хендлеров:
+    # второй чек не записывается, админам не уходит второе уведомление.
+    # update_id отмечается в начале обработки, чтобы поймать и дубль, пришедший,
+    # пока первый ещё обрабатывается. Если хендлер упал, отметка снимается —
+    # повторная доставка такого апдейта будет обработана.
+    def __init__(self, window: int = DEDUP_WINDOW, path: Optional[str] = DEDUP_FILE):
+        self.window = window
+        self.path = path
+        # (id бота, update_id) -> None, от старых к новым; update_id у каждого бота свои
+        self._seen: OrderedDict = OrderedDict()
+        self.suppressed = 0
+
+    def _remember(self, key: tuple) -> bool:
+        # False — такой update_id уже был
+        if key in self._seen:
+            return False
+        self._seen[key] = None
+        if len(self._seen) > self.window:
+            self._seen.popitem(last=False)
+        return True
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, Update):
+            return await handler(event, data)
+        key = (data["bot"].id, event.update_id)
+        if not self._remember(key):
+            self.suppressed += 1
+            return None
+        try:
+            return await handler(event, data)
+        except Exception:
+            self._seen.pop(key, None)
+            raise
+
+    def load(self) -> int:
+        # Возвращает число восстановленных update_id
+        if self.path is None or not os.path.exists(self.path):
+            return 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                ids = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error loading {self.path}: {e}")
+            return 0
+        for entry in ids[-self.window:]:
+            # Записи без id бота (файл первой версии) пропускаем
+            if isinstance(entry, list) and len(entry) == 2:
+                self._remember((int(entry[0]), int(entry[1])))
+        return len(self._seen)
+
+    def save(self):
+        if self.path is None:
+            return
+        tmp_file = self.path + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(list(self._seen), f)
+        os.replace(tmp_file, self.path)
+
+    def get_metrics(self) -> dict:
+        return {"tracked": len(self._seen), "suppressed": self.suppressed}
+
+
+# Общий экземпляр: подключается в main.py после shutdown_coordinator, метрики читает админ-панель.
+# Апдейт, отброшенный при остановке, не попадает в окно и после рестарта будет обработан
+update_dedup = UpdateDedupMiddleware()
@@ -0,0 +1,174 @@
+import copy
+import itertools
+
+from utils.storage import get_buttons, get_buttons_with_version, publish_buttons
+from utils.subscriptions import button_plan
+from utils.tenants import TenantLocal
+
+# Черновики кнопок: каждый админ правит свою копию в памяти, пользователи видят
+# опубликованную версию, пока черновик не опубликуют целиком. У каждого арендатора свои.
+# Черновик заводится при первой правке: просмотр читает опубликованные кнопки
+# и не привязывает админа к текущей версии.
+_drafts = TenantLocal(dict)  # admin_id -> черновик
+# Опубликованные кнопки для админов без черновика, с тем же индексом названий
+_published = TenantLocal(dict)
+# Ревизии: revision меняется при любом изменении кнопок или сообщений,
+# names_revision — только когда меняется сам список кнопок.
+# Счётчик общий, чтобы новый черновик после публикации не повторил номер старого
+_revisions = itertools.count(1)
+
+
+def _published_view() -> dict:
+    buttons, version = get_buttons_with_version()
+    view = _published.instance()
+    key = (version, len(buttons))
+    if view.get("key") != key:
+        revision = next(_revisions)
+        view.update(key=key, base_version=version, names=None, revision=revision, names_revision=revision)
+    view["buttons"] = buttons
+    return view
+
+
+def _view(admin_id: int) -> dict:
+    # Черновик админа или, если его нет, опубликованные кнопки — только для чтения
+    return _drafts.instance().get(admin_id) or _published_view()
+
+
+def _draft(admin_id: int) -> dict:
+    drafts = _drafts.instance()
+    draft = drafts.get(admin_id)
+    if draft is None:
+        view = _published_view()
+        draft = drafts[admin_id] = {
+            "base_version": view["base_version"],
+            "buttons": copy.deepcopy(view["buttons"]),
+            "renamed": {},  # новое название -> опубликованное
+            "names": None,  # порядок кнопок для постраничного списка, строится по требованию
+            "revision": view["revision"],
+            "names_revision": view["names_revision"],
+        }
+    return draft
+
+
+def _changed(draft: dict, names: bool = False):
+    draft["revision"] = next(_revisions)
+    if names:
+        draft["names"] = None
+        draft["names_revision"] = draft["revision"]
+
+
+def get_draft_buttons(admin_id: int) -> dict:
+    # Без черновика это опубликованные кнопки: менять их можно только через функции ниже
+    return _view(admin_id)["buttons"]
+
+
+def button_names(admin_id: int) -> list[str]:
+    # Индекс кнопок: страница списка — срез, без обхода всех кнопок
+    view = _view(admin_id)
+    if view["names"] is None:
+        view["names"] = list(view["buttons"])
+    return view["names"]
+
+
+def revision(admin_id: int) -> int:
+    return _view(admin_id)["revision"]
+
+
+def names_revision(admin_id: int) -> int:
+    return _view(admin_id)["names_revision"]
+
+
+def has_draft(admin_id: int) -> bool:
+    return admin_id in _drafts.instance()
+
+
+def discard(admin_id: int):
+    _drafts.instance().pop(admin_id, None)
+
+
+def create_button(admin_id: int, name: str):
+    draft = _draft(admin_id)
+    draft["buttons"][name] = {"messages": [], "active": True}
+    _changed(draft, names=True)
+
+
+def rename_button(admin_id: int, old_name: str, new_name: str):
+    draft = _draft(admin_id)
+    info = draft["buttons"].get(old_name)
+    plan = button_plan(old_name, info) if info is not None else None
+    if plan:
+        # План старой кнопки мог определяться только её названием — закрепляем его явно
+        info["plan"] = plan
+    # Пересобираем словарь, чтобы кнопка осталась на своём месте
+    draft["buttons"] = {new_name if name == old_name else name: info for name, info in draft["buttons"].items()}
+    draft["renamed"][new_name] = draft["renamed"].pop(old_name, old_name)
+    _changed(draft, names=True)
+
+
+def add_message(admin_id: int, name: str, message_data: dict):
+    draft = _draft(admin_id)
+    buttons = draft["buttons"]
+    created = name not in buttons
+    if created:
+        buttons[name] = {"messages": [], "active": True}
+    buttons[name]["messages"].append(message_data)
+    _changed(draft, names=created)
+
+
+def remove_message(admin_id: int, name: str, index: int) -> bool:
+    draft = _draft(admin_id)
+    messages = draft["buttons"].get(name, {}).get("messages", [])
+    if 0 <= index < len(messages):
+        messages.pop(index)
+        _changed(draft)
+        return True
+    return False
+
+
+def set_active(admin_id: int, name: str, active: bool):
+    current = _view(admin_id)["buttons"].get(name)
+    if current is None or current.get("active", True) == active:
+        return
+    draft = _draft(admin_id)
+    draft["buttons"][name]["active"] = active
+    _changed(draft)
+
+
+def describe_changes(admin_id: int) -> list[str]:
+    draft = _drafts.instance().get(admin_id)
+    if draft is None:
+        return []
+    live = get_buttons()
+    changes = []
+    renamed_from = set()
+    for new_name, old_name in draft["renamed"].items():
+        if new_name != old_name and new_name in draft["buttons"]:
+            changes.append(f"✏️ «{old_name}» → «{new_name}»")
+            renamed_from.add(old_name)
+    for name, info in draft["buttons"].items():
+        source = draft["renamed"].get(name, name)
+        old = live.get(source)
+        if old is None:
+            changes.append(f"➕ Новая кнопка «{name}» ({len(info['messages'])} сообщ.)")
+            continue
+        if old.get("active", True) != info.get("active", True):
+            changes.append(f"{'✅ Включена' if info.get('active', True) else '🚫 Отключена'} «{name}»")
+        if old.get("messages", []) != info["messages"]:
+            changes.append(f"🧾 «{name}»: сообщений {len(old.get('messages', []))} → {len(info['messages'])}")
+    for name in live:
+        if name not in draft["buttons"] and name not in renamed_from:
+            changes.append(f"🗑️ Удалена «{name}»")
+    return changes
+
+
+def publish(admin_id: int):
+    # Возвращает номер опубликованной версии; None — кнопки успели опубликовать заново,
+    # черновик устарел
+    drafts = _drafts.instance()
+    draft = drafts.get(admin_id)
+    if draft is None:
+        return None
+    version = publish_buttons(draft["buttons"], admin_id, draft["base_version"])
+    if version is not None:
+        del drafts[admin_id]
+    return version
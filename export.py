@@ -0,0 +1,112 @@
+import csv
+import datetime
+import json
+import os
+import tempfile
+from collections.abc import Mapping
+from typing import Iterator, Optional
+
+from utils.snapshot import Snapshot
+from utils.storage import snapshot
+
+KINDS = ("users", "receipts", "history")
+FORMATS = ("csv", "jsonl")
+# Сколько строк копим перед записью в файл
+CHUNK_ROWS = 1000
+
+COLUMNS = {
+    "users": ("user_id", "joined", "is_admin_panel_enabled"),
+    "receipts": ("user_id", "file_id", "file_unique_id", "type", "plan", "status", "timestamp", "decided", "duplicate"),
+    "history": ("user_id", "timestamp"),
+}
+
+
+def _iso(timestamp) -> str:
+    if not timestamp:
+        return ""
+    return datetime.datetime.fromtimestamp(timestamp).isoformat(timespec="seconds")
+
+
+def _in_range(timestamp, since: Optional[float], until: Optional[float]) -> bool:
+    if since is None and until is None:
+        return True
+    if not timestamp:
+        return False
+    return (since is None or timestamp >= since) and (until is None or timestamp < until)
+
+
+def _rows(snap: Snapshot, kind: str, since: Optional[float], until: Optional[float],
+          status: Optional[str]) -> Iterator[dict]:
+    # Строки отдаются по одной из одного снимка: выгрузка согласована и не держит блокировок
+    if kind == "users":
+        for user_id, info in snap.get("users", {}).items():
+            joined = info.get("joined") if isinstance(info, Mapping) else None
+            if _in_range(joined, since, until):
+                yield {
+                    "user_id": user_id,
+                    "joined": _iso(joined),
+                    "is_admin_panel_enabled": bool(info.get("is_admin_panel_enabled", False)),
+                }
+    elif kind == "receipts":
+        for receipt in snap.get("receipts", []):
+            if status and receipt.get("status") != status:
+                continue
+            if _in_range(receipt.get("timestamp"), since, until):
+                yield {
+                    "user_id": receipt.get("user_id"),
+                    "file_id": receipt.get("file_id"),
+                    "file_unique_id": receipt.get("file_unique_id", ""),
+                    "type": receipt.get("type"),
+                    "plan": receipt.get("plan", ""),
+                    "status": receipt.get("status"),
+                    "timestamp": _iso(receipt.get("timestamp")),
+                    "decided": _iso(receipt.get("decided")),
+                    "duplicate": bool(receipt.get("duplicate_of")),
+                }
+    elif kind == "history":
+        for user_id, timestamps in snap.get("receipt_history", {}).items():
+            for timestamp in timestamps:
+                if _in_range(timestamp, since, until):
+                    yield {"user_id": user_id, "timestamp": _iso(timestamp)}
+    else:
+        raise ValueError(f"Unknown export kind: {kind}")
+
+
+def write_export(kind: str, fmt: str, since: Optional[float] = None, until: Optional[float] = None,
+                 status: Optional[str] = None) -> tuple[str, int]:
+    # Выполняется в рабочем потоке: пишет выгрузку во временный файл порциями
+    # и возвращает путь к нему и число строк
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    snap = snapshot()
+    fd, path = tempfile.mkstemp(prefix=f"export-{kind}-", suffix=f".{fmt}")
+    count = 0
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            if fmt == "csv":
+                writer = csv.DictWriter(f, fieldnames=COLUMNS[kind])
+                writer.writeheader()
+            chunk = []
+            for row in _rows(snap, kind, since, until, status):
+                chunk.append(row)
+                if len(chunk) >= CHUNK_ROWS:
+                    count += _flush(f, writer if fmt == "csv" else None, chunk)
+            count += _flush(f, writer if fmt == "csv" else None, chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, count
+
+
+def _flush(f, writer, chunk: list) -> int:
+    written = len(chunk)
+    if writer is not None:
+        writer.writerows(chunk)
+    else:
+        f.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in chunk)
+    chunk.clear()
+    return written
+
+
+def parse_date(value: str) -> float:
+    return datetime.datetime.strptime(value, "%Y-%m-%d").timestamp()
@@ -0,0 +1,248 @@
+import html
+import re
+from functools import lru_cache
+
+# Разметка сообщений Telegram -> HTML для parse_mode="HTML".
+# Смещения entities Telegram считает в UTF-16 (эмодзи занимают две позиции),
+# поэтому сначала строим карту UTF-16 смещение -> индекс в строке Python.
+
+# Простые теги без атрибутов
+SIMPLE_TAGS = {
+    "bold": "b",
+    "italic": "i",
+    "underline": "u",
+    "strikethrough": "s",
+    "code": "code",
+    "blockquote": "blockquote",
+}
+# Эти entities Telegram распознаёт в тексте сам — выводим их как обычный текст
+PLAIN_TYPES = {"mention", "hashtag", "cashtag", "bot_command", "url", "email", "phone_number"}
+# Внутри кода Telegram не разрешает другую разметку
+CODE_TYPES = {"code", "pre"}
+
+
+def _field(entity, name: str):
+    # Entities приходят как MessageEntity или как словари (из очереди шардов)
+    if isinstance(entity, dict):
+        return entity.get(name)
+    return getattr(entity, name, None)
+
+
+def utf16_index_map(content: str) -> list[int]:
+    # index_map[o] — индекс символа в строке для UTF-16 смещения o (длина карты — UTF-16 длина + 1)
+    index_map = []
+    for index, char in enumerate(content):
+        index_map.append(index)
+        if ord(char) > 0xFFFF:
+            # Вторая половина суррогатной пары указывает на тот же символ
+            index_map.append(index)
+    index_map.append(len(content))
+    return index_map
+
+
+def _tags(entity) -> tuple[str, str]:
+    kind = _field(entity, "type")
+    if kind in SIMPLE_TAGS:
+        tag = SIMPLE_TAGS[kind]
+        return f"<{tag}>", f"</{tag}>"
+    if kind == "spoiler":
+        return '<span class="tg-spoiler">', "</span>"
+    if kind == "pre":
+        language = _field(entity, "language")
+        if language:
+            return f'<pre><code class="language-{html.escape(language)}">', "</code></pre>"
+        return "<pre>", "</pre>"
+    if kind == "text_link":
+        return f'<a href="{html.escape(_field(entity, "url") or "")}">', "</a>"
+    if kind == "text_mention":
+        user = _field(entity, "user")
+        user_id = _field(user, "id") if user is not None else None
+        if user_id is None:
+            return "", ""
+        return f'<a href="tg://user?id={user_id}">', "</a>"
+    if kind == "custom_emoji":
+        return f'<tg-emoji emoji-id="{html.escape(str(_field(entity, "custom_emoji_id") or ""))}">', "</tg-emoji>"
+    if kind == "expandable_blockquote":
+        return "<blockquote expandable>", "</blockquote>"
+    return "", ""
+
+
+def _spans(content: str, entities: list) -> list[tuple[int, int, str, str]]:
+    # Переводим entities в (начало, конец, открывающий, закрывающий) в индексах строки,
+    # отсортированные так, что внешние идут раньше вложенных
+    index_map = utf16_index_map(content)
+    limit = len(index_map) - 1
+    spans = []
+    for order, entity in enumerate(entities):
+        if _field(entity, "type") in PLAIN_TYPES:
+            continue
+        offset = _field(entity, "offset") or 0
+        length = _field(entity, "length") or 0
+        if length <= 0 or offset >= limit:
+            continue
+        start = index_map[max(offset, 0)]
+        end = index_map[min(offset + length, limit)]
+        if end <= start:
+            continue
+        tag_open, tag_close = _tags(entity)
+        if not tag_open:
+            continue
+        spans.append((start, -end, order, tag_open, tag_close, _field(entity, "type") in CODE_TYPES))
+    spans.sort()
+
+    result = []
+    code_end = -1
+    for start, neg_end, _, tag_open, tag_close, is_code in spans:
+        if start < code_end:
+            continue
+        if is_code:
+            code_end = -neg_end
+        result.append((start, -neg_end, tag_open, tag_close))
+    return result
+
+
+def entities_to_html(content: str, entities: list = None) -> str:
+    if not content or not content.strip():
+        return ""
+    if not entities:
+        return html.escape(content)
+
+    spans = _spans(content, entities)
+    result = []
+    stack = []  # открытые теги: (конец, закрывающий, открывающий)
+    last_pos = 0
+    closes = sorted({end for _, end, _, _ in spans})
+    close_index = 0
+    span_index = 0
+
+    while span_index < len(spans) or stack:
+        next_open = spans[span_index][0] if span_index < len(spans) else None
+        next_close = closes[close_index] if close_index < len(closes) else None
+        # При равной позиции сначала закрываем, потом открываем
+        if next_close is not None and (next_open is None or next_close <= next_open):
+            pos = next_close
+            close_index += 1
+            if pos > last_pos:
+                result.append(html.escape(content[last_pos:pos]))
+                last_pos = pos
+            # Самый глубокий из заканчивающихся здесь тегов определяет, сколько снимать со стека;
+            # пересекающиеся теги выше него закрываем и открываем заново
+            lowest = next((i for i, item in enumerate(stack) if item[0] <= pos), None)
+            if lowest is None:
+                continue
+            reopen = []
+            while len(stack) > lowest:
+                end, tag_close, tag_open = stack.pop()
+                result.append(tag_close)
+                if end > pos:
+                    reopen.append((end, tag_close, tag_open))
+            for item in reversed(reopen):
+                result.append(item[2])
+                stack.append(item)
+        else:
+            start, end, tag_open, tag_close = spans[span_index]
+            span_index += 1
+            if start > last_pos:
+                result.append(html.escape(content[last_pos:start]))
+                last_pos = start
+            result.append(tag_open)
+            stack.append((end, tag_close, tag_open))
+
+    if last_pos < len(content):
+        result.append(html.escape(content[last_pos:]))
+    return "".join(result)
+
+
+# Очистка готового HTML (тексты и подписи сообщений кнопок) перед отправкой.
+# Один проход по тексту регулярным выражением, результат собирается в список:
+# время линейно от длины, а очень длинный ввод обрезается до MAX_HTML_LENGTH.
+MAX_HTML_LENGTH = 65536
+# Глубже этого теги не открываем
+MAX_TAG_DEPTH = 32
+
+# Разрешённые Telegram теги и их атрибуты
+ALLOWED_TAGS = {
+    "b": (), "i": (), "u": (), "s": (), "code": ("class",), "pre": (),
+    "a": ("href",), "span": ("class",), "blockquote": ("expandable",),
+    "tg-spoiler": (), "tg-emoji": ("emoji-id",),
+}
+# Атрибуты обязаны начинаться с пробела, поэтому неудачная попытка разбора
+# доходит только до следующего "<" или ">" и не откатывается квадратично
+TAG_RE = re.compile(r"<(/?)([a-zA-Z][a-zA-Z-]*)(\s[^<>]*)?>")
+ATTR_RE = re.compile(r"""([a-zA-Z-]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'<>=]+)))?""")
+ANY_TAG_RE = re.compile(r"<[^<>]*>")
+
+
+def _attributes(tag: str, raw: str) -> str:
+    allowed = ALLOWED_TAGS[tag]
+    if not raw or not allowed:
+        return ""
+    result = []
+    for match in ATTR_RE.finditer(raw):
+        name = match.group(1).lower()
+        if name not in allowed:
+            continue
+        value = next((value for value in match.group(2, 3, 4) if value is not None), None)
+        if value is None:
+            result.append(f" {name}")
+        else:
+            # Значение могло прийти уже экранированным — не экранируем дважды
+            result.append(f' {name}="{html.escape(html.unescape(value))}"')
+    return "".join(result)
+
+
+def sanitize_html(text: str, limit: int = MAX_HTML_LENGTH) -> str:
+    if not text:
+        return text
+    if limit is not None and len(text) > limit:
+        print(f"sanitize_html: input truncated from {len(text)} to {limit} characters")
+        text = text[:limit]
+
+    try:
+        result = []
+        open_tags = []
+        last_pos = 0
+        for match in TAG_RE.finditer(text):
+            if match.start() > last_pos:
+                result.append(html.escape(text[last_pos:match.start()]))
+            last_pos = match.end()
+            tag = match.group(2).lower()
+            if tag not in ALLOWED_TAGS:
+                continue  # Недопустимый тег выбрасываем, содержимое оставляем
+            if match.group(1):
+                # Закрывающий тег оставляем, только если он закрывает последний открытый
+                if open_tags and open_tags[-1] == tag:
+                    open_tags.pop()
+                    result.append(f"</{tag}>")
+            elif len(open_tags) < MAX_TAG_DEPTH:
+                open_tags.append(tag)
+                result.append(f"<{tag}{_attributes(tag, match.group(3))}>")
+        if last_pos < len(text):
+            result.append(html.escape(text[last_pos:]))
+        # Закрываем все незакрытые теги
+        while open_tags:
+            result.append(f"</{open_tags.pop()}>")
+        return "".join(result)
+    except Exception as e:
+        print(f"Ошибка очистки HTML: {e}")
+        # В крайнем случае удаляем все теги
+        return html.escape(ANY_TAG_RE.sub("", text))
+
+
+# Содержимое кнопок меняется редко, а отправляется на каждое нажатие:
+# очищенный текст кешируется по исходной строке и прогревается при старте
+SANITIZE_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=SANITIZE_CACHE_SIZE)
+def sanitize_html_cached(text: str) -> str:
+    return sanitize_html(text)
+
+
+def html_preview(text: str, limit: int) -> str:
+    # Короткий безопасный фрагмент готового HTML для списков: теги убираем,
+    # обрезаем по видимому тексту, чтобы не разрезать тег пополам
+    plain = html.unescape(ANY_TAG_RE.sub("", text or "")).strip()
+    if len(plain) > limit:
+        plain = plain[:limit - 1].rstrip() + "…"
+    return html.escape(plain)
@@ -0,0 +1,163 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Optional
+
+from config import HEALTH_HOST, HEALTH_PORT, LAG_THRESHOLD
+from utils import storage, tenants
+
+# Проверка здоровья для локального мониторинга:
+#   GET /health — процесс жив, задержка цикла событий и состояние хранилища
+#   GET /ready  — 200, когда хранилище прочитано и сессия Telegram поднята, иначе 503
+# Задержку цикла меряет задача-пульс: насколько позже заказанного она просыпается.
+# Отдельный поток следит за пульсом и, если цикл завис дольше LAG_THRESHOLD, печатает
+# стек потока цикла (то, что его держит) и стеки задач — пока зависание ещё идёт.
+# Время холодного старта считается от started (main.py отмечает его до импортов):
+# готовность Telegram и первый обработанный апдейт.
+
+HEARTBEAT_INTERVAL = 0.5
+LAG_SAMPLES = 120
+
+
+class LoopWatchdog:
+    def __init__(self, interval: float = HEARTBEAT_INTERVAL, threshold: float = LAG_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.telegram_ready = False
+        self.stalls = 0
+        self._lags = deque(maxlen=LAG_SAMPLES)
+        self._max_lag = 0.0
+        self._last_beat = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._runner = None
+        self.started = time.monotonic()
+        self.ready_after: Optional[float] = None
+        self.first_update_after: Optional[float] = None
+
+    async def _beat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self._lags.append(lag)
+            if lag > self._max_lag:
+                self._max_lag = lag
+            self._last_beat = now
+
+    def _watch(self):
+        dumped = False
+        while not self._stop.wait(self.interval):
+            stalled = time.monotonic() - self._last_beat - self.interval
+            if stalled <= self.threshold:
+                dumped = False
+                continue
+            if not dumped:
+                # Одно зависание — один дамп
+                dumped = True
+                self.stalls += 1
+                self._dump(stalled)
+
+    def _dump(self, stalled: float):
+        lines = [f"⚠️ Цикл событий не отвечает {stalled:.1f} с. Стек потока цикла:"]
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is not None:
+            lines += [line.rstrip() for line in traceback.format_stack(frame)]
+        try:
+            tasks = list(asyncio.all_tasks(self._loop))
+        except RuntimeError:
+            tasks = []
+        for task in tasks:
+            stack = task.get_stack(limit=5)
+            if stack:
+                lines.append(f"Задача {task.get_name()}:")
+                lines += [f"  {frame.f_code.co_filename}:{frame.f_lineno} {frame.f_code.co_name}" for frame in stack]
+        print("\n".join(lines))
+
+    def get_metrics(self) -> dict:
+        lags = sorted(self._lags)
+        return {
+            "last_lag": self._lags[-1] if self._lags else 0.0,
+            "p95_lag": lags[int(len(lags) * 0.95) - 1] if lags else 0.0,
+            "max_lag": self._max_lag,
+            "heartbeat_age": time.monotonic() - self._last_beat,
+            "stalls": self.stalls,
+        }
+
+    def mark_ready(self):
+        self.telegram_ready = True
+        if self.ready_after is None:
+            self.ready_after = time.monotonic() - self.started
+            print(f"✅ Бот готов через {self.ready_after:.2f} с после запуска")
+
+    async def first_update_probe(self, handler, event, data):
+        # Внешний middleware апдейтов: засекает первый апдейт после старта
+        if self.first_update_after is None:
+            self.first_update_after = time.monotonic() - self.started
+            print(f"✅ Первый апдейт через {self.first_update_after:.2f} с после запуска")
+        return await handler(event, data)
+
+    def get_startup(self) -> dict:
+        return {"ready_after": self.ready_after, "first_update_after": self.first_update_after}
+
+    def report(self) -> tuple[bool, dict]:
+        # У каждого арендатора своё хранилище: процесс готов, когда прочитаны все
+        stores = {}
+        for tenant in tenants.registered() or [None]:
+            with tenants.use(tenant):
+                stores[tenant.name if tenant is not None else None] = storage.get_health()
+        ready = self.telegram_ready and all(store["last_load_age"] is not None for store in stores.values())
+        store = stores[None] if None in stores else stores
+        return ready, {
+            "status": "ready" if ready else "starting",
+            "telegram": self.telegram_ready,
+            "loop": self.get_metrics(),
+            "startup": self.get_startup(),
+            "storage": store,
+        }
+
+    async def start(self, host: str = HEALTH_HOST, port: Optional[int] = HEALTH_PORT, started: Optional[float] = None):
+        if started is not None:
+            self.started = started
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._heartbeat = asyncio.create_task(self._beat())
+        self._stop.clear()
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        if port is None:
+            return
+        from aiohttp import web
+
+        async def health(request: web.Request) -> web.Response:
+            return web.json_response({"alive": True, **self.report()[1]})
+
+        async def ready(request: web.Request) -> web.Response:
+            is_ready, body = self.report()
+            return web.json_response(body, status=200 if is_ready else 503)
+
+        app = web.Application()
+        app.router.add_get("/health", health)
+        app.router.add_get("/ready", ready)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        print(f"✅ Проверка здоровья: http://{host}:{port}/health, /ready")
+
+    async def stop(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+# Общий экземпляр: запускается в main.py, метрики читает админ-панель
+watchdog = LoopWatchdog()
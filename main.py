@@ -1,21 +1,115 @@
+import time
+# Отсчёт холодного старта — до импорта aiogram и хендлеров
+STARTED = time.monotonic()
+import asyncio
 from aiogram import Bot, Dispatcher
-from config import TOKEN
+from aiogram.client.session.aiohttp import AiohttpSession
+from config import TOKEN, TENANTS, WRITE_BEHIND, WRITE_BEHIND_INTERVAL
 from handlers import user
 from handlers import admin
+from utils.outgoing import OutgoingMiddleware, scheduler
+from utils.ordering import update_ordering
+from utils.throttling import update_throttling
+from utils.dedup import update_dedup
+from utils import runtime, tenants
+from utils.health import watchdog
+from utils import storage
+from utils.storage import rebuild_receipt_index
+from utils.shutdown import shutdown_coordinator, flush_periodically
+from utils.scheduled import broadcast_scheduler
+from utils.subscriptions import subscription_watcher
 
-bot = Bot(token=TOKEN)
+# Одна HTTP-сессия (пул соединений) на всех ботов процесса
+session = AiohttpSession()
+# Все исходящие запросы проходят через общий планировщик с приоритетами
+session.middleware(OutgoingMiddleware(scheduler))
+bot = Bot(token=TOKEN, session=session)
 dp = Dispatcher()
+# В многоарендном режиме апдейт обрабатывается от имени арендатора своего бота
+dp.update.outer_middleware(tenants.tenant_context)
+# При остановке новые апдейты отбрасываются, принятые дорабатываются
+dp.update.outer_middleware(shutdown_coordinator)
+# Повторно доставленные апдейты (тот же update_id) не доходят до хендлеров
+dp.update.outer_middleware(update_dedup)
+# Время до первого апдейта для /metrics и /health
+dp.update.outer_middleware(watchdog.first_update_probe)
+# Флуд от одного пользователя отсекается до очереди чата и хендлеров
+dp.update.outer_middleware(update_throttling)
+# Апдейты разных чатов обрабатываются параллельно, одного чата — по порядку
+dp.update.outer_middleware(update_ordering)
 
 dp.include_router(admin.router)
 dp.include_router(user.router)
 
+@dp.startup()
+async def on_startup(bots: list[Bot]):
+    # Сессия Telegram поднята, когда getMe прошёл у всех ботов; результат кешируется и для polling
+    for polled_bot in bots:
+        await polled_bot.me()
+    watchdog.mark_ready()
+
+@dp.shutdown()
+async def on_shutdown():
+    watchdog.telegram_ready = False
+
+def warm_up():
+    # Индекс повторных чеков догоняется и при первом чеке, здесь он строится заранее
+    print(f"✅ Индекс чеков: {rebuild_receipt_index()} уникальных файлов")
+    user.warm_caches()
+
 async def main():
+    # Пульс цикла событий и /health, /ready на локальном порту
+    await watchdog.start(started=STARTED)
+    # Окно update_id с прошлого запуска: ретраи, пришедшие после рестарта, тоже отсекаются
+    print(f"✅ Окно апдейтов: {update_dedup.load()} update_id")
+    # Без config.TENANTS арендатор один — None: текущий каталог, TOKEN и ADMINS
+    tenant_list = tenants.from_config(TENANTS)
+    for tenant in tenant_list:
+        tenants.register(tenant, Bot(token=tenant.token, session=session))
+    contexts = tenant_list or [None]
+    bots = [tenant.bot for tenant in tenant_list] or [bot]
+    background = []
+    for tenant in contexts:
+        # Задачи, созданные внутри use(), работают от имени арендатора
+        with tenants.use(tenant):
+            tenant_bot = tenant.bot if tenant is not None else bot
+            # Снимок хранилища, индекс чеков, раскладка меню и очищенный HTML кнопок готовятся в фоне:
+            # polling стартует сразу, не дожидаясь разбора data.json
+            background.append(asyncio.create_task(asyncio.to_thread(warm_up)))
+            background.append(asyncio.create_task(user.watch_buttons_menu()))
+            # Отложенные рассылки: таймер на ближайшую задачу из data.json
+            broadcast_scheduler.start(tenant_bot)
+            # Напоминания о продлении и окончании подписок
+            subscription_watcher.start(tenant_bot)
+            if WRITE_BEHIND:
+                storage.enable_write_behind()
+                background.append(asyncio.create_task(flush_periodically(WRITE_BEHIND_INTERVAL)))
+    if tenant_list:
+        print(f"✅ Арендаторы: {', '.join(tenant.name for tenant in tenant_list)}")
     try:
-        await dp.start_polling(bot)
+        # SIGTERM/SIGINT останавливают polling; сессию закрываем сами, когда всё отправлено
+        await dp.start_polling(*bots, handle_as_tasks=True, close_bot_session=False)
     except Exception as e:
         print(f"Error starting bot: {e}")
         raise
+    finally:
+        shutdown_coordinator.begin()
+        for tenant in contexts:
+            with tenants.use(tenant):
+                broadcast_scheduler.stop()
+                subscription_watcher.stop()
+        await shutdown_coordinator.drain()
+        for task in background:
+            task.cancel()
+        # Последняя запись data.json — после того, как все хендлеры закончили
+        for tenant in contexts:
+            with tenants.use(tenant):
+                if await asyncio.to_thread(storage.flush):
+                    print(f"✅ Хранилище сохранено: {tenants.path(storage.DATA_FILE)}")
+        update_dedup.save()
+        await watchdog.stop()
+        await session.close()
 
 if __name__ == "__main__":
-    import asyncio
-    asyncio.run(main())
\ No newline at end of file
+    # uvloop, если установлен; режим и отладка цикла настраиваются в config.py
+    runtime.run(main())
\ No newline at end of file
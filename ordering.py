@@ -0,0 +1,101 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+# Сколько апдейтов обрабатывается одновременно
+MAX_CONCURRENT_UPDATES = 32
+# Сколько последних ожиданий хранить для перцентилей
+WAIT_SAMPLES = 1000
+
+
+class ChatOrderingMiddleware(BaseMiddleware):
+    # Апдейты разных чатов идут параллельно, апдейты одного чата — строго по очереди.
+    # asyncio.Lock отдаёт блокировку ожидающим в порядке FIFO, поэтому порядок
+    # прихода апдейтов внутри чата сохраняется (важно для переходов FSM).
+    def __init__(self, max_concurrency: int = MAX_CONCURRENT_UPDATES):
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._chains: dict[int, list] = {}  # chat_id -> [lock, число апдейтов в цепочке]
+        self.queued = 0
+        self.active = 0
+        self.processed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+
+    @staticmethod
+    def _chat_key(data: Dict[str, Any]):
+        chat = data.get("event_chat")
+        if chat is not None:
+            return chat.id
+        user = data.get("event_from_user")
+        return user.id if user is not None else None
+
+    def _record_wait(self, waited: float):
+        self._wait_total += waited
+        if waited > self._wait_max:
+            self._wait_max = waited
+        self._waits.append(waited)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        enqueued = time.monotonic()
+        self.queued += 1
+        waiting = True
+        key = self._chat_key(data)
+        chain = None
+        if key is not None:
+            chain = self._chains.get(key)
+            if chain is None:
+                chain = self._chains[key] = [asyncio.Lock(), 0]
+            chain[1] += 1
+        try:
+            if chain is not None:
+                await chain[0].acquire()
+            try:
+                async with self._semaphore:
+                    waiting = False
+                    self.queued -= 1
+                    self._record_wait(time.monotonic() - enqueued)
+                    self.active += 1
+                    try:
+                        return await handler(event, data)
+                    finally:
+                        self.active -= 1
+                        self.processed += 1
+            finally:
+                if chain is not None:
+                    chain[0].release()
+        finally:
+            # Апдейт отменили, пока он ждал своей очереди
+            if waiting:
+                self.queued -= 1
+            if chain is not None:
+                chain[1] -= 1
+                if chain[1] == 0:
+                    del self._chains[key]
+
+    def get_metrics(self) -> dict:
+        waits = sorted(self._waits)
+        return {
+            "queue_depth": self.queued,
+            "active": self.active,
+            "max_concurrency": self.max_concurrency,
+            "chats_in_flight": len(self._chains),
+            "processed": self.processed,
+            "avg_wait": self._wait_total / self.processed if self.processed else 0.0,
+            "p95_wait": waits[int(len(waits) * 0.95) - 1] if waits else 0.0,
+            "max_wait": self._wait_max,
+        }
+
+
+# Общий экземпляр: подключается в main.py, метрики читает админ-панель
+update_ordering = ChatOrderingMiddleware()
@@ -0,0 +1,163 @@
+import asyncio
+import contextvars
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+# Классы приоритета исходящих сообщений
+INTERACTIVE = 0
+BULK = 1
+
+# Общий лимит Telegram ~30 сообщений в секунду, оставляем запас
+GLOBAL_RATE = 25
+BURST = 5
+# Сколько токенов массовая рассылка всегда оставляет для ответов пользователям
+INTERACTIVE_RESERVE = 2
+# Ответ пользователю должен уйти не позже чем через столько секунд
+INTERACTIVE_LATENCY_BOUND = 1.0
+
+# Методы API, которые расходуют лимит на отправку
+THROTTLED_PREFIXES = ("Send", "Copy", "Forward", "Edit")
+
+_priority = contextvars.ContextVar("send_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def bulk_priority():
+    # Все отправки внутри блока идут как массовые (рассылки, напоминания)
+    token = _priority.set(BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class OutgoingScheduler:
+    def __init__(self, rate: float = GLOBAL_RATE, burst: int = BURST,
+                 reserve: int = INTERACTIVE_RESERVE, latency_bound: float = INTERACTIVE_LATENCY_BOUND):
+        if burst <= reserve:
+            raise ValueError("burst must be greater than reserve")
+        self.rate = rate
+        self.burst = burst
+        self.reserve = reserve
+        self.latency_bound = latency_bound
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._queues = (deque(), deque())
+        self._wakeup = None
+        self._worker = None
+        self._sent = [0, 0]
+        self._wait_total = [0.0, 0.0]
+        self._wait_max = [0.0, 0.0]
+        self._late = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _can_take(self, priority: int) -> bool:
+        # Массовым отправкам нельзя трогать резерв интерактивных
+        need = 1 if priority == INTERACTIVE else 1 + self.reserve
+        return self._tokens >= need
+
+    def _record(self, priority: int, waited: float):
+        self._sent[priority] += 1
+        self._wait_total[priority] += waited
+        if waited > self._wait_max[priority]:
+            self._wait_max[priority] = waited
+        if priority == INTERACTIVE and waited > self.latency_bound:
+            self._late += 1
+            print(f"Warning: interactive send waited {waited:.2f}s (bound {self.latency_bound}s)")
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._worker.get_loop() is not loop:
+            self._wakeup = asyncio.Event()
+            self._worker = loop.create_task(self._run())
+
+    async def acquire(self, priority: int = None):
+        if priority is None:
+            priority = _priority.get()
+        self._ensure_worker()
+        self._refill()
+        # Быстрый путь: очередь пуста и токен есть
+        if not self._queues[INTERACTIVE] and (priority == INTERACTIVE or not self._queues[BULK]) \
+                and self._can_take(priority):
+            self._tokens -= 1
+            self._record(priority, 0.0)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._queues[priority].append((future, time.monotonic()))
+        self._wakeup.set()
+        await future
+
+    def _next_priority(self):
+        # Сначала разбираем интерактивную очередь, потом массовую
+        for priority in (INTERACTIVE, BULK):
+            queue = self._queues[priority]
+            while queue and queue[0][0].done():
+                queue.popleft()  # Отменённые ожидания
+            if queue:
+                return priority
+        return None
+
+    async def _run(self):
+        while True:
+            priority = self._next_priority()
+            if priority is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            self._refill()
+            if not self._can_take(priority):
+                need = 1 if priority == INTERACTIVE else 1 + self.reserve
+                self._wakeup.clear()
+                try:
+                    # Просыпаемся раньше, если пришло интерактивное сообщение
+                    await asyncio.wait_for(self._wakeup.wait(), (need - self._tokens) / self.rate)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            future, enqueued = self._queues[priority].popleft()
+            self._tokens -= 1
+            self._record(priority, time.monotonic() - enqueued)
+            future.set_result(None)
+
+    def queue_depth(self) -> dict:
+        return {"interactive": len(self._queues[INTERACTIVE]), "bulk": len(self._queues[BULK])}
+
+    def get_stats(self) -> dict:
+        stats = {"queue": self.queue_depth(), "late_interactive": self._late}
+        for name, priority in (("interactive", INTERACTIVE), ("bulk", BULK)):
+            sent = self._sent[priority]
+            stats[name] = {
+                "sent": sent,
+                "avg_wait": self._wait_total[priority] / sent if sent else 0.0,
+                "max_wait": self._wait_max[priority],
+            }
+        return stats
+
+
+class OutgoingMiddleware(BaseRequestMiddleware):
+    def __init__(self, scheduler: OutgoingScheduler):
+        self.scheduler = scheduler
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if type(method).__name__.startswith(THROTTLED_PREFIXES):
+            await self.scheduler.acquire()
+        return await make_request(bot, method)
+
+
+# Общий планировщик для всех отправок бота
+scheduler = OutgoingScheduler()
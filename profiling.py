@@ -0,0 +1,144 @@
+import asyncio
+import cProfile
+import html
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.types import FSInputFile
+
+# Профилирование по команде админа. Пока сеанс не запущен, ничего не установлено:
+# ни профайлера, ни потока-сэмплера, поэтому накладных расходов нет.
+#   sample   — поток раз в SAMPLE_INTERVAL снимает стеки всех потоков (цикл событий
+#              и потоки asyncio.to_thread с хранилищем); сырой файл — свёрнутые стеки
+#              для flamegraph.pl / speedscope
+#   cprofile — детерминированный cProfile потока цикла событий; сырой файл — .prof для pstats/snakeviz
+MODES = ("sample", "cprofile")
+DEFAULT_DURATION = 30
+MAX_DURATION = 300
+SAMPLE_INTERVAL = 0.005
+MAX_STACK_DEPTH = 64
+TOP_N = 15
+
+_session: Optional[asyncio.Task] = None
+
+
+def is_running() -> bool:
+    return _session is not None and not _session.done()
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _sample(stop: threading.Event, interval: float, stacks: Counter):
+    own = threading.get_ident()
+    names = {}
+    while not stop.wait(interval):
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if thread_id not in names:
+                names.update((thread.ident, thread.name) for thread in threading.enumerate())
+            stack.append(names.get(thread_id, str(thread_id)))
+            stacks[";".join(reversed(stack))] += 1
+
+
+def _sample_summary(stacks: Counter, top: int) -> str:
+    total = sum(stacks.values())
+    if not total:
+        return "Нет сэмплов."
+    own = Counter()
+    inclusive = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")[1:]
+        if frames:
+            own[frames[-1]] += count
+        for name in set(frames):
+            inclusive[name] += count
+    lines = [f"Сэмплов: {total}", "", "Собственное время:"]
+    lines += [f"{count / total:6.1%}  {name}" for name, count in own.most_common(top)]
+    lines += ["", "Вместе с вызываемыми:"]
+    lines += [f"{count / total:6.1%}  {name}" for name, count in inclusive.most_common(top)]
+    return "\n".join(lines)
+
+
+def _cprofile_summary(path: str, top: int) -> str:
+    stats = pstats.Stats(path)
+    rows = []
+    for (filename, line, name), (_, calls, own_time, total_time, _) in stats.stats.items():
+        rows.append((own_time, total_time, calls, f"{name} ({os.path.basename(filename)}:{line})"))
+    lines = [f"Всего: {stats.total_tt:.2f} с", "", "Собственное время, с / вместе с вызываемыми, с / вызовов:"]
+    for own_time, total_time, calls, name in sorted(rows, reverse=True)[:top]:
+        lines.append(f"{own_time:7.3f} {total_time:7.3f} {calls:7}  {name}")
+    return "\n".join(lines)
+
+
+async def profile(mode: str, duration: float, top: int = TOP_N) -> tuple[str, str]:
+    # Возвращает текст сводки и путь к сырому файлу профиля
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            profiler.disable()
+        fd, path = tempfile.mkstemp(prefix="profile-", suffix=".prof")
+        os.close(fd)
+        profiler.dump_stats(path)
+        return await asyncio.to_thread(_cprofile_summary, path, top), path
+
+    stacks = Counter()
+    stop = threading.Event()
+    sampler = threading.Thread(target=_sample, args=(stop, SAMPLE_INTERVAL, stacks), name="profile-sampler", daemon=True)
+    sampler.start()
+    try:
+        await asyncio.sleep(duration)
+    finally:
+        stop.set()
+        await asyncio.to_thread(sampler.join)
+    fd, path = tempfile.mkstemp(prefix="profile-", suffix=".folded")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.writelines(f"{stack} {count}\n" for stack, count in stacks.items())
+    return _sample_summary(stacks, top), path
+
+
+async def _run_session(bot: Bot, chat_id: int, mode: str, duration: float):
+    started = time.time()
+    path = None
+    try:
+        summary, path = await profile(mode, duration)
+        # Длинные имена обрезаем, чтобы сводка поместилась в одно сообщение
+        summary = "\n".join(line[:110] for line in summary.splitlines())[:3500]
+        await bot.send_message(
+            chat_id,
+            f"🔬 <b>Профиль ({mode}, {time.time() - started:.0f} с)</b>\n<pre>{html.escape(summary)}</pre>",
+            parse_mode="HTML"
+        )
+        await bot.send_document(chat_id, FSInputFile(path, filename=os.path.basename(path)))
+    except Exception as e:
+        print(f"Ошибка профилирования: {e}")
+        await bot.send_message(chat_id, f"❌ Ошибка профилирования: {e}")
+    finally:
+        if path:
+            os.remove(path)
+
+
+def start_session(bot: Bot, chat_id: int, mode: str, duration: float) -> bool:
+    # False — уже идёт другой сеанс
+    global _session
+    if is_running():
+        return False
+    _session = asyncio.create_task(_run_session(bot, chat_id, mode, min(duration, MAX_DURATION)))
+    return True
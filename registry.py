@@ -0,0 +1,138 @@
+import bisect
+import json
+import struct
+import sys
+from array import array
+from typing import Iterator, Optional
+
+# Компактный реестр пользователей: id и время входа лежат в типизированных массивах,
+# отсортированных по id (8 + 8 байт на пользователя вместо строкового ключа и словаря).
+# Редкие дополнительные поля (например, is_admin_panel_enabled) хранятся отдельно
+# только для тех, у кого они есть.
+
+MAGIC = b"URG1"
+# Заголовок: магия, число пользователей, длина блока дополнительных полей
+HEADER = struct.Struct("<4sQQ")
+
+
+class UserRecord:
+    __slots__ = ("user_id", "joined", "extra")
+
+    def __init__(self, user_id: int, joined: float, extra: Optional[dict] = None):
+        self.user_id = user_id
+        self.joined = joined
+        self.extra = extra or {}
+
+    def __repr__(self):
+        return f"UserRecord(user_id={self.user_id}, joined={self.joined}, extra={self.extra})"
+
+
+class UserRegistry:
+    def __init__(self):
+        self._ids = array("q")
+        self._joined = array("d")
+        self._extra: dict[int, dict] = {}
+
+    @classmethod
+    def from_users(cls, users: dict) -> "UserRegistry":
+        # users — раздел "users" из data.json: {"123": {"joined": ...}, ...}
+        registry = cls()
+        rows = []
+        for key, info in users.items():
+            user_id = int(key)
+            info = info if isinstance(info, dict) else {}
+            rows.append((user_id, float(info.get("joined") or 0.0)))
+            extra = {name: value for name, value in info.items() if name != "joined"}
+            if extra:
+                registry._extra[user_id] = extra
+        rows.sort()
+        registry._ids = array("q", (row[0] for row in rows))
+        registry._joined = array("d", (row[1] for row in rows))
+        return registry
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._ids)
+
+    def ids(self) -> array:
+        # Копия массива id: по ней можно долго идти (рассылка), пока реестр пополняется
+        return self._ids[:]
+
+    def _position(self, user_id: int) -> int:
+        index = bisect.bisect_left(self._ids, user_id)
+        if index < len(self._ids) and self._ids[index] == user_id:
+            return index
+        return -1
+
+    def __contains__(self, user_id: int) -> bool:
+        return self._position(int(user_id)) >= 0
+
+    def add(self, user_id: int, joined: float, **extra) -> bool:
+        # Как и запись в data.json, повторное добавление заменяет данные пользователя.
+        # True — пользователь новый
+        user_id = int(user_id)
+        index = bisect.bisect_left(self._ids, user_id)
+        is_new = not (index < len(self._ids) and self._ids[index] == user_id)
+        if is_new:
+            self._ids.insert(index, user_id)
+            self._joined.insert(index, joined)
+        else:
+            self._joined[index] = joined
+        self._extra.pop(user_id, None)
+        if extra:
+            self._extra[user_id] = extra
+        return is_new
+
+    def get(self, user_id: int) -> Optional[UserRecord]:
+        user_id = int(user_id)
+        index = self._position(user_id)
+        if index < 0:
+            return None
+        return UserRecord(user_id, self._joined[index], self._extra.get(user_id))
+
+    def ids_between(self, low: int, high: int) -> array:
+        # id из полуинтервала [low, high) — срез отсортированного массива
+        return self._ids[bisect.bisect_left(self._ids, low):bisect.bisect_left(self._ids, high)]
+
+    def joined_between(self, since: float, until: float) -> Iterator[int]:
+        for user_id, joined in zip(self._ids, self._joined):
+            if since <= joined < until:
+                yield user_id
+
+    def to_bytes(self) -> bytes:
+        ids, joined = self._ids, self._joined
+        if sys.byteorder != "little":
+            ids, joined = array("q", ids), array("d", joined)
+            ids.byteswap()
+            joined.byteswap()
+        extra = json.dumps({str(key): value for key, value in self._extra.items()}, ensure_ascii=False).encode("utf-8")
+        return HEADER.pack(MAGIC, len(ids), len(extra)) + ids.tobytes() + joined.tobytes() + extra
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> "UserRegistry":
+        magic, count, extra_size = HEADER.unpack_from(blob)
+        if magic != MAGIC:
+            raise ValueError("not a user registry dump")
+        registry = cls()
+        offset = HEADER.size
+        registry._ids.frombytes(blob[offset:offset + count * 8])
+        offset += count * 8
+        registry._joined.frombytes(blob[offset:offset + count * 8])
+        offset += count * 8
+        if sys.byteorder != "little":
+            registry._ids.byteswap()
+            registry._joined.byteswap()
+        extra = json.loads(blob[offset:offset + extra_size].decode("utf-8")) if extra_size else {}
+        registry._extra = {int(key): value for key, value in extra.items()}
+        return registry
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path: str) -> "UserRegistry":
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
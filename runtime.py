@@ -0,0 +1,32 @@
+import asyncio
+
+from config import EVENT_LOOP, LOOP_DEBUG, SLOW_CALLBACK_DURATION
+
+LOOP_MODES = ("auto", "uvloop", "asyncio")
+
+
+def loop_factory(mode: str = EVENT_LOOP):
+    # Возвращает (фабрику цикла или None для стандартного, название режима)
+    if mode not in LOOP_MODES:
+        raise ValueError(f"Unknown event loop mode: {mode}")
+    if mode != "asyncio":
+        try:
+            import uvloop
+        except ImportError:
+            if mode == "uvloop":
+                raise RuntimeError("uvloop is not installed")
+        else:
+            return uvloop.new_event_loop, f"uvloop {uvloop.__version__}"
+    return None, "asyncio"
+
+
+def run(main, mode: str = EVENT_LOOP, debug: bool = LOOP_DEBUG, slow_callback: float = SLOW_CALLBACK_DURATION,
+        quiet: bool = False):
+    # Замена asyncio.run с выбором цикла событий по настройкам из config.py
+    factory, name = loop_factory(mode)
+    with asyncio.Runner(debug=debug, loop_factory=factory) as runner:
+        runner.get_loop().slow_callback_duration = slow_callback
+        if not quiet:
+            debug_text = f"вкл, медленные колбэки от {slow_callback * 1000:.0f} мс" if debug else "выкл"
+            print(f"✅ Цикл событий: {name}, debug: {debug_text}")
+        return runner.run(main)
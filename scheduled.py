@@ -0,0 +1,214 @@
+import asyncio
+import datetime
+import heapq
+import re
+import time
+from typing import Optional
+
+from aiogram import Bot
+
+from utils import storage, tenants
+from utils.sharding import notify_leader, portable_broadcast
+from utils.shutdown import JobInterrupted, shutdown_coordinator
+
+# Отложенные и повторяющиеся рассылки. Задачи хранятся в data.json
+# (раздел "scheduled_broadcasts"), в памяти — куча по сроку и один таймер
+# на ближайший срок: пока ничего не наступило, планировщик не просыпается.
+
+# Таймер дольше часа не ставим: после перевода системных часов срок пересчитается
+MAX_TIMER_DELAY = 3600
+# Повтор задаётся суффиксом: 30m, 12h, 1d, 1w
+INTERVAL_RE = re.compile(r"^(\d+)([mhdw])$")
+INTERVAL_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+DATE_FORMATS = ("%d.%m.%Y %H:%M", "%Y-%m-%d %H:%M")
+
+
+def parse_schedule(text: str, now: float = None) -> tuple[float, int]:
+    # "25.12.2025 18:00", "18:00" (ближайшее такое время), к любому можно добавить повтор: "18:00 1d"
+    now = now if now is not None else time.time()
+    parts = text.split()
+    interval = 0
+    if len(parts) > 1:
+        match = INTERVAL_RE.match(parts[-1].lower())
+        if match:
+            interval = int(match.group(1)) * INTERVAL_UNITS[match.group(2)]
+            if interval <= 0:
+                raise ValueError("interval must be positive")
+            parts = parts[:-1]
+    value = " ".join(parts)
+    if len(parts) == 1:
+        moment = datetime.datetime.strptime(value, "%H:%M").time()
+        today = datetime.datetime.fromtimestamp(now)
+        due = datetime.datetime.combine(today.date(), moment).timestamp()
+        if due <= now:
+            due = datetime.datetime.combine(today.date() + datetime.timedelta(days=1), moment).timestamp()
+        return due, interval
+    for date_format in DATE_FORMATS:
+        try:
+            due = datetime.datetime.strptime(value, date_format).timestamp()
+        except ValueError:
+            continue
+        if due <= now and not interval:
+            raise ValueError("time is in the past")
+        return due, interval
+    raise ValueError(f"unknown date format: {value}")
+
+
+def format_interval(seconds: int) -> str:
+    for unit, size in (("нед.", INTERVAL_UNITS["w"]), ("дн.", INTERVAL_UNITS["d"]), ("ч", INTERVAL_UNITS["h"])):
+        if seconds % size == 0:
+            return f"{seconds // size} {unit}"
+    return f"{seconds // 60} мин"
+
+
+class BroadcastScheduler:
+    def __init__(self):
+        self._heap = []  # (срок, id); отменённые задачи удаляются лениво
+        self._jobs: dict[int, dict] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._bot: Optional[Bot] = None
+        self._tasks = set()
+        # Сработавшие задачи, чей новый срок (или удаление) ещё не записан в файл
+        self._inflight: set[int] = set()
+
+    @property
+    def running(self) -> bool:
+        return self._bot is not None
+
+    def start(self, bot: Bot):
+        # Вызывается в процессе, который выполняет рассылки: обычный запуск или ведущий процесс шардов
+        self._bot = bot
+        self.reload()
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._bot = None
+
+    def reload(self):
+        jobs = {job["id"]: job for job in storage.get_scheduled_jobs()}
+        for job_id in self._inflight:
+            # В файле у сработавшей задачи ещё прежний срок — верим памяти,
+            # иначе разовая рассылка встала бы в очередь второй раз
+            jobs.pop(job_id, None)
+            if job_id in self._jobs:
+                jobs[job_id] = self._jobs[job_id]
+        self._jobs = jobs
+        self._heap = [(job["due"], job_id) for job_id, job in self._jobs.items()]
+        heapq.heapify(self._heap)
+        self._arm()
+
+    def jobs(self) -> list[dict]:
+        if self.running:
+            jobs = self._jobs.values()
+        else:
+            jobs = storage.get_scheduled_jobs()
+        return sorted(jobs, key=lambda job: job["due"])
+
+    async def schedule(self, chat_id: int, broadcast_data: dict, due: float, interval: int = 0, resume_after: int = None) -> int:
+        job = {
+            "due": due,
+            "interval": interval,
+            "chat_id": chat_id,
+            "broadcast": portable_broadcast(broadcast_data),
+            "created": time.time(),
+        }
+        if resume_after is not None:
+            job["resume_after"] = resume_after
+        job["id"] = await asyncio.to_thread(storage.add_scheduled_job, job)
+        self._changed(job)
+        return job["id"]
+
+    async def cancel(self, job_id: int) -> bool:
+        removed = await asyncio.to_thread(storage.remove_scheduled_job, job_id)
+        if removed:
+            self._changed(None, job_id)
+        return removed
+
+    def _changed(self, job: Optional[dict], removed_id: int = None):
+        if not self.running:
+            # Планировщик живёт в другом процессе (ведущем) — просим его перечитать задачи
+            notify_leader("schedule")
+            return
+        if removed_id is not None:
+            self._jobs.pop(removed_id, None)
+        if job is not None:
+            self._jobs[job["id"]] = job
+            heapq.heappush(self._heap, (job["due"], job["id"]))
+        self._arm()
+
+    def _arm(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # Снимаем с вершины отменённые и перенесённые задачи
+        while self._heap and self._jobs.get(self._heap[0][1], {}).get("due") != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap or not self.running:
+            return
+        delay = min(max(0.0, self._heap[0][0] - time.time()), MAX_TIMER_DELAY)
+        self._timer = asyncio.get_running_loop().call_later(delay, self._fire)
+
+    def _fire(self):
+        self._timer = None
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            due, job_id = heapq.heappop(self._heap)
+            job = self._jobs.get(job_id)
+            if job is None or job["due"] != due:
+                continue
+            if job.get("interval"):
+                # Пропущенные за время простоя повторы не догоняем, берём следующий срок в будущем
+                missed = int((now - due) // job["interval"]) + 1
+                job = {**job, "due": due + missed * job["interval"]}
+                self._jobs[job_id] = job
+                heapq.heappush(self._heap, (job["due"], job_id))
+            else:
+                del self._jobs[job_id]
+            self._inflight.add(job_id)
+            task = asyncio.create_task(self._run(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            shutdown_coordinator.track(task)
+        self._arm()
+
+    async def _run(self, job: dict):
+        bot = self._bot
+        # Сначала фиксируем в файле следующий срок (или удаление): после перезапуска
+        # разовая рассылка не уйдёт второй раз
+        try:
+            if job.get("interval"):
+                await asyncio.to_thread(storage.update_scheduled_job, job["id"], job["due"])
+            else:
+                await asyncio.to_thread(storage.remove_scheduled_job, job["id"])
+        finally:
+            self._inflight.discard(job["id"])
+        try:
+            success = await run_resumable(bot, job["chat_id"], job["broadcast"], job.get("resume_after"))
+            if success is None:
+                return
+            await bot.send_message(job["chat_id"], f"✅ Запланированная рассылка #{job['id']} завершена. Отправлено: {success} сообщений.")
+        except Exception as e:
+            print(f"Scheduled broadcast {job['id']} failed: {e}")
+
+
+# У каждого арендатора свой планировщик; в обычном запуске он один
+broadcast_scheduler = tenants.TenantLocal(BroadcastScheduler)
+
+
+async def run_resumable(bot: Bot, chat_id: int, broadcast_data: dict, resume_after: int = None) -> Optional[int]:
+    # Число отправленных сообщений или None, если рассылку прервала остановка бота:
+    # остаток сохраняется разовой задачей на «сейчас» и уйдёт сразу после перезапуска
+    from handlers.admin import run_broadcast
+    try:
+        return await run_broadcast(bot, broadcast_data, resume_after)
+    except JobInterrupted as e:
+        job_id = await broadcast_scheduler.schedule(chat_id, broadcast_data, time.time(), resume_after=e.resume_after)
+        print(f"Broadcast interrupted after {e.done} messages, saved as job {job_id}")
+        await bot.send_message(
+            chat_id,
+            f"⏸ Рассылка прервана остановкой бота, отправлено: {e.done} сообщений. "
+            f"Остальным она уйдёт после перезапуска (задача #{job_id})."
+        )
+        return None
@@ -0,0 +1,265 @@
+# Шардированный режим: фронт-процесс получает апдейты (polling или webhook)
+# и раздаёт их N воркерам по user_id. Все апдейты одного пользователя попадают
+# в один воркер, поэтому его FSM-состояние живёт в одном процессе.
+# Фронт — ведущий процесс: только он выполняет рассылки, в том числе отложенные.
+#
+# Запуск из корня проекта:
+#   python -m utils.sharding --workers 4
+#   python -m utils.sharding --workers 4 --webhook-url https://example.org/webhook --port 8080
+import argparse
+import asyncio
+import multiprocessing
+import os
+from typing import Optional
+
+from aiogram import Bot, types
+
+from utils import runtime, storage
+from utils.outgoing import GLOBAL_RATE, OutgoingMiddleware, scheduler
+
+# Очередь к ведущему процессу; задаётся только внутри воркера
+_leader_queue = None
+
+
+def update_owner(raw: dict) -> Optional[int]:
+    # Ищем автора апдейта: from/user у события, иначе чат
+    for key, value in raw.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        for field in ("from", "user"):
+            if isinstance(value.get(field), dict):
+                return value[field].get("id")
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if isinstance(chat, dict):
+            return chat.get("id")
+    return None
+
+
+def shard_for(raw: dict, workers: int) -> int:
+    owner = update_owner(raw)
+    return 0 if owner is None else owner % workers
+
+
+def portable_broadcast(broadcast_data: dict) -> dict:
+    # Entities привязаны к боту процесса-воркера, передаём их как обычные словари.
+    # Повторный вызов (прерванная задача снова уходит в планировщик) ничего не меняет
+    data = dict(broadcast_data)
+    for key in ("entities", "caption_entities"):
+        if data.get(key):
+            data[key] = [entity if isinstance(entity, dict) else entity.model_dump(exclude_none=True) for entity in data[key]]
+    return data
+
+
+def _restore(broadcast_data: dict) -> dict:
+    data = dict(broadcast_data)
+    for key in ("entities", "caption_entities"):
+        if data.get(key):
+            data[key] = [types.MessageEntity(**entity) for entity in data[key]]
+    return data
+
+
+def submit_broadcast(chat_id: int, broadcast_data: dict) -> bool:
+    # True — рассылка передана ведущему процессу; False — выполняйте её на месте
+    if _leader_queue is None:
+        return False
+    _leader_queue.put({"chat_id": chat_id, "broadcast": portable_broadcast(broadcast_data)})
+    return True
+
+
+def notify_leader(reload: str) -> bool:
+    # Отложенные рассылки и напоминания о подписках ведёт ведущий процесс:
+    # просим его перечитать данные ("schedule" или "subscriptions")
+    if _leader_queue is None:
+        return False
+    _leader_queue.put({"reload": reload})
+    return True
+
+
+async def worker_loop(dp, bot: Bot, inbox) -> int:
+    # Каждый апдейт — отдельная задача; порядок внутри чата держит ChatOrderingMiddleware
+    tasks = set()
+    processed = 0
+    while True:
+        raw = await asyncio.to_thread(inbox.get)
+        if raw is None:
+            break
+        task = asyncio.create_task(dp.feed_raw_update(bot, raw))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        processed += 1
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return processed
+
+
+def _worker_main(index: int, workers: int, inbox, leader_queue):
+    global _leader_queue
+    _leader_queue = leader_queue
+    storage.enable_process_lock()
+    # Бюджет отправок делится между воркерами и ведущим процессом
+    scheduler.rate = GLOBAL_RATE / (workers + 1)
+    import main as app
+
+    async def run():
+        menu_watcher = asyncio.create_task(app.user.watch_buttons_menu())
+        try:
+            processed = await worker_loop(app.dp, app.bot, inbox)
+            print(f"Shard {index}: processed {processed} updates")
+        finally:
+            menu_watcher.cancel()
+            await app.bot.session.close()
+
+    try:
+        runtime.run(run(), quiet=True)
+    except KeyboardInterrupt:
+        pass
+
+
+async def _run_leader_broadcast(bot: Bot, job: dict):
+    from utils.scheduled import run_resumable
+    try:
+        success = await run_resumable(bot, job["chat_id"], _restore(job["broadcast"]))
+        if success is None:
+            return
+        await bot.send_message(job["chat_id"], f"✅ Рассылка завершена. Отправлено: {success} сообщений.")
+    except Exception as e:
+        print(f"Leader broadcast failed: {e}")
+
+
+async def _leader_loop(bot: Bot, leader_queue):
+    from utils.scheduled import broadcast_scheduler
+    from utils.subscriptions import subscription_watcher
+    from utils.shutdown import shutdown_coordinator
+    broadcast_scheduler.start(bot)
+    subscription_watcher.start(bot)
+    tasks = set()
+    while True:
+        job = await asyncio.to_thread(leader_queue.get)
+        if job is None:
+            break
+        if job.get("reload") == "schedule":
+            broadcast_scheduler.reload()
+            continue
+        if job.get("reload") == "subscriptions":
+            subscription_watcher.reload()
+            continue
+        task = asyncio.create_task(_run_leader_broadcast(bot, job))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    broadcast_scheduler.stop()
+    subscription_watcher.stop()
+    # Идущие рассылки сохраняют остаток задачами и завершаются
+    shutdown_coordinator.begin()
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _raw(update: types.Update) -> dict:
+    return update.model_dump(mode="json", by_alias=True, exclude_none=True)
+
+
+async def _poll(bot: Bot, inboxes: list):
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30)
+        except Exception as e:
+            print(f"Polling error: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            raw = _raw(update)
+            inboxes[shard_for(raw, len(inboxes))].put(raw)
+            offset = update.update_id + 1
+
+
+async def _serve_webhook(bot: Bot, inboxes: list, url: str, host: str, port: int, secret: Optional[str]):
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        if secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret:
+            return web.Response(status=401)
+        raw = await request.json()
+        inboxes[shard_for(raw, len(inboxes))].put(raw)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(_webhook_path(url), handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    await bot.set_webhook(url, secret_token=secret)
+    print(f"Webhook listening on {host}:{port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def _webhook_path(url: str) -> str:
+    from urllib.parse import urlparse
+    return urlparse(url).path or "/"
+
+
+async def _front(workers: int, inboxes: list, leader_queue, webhook_url: Optional[str],
+                 host: str, port: int, secret: Optional[str]):
+    from config import TOKEN
+
+    scheduler.rate = GLOBAL_RATE / (workers + 1)
+    bot = Bot(token=TOKEN)
+    bot.session.middleware(OutgoingMiddleware(scheduler))
+    leader = asyncio.create_task(_leader_loop(bot, leader_queue))
+    try:
+        if webhook_url:
+            await _serve_webhook(bot, inboxes, webhook_url, host, port, secret)
+        else:
+            await bot.delete_webhook()
+            await _poll(bot, inboxes)
+    finally:
+        # Поток, ждущий очередь, освобождаем сигналом остановки, а не отменой
+        leader_queue.put(None)
+        await asyncio.wait({leader}, timeout=30)
+        await bot.session.close()
+
+
+def run(workers: int, webhook_url: Optional[str] = None, host: str = "127.0.0.1", port: int = 8080,
+        secret: Optional[str] = None):
+    storage.enable_process_lock()
+    ctx = multiprocessing.get_context("spawn")
+    inboxes = [ctx.Queue() for _ in range(workers)]
+    leader_queue = ctx.Queue()
+    processes = [
+        ctx.Process(target=_worker_main, args=(i, workers, inboxes[i], leader_queue), name=f"shard-{i}")
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    print(f"✅ Запущено воркеров: {workers}")
+    try:
+        runtime.run(_front(workers, inboxes, leader_queue, webhook_url, host, port, secret))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for inbox in inboxes:
+            inbox.put(None)
+        for process in processes:
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Шардированный запуск бота")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--webhook-url", help="публичный URL вебхука; без него используется polling")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--secret", help="секрет X-Telegram-Bot-Api-Secret-Token")
+    args = parser.parse_args(argv)
+    run(args.workers, args.webhook_url, args.host, args.port, args.secret)
+
+
+if __name__ == "__main__":
+    # Запускаем через импортированный модуль, чтобы воркеры и хендлеры видели одно и то же состояние
+    from utils import sharding
+    sharding.main()
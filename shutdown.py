@@ -0,0 +1,107 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from config import SHUTDOWN_TIMEOUT
+from utils import storage
+from utils.outgoing import scheduler
+
+# Порядок остановки (main.py):
+#   1. begin(): новые апдейты отбрасываются, рассылки на следующем получателе
+#      сохраняют остаток отложенной задачей (JobInterrupted) и завершаются
+#   2. drain(): ждём хендлеры, фоновые задачи и очередь исходящих не дольше SHUTDOWN_TIMEOUT,
+#      то, что не успело, отменяем
+#   3. storage.flush(): последняя атомарная запись data.json
+DRAIN_POLL_INTERVAL = 0.05
+
+
+class JobInterrupted(Exception):
+    # Длинная задача остановлена на полпути; resume_after — с чего продолжить
+    def __init__(self, done: int, resume_after):
+        super().__init__(f"interrupted after {done}")
+        self.done = done
+        self.resume_after = resume_after
+
+
+class ShutdownCoordinator(BaseMiddleware):
+    def __init__(self, timeout: float = SHUTDOWN_TIMEOUT):
+        self.timeout = timeout
+        self.stopping = False
+        self.rejected = 0
+        self._tasks: set[asyncio.Task] = set()
+        self._handlers: dict[asyncio.Task, int] = {}  # задача -> сколько апдейтов в ней обрабатывается
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if self.stopping:
+            self.rejected += 1
+            return None
+        task = asyncio.current_task()
+        self._handlers[task] = self._handlers.get(task, 0) + 1
+        try:
+            return await handler(event, data)
+        finally:
+            if self._handlers[task] == 1:
+                del self._handlers[task]
+            else:
+                self._handlers[task] -= 1
+
+    def track(self, task: asyncio.Task):
+        # Фоновая задача (рассылка), которую нужно дождаться при остановке
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def begin(self):
+        if not self.stopping:
+            self.stopping = True
+            print("⏹ Остановка: новые апдейты не принимаются")
+
+    def _busy(self) -> dict:
+        queue = scheduler.queue_depth()
+        own = asyncio.current_task()
+        return {
+            "handlers": sum(1 for task in self._handlers if task is not own),
+            "tasks": len(self._tasks),
+            "outgoing": queue["interactive"] + queue["bulk"],
+        }
+
+    async def drain(self, timeout: float = None) -> bool:
+        # True — всё завершилось до срока
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        busy = self._busy()
+        while any(busy.values()) and time.monotonic() < deadline:
+            await asyncio.sleep(DRAIN_POLL_INTERVAL)
+            busy = self._busy()
+        if not any(busy.values()):
+            return True
+        print(f"⚠️ Не дождались до конца остановки: {busy}, отменяем")
+        own = asyncio.current_task()
+        pending = [task for task in (*self._handlers, *self._tasks) if task is not own and not task.done()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        return False
+
+    def get_metrics(self) -> dict:
+        return {"stopping": self.stopping, "rejected": self.rejected, **self._busy()}
+
+
+async def flush_periodically(interval: float):
+    # Фоновый сброс отложенной записи хранилища
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(storage.flush)
+        except Exception as e:
+            print(f"Error flushing storage: {e}")
+
+
+# Общий экземпляр: подключается в main.py сразу после tenant_context, до всех остальных middleware апдейтов
+shutdown_coordinator = ShutdownCoordinator()
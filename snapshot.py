@@ -0,0 +1,78 @@
+import copy
+import time
+from collections.abc import Mapping, Sequence
+
+# Обёртки только для чтения над разобранным data.json. Данные не копируются:
+# обёртка создаётся при обращении, вложенные словари и списки оборачиваются так же.
+# Нужна копия для изменения — thaw().
+
+
+def frozen(value):
+    if isinstance(value, dict):
+        return ReadOnlyDict(value)
+    if isinstance(value, list):
+        return ReadOnlyList(value)
+    return value
+
+
+class ReadOnlyDict(Mapping):
+    __slots__ = ("_data",)
+
+    def __init__(self, data: dict):
+        self._data = data
+
+    def __getitem__(self, key):
+        return frozen(self._data[key])
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        return frozen(self._data[key]) if key in self._data else default
+
+    def items(self):
+        return ((key, frozen(value)) for key, value in self._data.items())
+
+    def values(self):
+        return (frozen(value) for value in self._data.values())
+
+    def thaw(self) -> dict:
+        return copy.deepcopy(self._data)
+
+
+class ReadOnlyList(Sequence):
+    __slots__ = ("_data",)
+
+    def __init__(self, data: list):
+        self._data = data
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ReadOnlyList(self._data[index])
+        return frozen(self._data[index])
+
+    def __iter__(self):
+        return (frozen(value) for value in self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def thaw(self) -> list:
+        return copy.deepcopy(self._data)
+
+
+class Snapshot(ReadOnlyDict):
+    # Согласованный вид всего data.json: разделы берутся из одного и того же документа.
+    # version растёт с каждой записью хранилища, taken — когда снимок снят
+    __slots__ = ("version", "taken")
+
+    def __init__(self, data: dict, version: int):
+        super().__init__(data)
+        self.version = version
+        self.taken = time.time()
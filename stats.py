@@ -0,0 +1,116 @@
+import time
+
+from utils.tenants import TenantLocal
+
+# Счётчики для админской статистики хранятся в data.json в разделе "stats"
+# и обновляются в той же транзакции, что и сами данные. Полный проход по
+# пользователям и чекам нужен только один раз — если раздела ещё нет.
+
+# Размер кольцевого буфера дневных счётчиков
+DAYS = 32
+STATUSES = ("pending", "approved", "rejected")
+
+# Последние прочитанные или записанные счётчики и подпись файла, из которого они взяты:
+# пока файл тот же, админ-панель показывает их без чтения. У каждого арендатора свои
+_cached = TenantLocal(dict)
+
+
+def day_number(timestamp: float) -> int:
+    return int(timestamp // 86400)
+
+
+def _empty() -> dict:
+    return {
+        "users_total": 0,
+        "receipts_by_status": {status: 0 for status in STATUSES},
+        "approval": {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0},
+        "join_days": [-1] * DAYS,
+        "join_counts": [0] * DAYS,
+    }
+
+
+def _bump_day(stats: dict, timestamp: float, delta: int = 1):
+    day = day_number(timestamp)
+    slot = day % DAYS
+    if stats["join_days"][slot] != day:
+        # Слот занят старым днём — он выпал из окна
+        if stats["join_days"][slot] > day:
+            return
+        stats["join_days"][slot] = day
+        stats["join_counts"][slot] = 0
+    stats["join_counts"][slot] += delta
+
+
+def rebuild(data: dict) -> dict:
+    stats = _empty()
+    now_day = day_number(time.time())
+    for user in data.get("users", {}).values():
+        stats["users_total"] += 1
+        joined = user.get("joined") if isinstance(user, dict) else None
+        if joined and now_day - day_number(joined) < DAYS:
+            _bump_day(stats, joined)
+    for receipt in data.get("receipts", []):
+        status = receipt.get("status", "pending")
+        stats["receipts_by_status"][status] = stats["receipts_by_status"].get(status, 0) + 1
+        if status == "approved" and receipt.get("decided") and receipt.get("timestamp"):
+            _record_approval(stats, receipt["decided"] - receipt["timestamp"])
+    return stats
+
+
+def ensure(data: dict) -> dict:
+    # Копию писателя не запоминаем: читатели увидят счётчики после save_data
+    if "stats" not in data:
+        data["stats"] = rebuild(data)
+    return data["stats"]
+
+
+def remember(stats: dict, signature):
+    # signature=None — счётчики есть только в памяти (отложенная запись)
+    if stats is not None:
+        _cached.instance().update(stats=stats, signature=signature)
+
+
+def cached() -> tuple:
+    entry = _cached.instance()
+    return entry.get("stats"), entry.get("signature")
+
+
+def on_user_added(data: dict, timestamp: float, is_new: bool):
+    stats = ensure(data)
+    if is_new:
+        stats["users_total"] += 1
+        _bump_day(stats, timestamp)
+
+
+def on_receipt_added(data: dict):
+    stats = ensure(data)
+    stats["receipts_by_status"]["pending"] = stats["receipts_by_status"].get("pending", 0) + 1
+
+
+def _record_approval(stats: dict, seconds: float):
+    approval = stats["approval"]
+    approval["count"] += 1
+    approval["total_seconds"] += seconds
+    if seconds > approval["max_seconds"]:
+        approval["max_seconds"] = seconds
+
+
+def on_receipt_status(data: dict, receipt: dict, old_status: str, new_status: str, timestamp: float):
+    stats = ensure(data)
+    if old_status == new_status:
+        return
+    by_status = stats["receipts_by_status"]
+    by_status[old_status] = max(0, by_status.get(old_status, 0) - 1)
+    by_status[new_status] = by_status.get(new_status, 0) + 1
+    if old_status == "pending" and new_status == "approved" and receipt.get("timestamp"):
+        _record_approval(stats, timestamp - receipt["timestamp"])
+
+
+def joins_since(stats: dict, days: int, now: float = None) -> int:
+    # Сумма по последним days дням — проход по буферу фиксированного размера
+    today = day_number(now if now is not None else time.time())
+    days = min(days, DAYS)
+    return sum(
+        count for day, count in zip(stats["join_days"], stats["join_counts"])
+        if 0 <= today - day < days
+    )
@@ -1,24 +1,192 @@
 import json
 import os
+import pickle
+import threading
 import time
+from contextlib import contextmanager, nullcontext
+
+from utils import stats, tenants
+from utils.registry import UserRegistry
+from utils.snapshot import Snapshot
+
+try:
+    from filelock import FileLock
+except ImportError:
+    FileLock = None
 
 DATA_FILE = "data.json"
+# Сколько прошлых версий кнопок хранить для отката
+MAX_BUTTON_VERSIONS = 10
+
+# Разобранный data.json делится между всеми читателями, пока файл не изменился:
+# меню, кнопки и статистика не разбирают JSON на каждое сообщение.
+# Снимок только для чтения — операции записи берут свою копию через load_data(cached=False).
+# Файлы больше CACHE_MAX_BYTES не держим в памяти постоянно.
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+class _Store:
+    # Состояние хранилища одного арендатора (в обычном запуске он один)
+    def __init__(self):
+        # Операции чтение-изменение-запись могут идти из разных потоков (asyncio.to_thread)
+        self.lock = threading.RLock()
+        # Межпроцессная блокировка, включается в шардированном режиме
+        self.file_lock = None
+        # Отложенная запись (включается enable_write_behind): save_data только подменяет снимок
+        # в памяти, на диск его сбрасывает flush() — периодически и при остановке бота.
+        # Несколько записей подряд превращаются в одну запись файла.
+        self.write_behind = False
+        # Для проверки здоровья: сколько операций ждут блокировку хранилища,
+        # когда файл последний раз успешно прочитан и записан
+        self.waiting = 0
+        self.waiting_lock = threading.Lock()
+        self.last_load = None
+        self.last_flush = None
+        # Индекс повторных чеков: file_unique_id -> позиция в receipts
+        self.unique_index = {}
+        self.indexed_receipts = 0
+        # Реестр пользователей строится из data.json один раз и дальше обновляется в add_user.
+        # Ключ — версия раздела users (её меняет только add_user), поэтому записи чеков,
+        # кнопок и задач реестр не трогают; перестраивается он, только когда пользователей
+        # добавил другой процесс. registry_signature — файл, на котором ключ проверен последним
+        self.registry = None
+        self.registry_key = None
+        self.registry_signature = None
+        self.cache = None
+        self.cache_signature = None
+        self.dirty = False
+        # Версия содержимого для снимков: растёт при каждой записи и когда файл изменили снаружи
+        self.version = 0
+        self.version_signature = None
+
+_stores = tenants.TenantLocal(_Store)
+
+def _data_file():
+    # Каталог арендатора или текущий каталог в обычном запуске
+    return tenants.path(DATA_FILE)
+
+def enable_process_lock():
+    if FileLock is None:
+        raise RuntimeError("filelock is required to share data.json between processes")
+    _stores.instance().file_lock = FileLock(_data_file() + ".lock")
+
+def enable_write_behind():
+    # Только для одного процесса: другие процессы читают файл и снимка в памяти не видят
+    store = _stores.instance()
+    if store.file_lock is not None:
+        raise RuntimeError("write-behind cannot be used together with the process lock")
+    store.write_behind = True
 
-def load_data():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
+@contextmanager
+def _locked():
+    store = _stores.instance()
+    with store.waiting_lock:
+        store.waiting += 1
+    waiting = True
+    try:
+        with store.lock, (store.file_lock if store.file_lock is not None else nullcontext()):
+            with store.waiting_lock:
+                store.waiting -= 1
+            waiting = False
+            yield
+    finally:
+        if waiting:
+            with store.waiting_lock:
+                store.waiting -= 1
+
+def get_health():
+    store = _stores.instance()
+    now = time.time()
+    return {
+        "queue_depth": store.waiting,
+        "last_load_age": now - store.last_load if store.last_load else None,
+        "last_flush_age": now - store.last_flush if store.last_flush else None,
+        "dirty": store.dirty,
+    }
+
+def invalidate_cache():
+    # Для тех, кто подменяет data.json в обход save_data (бенчмарки, ручное восстановление)
+    # Несброшенная отложенная запись при этом теряется: файл уже чужой
+    store = _stores.instance()
+    store.cache = None
+    store.cache_signature = None
+    store.registry = None
+    store.dirty = False
+
+def _remember(store, data, signature):
+    if signature is not None and signature[1] <= CACHE_MAX_BYTES:
+        store.cache, store.cache_signature = data, signature
+
+def _bump(store, signature):
+    # signature=None — новое содержимое есть только в памяти (отложенная запись)
+    if signature is None or signature != store.version_signature:
+        store.version += 1
+        store.version_signature = signature
+
+def load_data(cached=True):
+    store = _stores.instance()
+    if store.dirty:
+        # Файл отстаёт от снимка в памяти; копия для записи — через pickle, это быстрее deepcopy
+        return store.cache if cached else pickle.loads(pickle.dumps(store.cache, pickle.HIGHEST_PROTOCOL))
+    signature = _data_signature()
+    if cached and store.cache is not None and signature == store.cache_signature:
+        return store.cache
+    if signature is not None:
+        with open(_data_file(), 'r', encoding='utf-8') as f:
             data = json.load(f)
             # Исправляем структуру users, если она список
             if isinstance(data.get("users"), list):
                 print("Warning: 'users' is a list, converting to dict")
                 data["users"] = {}
+            if "receipt_history" not in data:
+                data["receipt_history"] = {}
+            store.last_load = time.time()
+            _bump(store, signature)
+            if cached:
+                # Счётчики запоминаем только из неизменяемого снимка, а не из копии писателя
+                stats.remember(data.get("stats"), signature)
+                _remember(store, data, signature)
             return data
     # Возвращаем словарь по умолчанию
+    store.last_load = time.time()
     return {"buttons": {}, "users": {}, "receipts": [], "receipt_history": {}}
 
 def save_data(data):
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    store = _stores.instance()
+    with _locked():
+        if store.write_behind:
+            # Данные сразу видны читателям, на диск их запишет flush()
+            store.cache = data
+            store.dirty = True
+            stats.remember(data.get("stats"), None)
+            _bump(store, None)
+            return
+        _write(data)
+
+def _write(data):
+    # Пишем во временный файл и подменяем: читатель никогда не увидит файл наполовину
+    with _locked():
+        data_file = _data_file()
+        tmp_file = data_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, data_file)
+        # Записанные данные и есть новое содержимое файла — перечитывать его не нужно
+        store = _stores.instance()
+        store.last_flush = time.time()
+        signature = _data_signature()
+        _bump(store, signature)
+        stats.remember(data.get("stats"), signature)
+        _remember(store, data, signature)
+
+def flush():
+    # Сбрасывает отложенную запись на диск. True — файл был записан
+    store = _stores.instance()
+    with _locked():
+        if not store.dirty:
+            return False
+        _write(store.cache)
+        store.dirty = False
+        return True
 
 def get_buttons():
     return load_data().get("buttons", {})
@@ -26,80 +194,299 @@ def get_buttons():
 def get_users():
     return load_data().get("users", {})
 
-def add_user(user_id):
+def _data_signature():
+    try:
+        stat = os.stat(_data_file())
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+def _users_key(data):
+    # Пользователи только добавляются, так что число записей страхует файлы без users_version
+    return data.get("users_version", 0), len(data.get("users", {}))
+
+def get_user_registry():
+    # Перестройка реестра — полный проход по пользователям: из асинхронного кода вызывать через asyncio.to_thread
+    store = _stores.instance()
+    with store.lock:
+        signature = _data_signature()
+        if store.registry is not None and signature == store.registry_signature:
+            return store.registry
+        data = load_data()
+        key = _users_key(data)
+        if store.registry is None or key != store.registry_key:
+            store.registry = UserRegistry.from_users(data.get("users", {}))
+            store.registry_key = key
+        store.registry_signature = signature
+        return store.registry
+
+def get_buttons_with_version():
     data = load_data()
-    if not isinstance(data["users"], dict):
-        print("Error: 'users' is not a dict, resetting to dict")
-        data["users"] = {}
-    data["users"][str(user_id)] = {"joined": time.time()}
+    return data.get("buttons", {}), data.get("buttons_meta", {}).get("version", 0)
+
+def publish_buttons(buttons, author=None, base_version=None):
+    # Публикует новую версию кнопок одной записью файла. Предыдущая версия уходит в историю.
+    # Возвращает номер новой версии или None, если с base_version кнопки уже опубликовали заново.
+    with _locked():
+        data = load_data(cached=False)
+        if base_version is not None and base_version != data.get("buttons_meta", {}).get("version", 0):
+            return None
+        return _publish(data, buttons, author)
+
+def _publish(data, buttons, author):
+    meta = data.get("buttons_meta", {"version": 0})
+    history = data.setdefault("button_versions", [])
+    history.append({**meta, "buttons": data.get("buttons", {})})
+    del history[:-MAX_BUTTON_VERSIONS]
+    version = meta.get("version", 0) + 1
+    data["buttons"] = buttons
+    data["buttons_meta"] = {"version": version, "published": time.time(), "author": author}
     save_data(data)
+    return version
 
-def add_receipt(user_id, file_id, file_type):
+def get_button_versions():
+    # Текущая версия и история, от новых к старым, без содержимого кнопок
     data = load_data()
-    data["receipts"].append({
-        "user_id": user_id,
-        "file_id": file_id,
-        "type": file_type,
-        "status": "pending",
-        "timestamp": time.time()
-    })
-    save_data(data)
+    current = {**data.get("buttons_meta", {"version": 0}), "buttons": len(data.get("buttons", {})), "current": True}
+    history = []
+    for entry in reversed(data.get("button_versions", [])):
+        summary = {key: value for key, value in entry.items() if key != "buttons"}
+        summary["buttons"] = len(entry.get("buttons", {}))
+        history.append(summary)
+    return [current] + history
+
+def rollback_buttons(version, author=None):
+    # Откат публикуется как новая версия, так что его тоже можно отменить
+    with _locked():
+        data = load_data(cached=False)
+        for entry in data.get("button_versions", []):
+            if entry.get("version") == version:
+                return _publish(data, entry["buttons"], author)
+        return None
+
+def add_user(user_id):
+    with _locked():
+        data = load_data(cached=False)
+        stats.ensure(data)
+        if not isinstance(data["users"], dict):
+            print("Error: 'users' is not a dict, resetting to dict")
+            data["users"] = {}
+        store = _stores.instance()
+        registry_fresh = store.registry is not None and store.registry_key == _users_key(data)
+        now = time.time()
+        is_new = str(user_id) not in data["users"]
+        data["users"][str(user_id)] = {"joined": now}
+        data["users_version"] = data.get("users_version", 0) + 1
+        stats.on_user_added(data, now, is_new)
+        save_data(data)
+        if registry_fresh:
+            _update_registry(store, user_id, now, _users_key(data))
+
+def _update_registry(store, user_id, joined, key):
+    store.registry.add(user_id, joined)
+    store.registry_key = key
+    store.registry_signature = _data_signature()
+
+def _sync_receipt_index(store, receipts):
+    # Чеки только дописываются в конец, поэтому индекс догоняет список с последней позиции
+    if store.indexed_receipts > len(receipts):
+        store.unique_index.clear()
+        store.indexed_receipts = 0
+    for position in range(store.indexed_receipts, len(receipts)):
+        unique_id = receipts[position].get("file_unique_id")
+        if unique_id and unique_id not in store.unique_index:
+            store.unique_index[unique_id] = position
+    store.indexed_receipts = len(receipts)
+
+def _find_duplicate(receipts, file_unique_id):
+    store = _stores.instance()
+    _sync_receipt_index(store, receipts)
+    position = store.unique_index.get(file_unique_id)
+    if position is None:
+        return None
+    if receipts[position].get("file_unique_id") != file_unique_id:
+        # Список перестроили снаружи — индекс устарел
+        store.unique_index.clear()
+        store.indexed_receipts = 0
+        return _find_duplicate(receipts, file_unique_id)
+    return receipts[position]
+
+def rebuild_receipt_index():
+    store = _stores.instance()
+    with _locked():
+        data = load_data(cached=False)
+        store.unique_index.clear()
+        store.indexed_receipts = 0
+        _sync_receipt_index(store, data["receipts"])
+        return len(store.unique_index)
+
+def add_receipt(user_id, file_id, file_type, file_unique_id=None, allow_duplicates=True, plan=None):
+    # Возвращает ранее присланный чек с тем же file_unique_id или None.
+    # Если allow_duplicates=False, повторный чек не сохраняется.
+    with _locked():
+        data = load_data(cached=False)
+        stats.ensure(data)
+        duplicate = _find_duplicate(data["receipts"], file_unique_id) if file_unique_id else None
+        if duplicate and not allow_duplicates:
+            return duplicate
+        receipt = {
+            "user_id": user_id,
+            "file_id": file_id,
+            "type": file_type,
+            "status": "pending",
+            "timestamp": time.time()
+        }
+        if file_unique_id:
+            receipt["file_unique_id"] = file_unique_id
+        if plan:
+            receipt["plan"] = plan
+        if duplicate:
+            receipt["duplicate_of"] = {"user_id": duplicate["user_id"], "file_id": duplicate["file_id"]}
+        data["receipts"].append(receipt)
+        _sync_receipt_index(_stores.instance(), data["receipts"])
+        stats.on_receipt_added(data)
+        save_data(data)
+        return duplicate
 
 def add_receipt_history(user_id, timestamp):
-    data = load_data()
-    user_id_str = str(user_id)
-    if user_id_str not in data["receipt_history"]:
-        data["receipt_history"][user_id_str] = []
-    data["receipt_history"][user_id_str].append(timestamp)
-    save_data(data)
+    with _locked():
+        data = load_data(cached=False)
+        user_id_str = str(user_id)
+        if user_id_str not in data["receipt_history"]:
+            data["receipt_history"][user_id_str] = []
+        data["receipt_history"][user_id_str].append(timestamp)
+        save_data(data)
 
 def get_receipt_history(user_id):
     data = load_data()
     return data["receipt_history"].get(str(user_id), [])
 
 def clean_receipt_history(user_id):
-    data = load_data()
-    user_id_str = str(user_id)
-    if user_id_str not in data["receipt_history"]:
-        return
-    current_time = time.time()
-    data["receipt_history"][user_id_str] = [
-        ts for ts in data["receipt_history"][user_id_str]
-        if current_time - ts < 7200
-    ]
-    save_data(data)
+    with _locked():
+        data = load_data(cached=False)
+        user_id_str = str(user_id)
+        if user_id_str not in data["receipt_history"]:
+            return
+        current_time = time.time()
+        data["receipt_history"][user_id_str] = [
+            ts for ts in data["receipt_history"][user_id_str]
+            if current_time - ts < 7200
+        ]
+        save_data(data)
 
-def update_button(button_name, button_data):
-    data = load_data()
-    data["buttons"][button_name] = button_data
-    save_data(data)
+def get_receipts():
+    return load_data().get("receipts", [])
 
-def add_message_to_button(button_name, message_data):
-    data = load_data()
-    if button_name not in data["buttons"]:
-        data["buttons"][button_name] = {"messages": [], "active": True}
-    data["buttons"][button_name]["messages"].append(message_data)
-    save_data(data)
+def snapshot():
+    # Согласованный вид данных для отчётов и выгрузок — без блокировок и без копирования.
+    # Записи не меняют разобранный документ на месте, а подменяют его новым, поэтому
+    # снимок не меняется, сколько бы ни шёл отчёт, и не задерживает запись.
+    # Файл больше CACHE_MAX_BYTES разбирается заново и живёт, пока жив снимок.
+    return Snapshot(load_data(), _stores.instance().version)
 
-def toggle_button(button_name, active):
-    data = load_data()
-    if button_name in data["buttons"]:
-        data["buttons"][button_name]["active"] = active
+def update_receipt_status(user_id, file_id, status):
+    with _locked():
+        data = load_data(cached=False)
+        stats.ensure(data)
+        for receipt in data["receipts"]:
+            if receipt["user_id"] == user_id and receipt["file_id"] == file_id:
+                now = time.time()
+                stats.on_receipt_status(data, receipt, receipt.get("status", "pending"), status, now)
+                receipt["status"] = status
+                receipt["decided"] = now
+                break
         save_data(data)
 
-def remove_message_from_button(button_name, index):
+def get_stats():
+    # Счётчики из последнего чтения или записи хранилища, пока файл не изменился.
+    # Файл мог переписать другой процесс (шарды) — тогда перечитываем
+    cached, signature = stats.cached()
+    if cached is not None and (_stores.instance().dirty or signature == _data_signature()):
+        return cached
     data = load_data()
-    if button_name in data["buttons"] and 0 <= index < len(data["buttons"][button_name]["messages"]):
-        data["buttons"][button_name]["messages"].pop(index)
+    if "stats" in data:
+        return data["stats"]
+    with _locked():
+        data = load_data(cached=False)
+        if "stats" not in data:
+            # save_data запомнит счётчики, только если запись удалась
+            stats.ensure(data)
+            save_data(data)
+        else:
+            stats.remember(data["stats"], _data_signature())
+        return data["stats"]
+
+def get_scheduled_jobs():
+    return load_data().get("scheduled_broadcasts", [])
+
+def add_scheduled_job(job):
+    # Возвращает id новой задачи
+    with _locked():
+        data = load_data(cached=False)
+        jobs = data.setdefault("scheduled_broadcasts", [])
+        job_id = data.get("next_job_id", 1)
+        data["next_job_id"] = job_id + 1
+        jobs.append({**job, "id": job_id})
         save_data(data)
+        return job_id
 
-def get_receipts():
-    return load_data().get("receipts", [])
+def update_scheduled_job(job_id, due):
+    # Переносит повторяющуюся задачу на следующий срок; False — задачу уже отменили
+    with _locked():
+        data = load_data(cached=False)
+        for job in data.get("scheduled_broadcasts", []):
+            if job["id"] == job_id:
+                job["due"] = due
+                save_data(data)
+                return True
+        return False
 
-def update_receipt_status(user_id, file_id, status):
-    data = load_data()
-    for receipt in data["receipts"]:
-        if receipt["user_id"] == user_id and receipt["file_id"] == file_id:
-            receipt["status"] = status
-            break
-    save_data(data)
\ No newline at end of file
+def remove_scheduled_job(job_id):
+    with _locked():
+        data = load_data(cached=False)
+        jobs = data.get("scheduled_broadcasts", [])
+        remaining = [job for job in jobs if job["id"] != job_id]
+        if len(remaining) == len(jobs):
+            return False
+        data["scheduled_broadcasts"] = remaining
+        save_data(data)
+        return True
+
+def get_subscriptions():
+    return load_data().get("subscriptions", {})
+
+def extend_subscription(user_id, plan, days, now=None, aliases=()):
+    # Продление считается от конца действующей подписки того же плана
+    # (aliases — прежние обозначения плана в старых записях).
+    # days=None — бессрочный план; его уже ничто не заменяет.
+    with _locked():
+        data = load_data(cached=False)
+        subscriptions = data.setdefault("subscriptions", {})
+        now = now if now is not None else time.time()
+        current = subscriptions.get(str(user_id))
+        if current and current.get("expires") is None:
+            return current
+        start = now
+        if days and current and current.get("plan") in (plan, *aliases) and current.get("expires", 0) > now:
+            start = current["expires"]
+        record = {
+            "plan": plan,
+            "started": now,
+            "expires": start + days * 86400 if days else None,
+            "reminded": False,
+            "expired": False,
+        }
+        subscriptions[str(user_id)] = record
+        save_data(data)
+        return record
+
+def mark_subscription(user_id, expires, field):
+    # Отмечает отправленное напоминание/истечение; если подписку успели продлить — False
+    with _locked():
+        data = load_data(cached=False)
+        record = data.get("subscriptions", {}).get(str(user_id))
+        if record is None or record.get("expires") != expires:
+            return False
+        record[field] = True
+        save_data(data)
+        return True
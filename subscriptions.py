@@ -0,0 +1,159 @@
+import asyncio
+import datetime
+import heapq
+import time
+from typing import Optional
+
+from aiogram import Bot
+
+from utils import storage, tenants
+from utils.outgoing import bulk_priority
+from utils.sharding import notify_leader
+
+# Планы, которые оплачиваются чеком: id -> название и срок действия в днях (None — навсегда).
+# Одобренный чек продлевает подписку пользователя на срок плана. Кнопка меню ссылается
+# на план полем "plan", чек и подписка хранят id — переименование кнопки план не теряет.
+PLANS = {
+    "entry": {"title": "ВХОД В ОТРЯД СВОБОДЫ🗽", "days": None},
+    "monthly": {"title": "Месячная подписка", "days": 30},
+}
+# Кнопки без поля "plan", чеки и подписки, где план записан названием кнопки (старые data.json)
+LEGACY_PLAN_NAMES = {
+    "ВХОД В ОТРЯД СВОБОДЫ🗽": "entry",
+    "Месячная подписка": "monthly",
+}
+# За сколько до окончания напомнить о продлении
+REMIND_BEFORE = 3 * 86400
+
+
+def format_date(timestamp: float) -> str:
+    return datetime.datetime.fromtimestamp(timestamp).strftime("%d.%m.%Y")
+
+
+def plan_id(plan: Optional[str]) -> Optional[str]:
+    return LEGACY_PLAN_NAMES.get(plan, plan)
+
+
+def button_plan(name: str, info: dict) -> Optional[str]:
+    # План, который оплачивает кнопка меню, или None
+    plan = plan_id(info.get("plan") or name)
+    return plan if plan in PLANS else None
+
+
+def plan_title(plan: Optional[str]) -> str:
+    return PLANS.get(plan_id(plan), {}).get("title", plan or "")
+
+
+class SubscriptionWatcher:
+    # Куча событий (время, user_id, срок подписки, "remind"/"expire"): ближайшее событие
+    # достаётся за O(log n), без прохода по всем пользователям. Записи, которые успели
+    # продлить, отбрасываются при извлечении — у них другой срок.
+    def __init__(self):
+        self._heap = []
+        self._expires: dict[str, float] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._bot: Optional[Bot] = None
+
+    @property
+    def running(self) -> bool:
+        return self._bot is not None
+
+    def start(self, bot: Bot):
+        # Вызывается в процессе, который рассылает уведомления: обычный запуск или ведущий процесс шардов
+        self._bot = bot
+        self._wakeup = asyncio.Event()
+        self.reload()
+        self._worker = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        self._bot = None
+
+    def reload(self):
+        self._heap = []
+        self._expires = {}
+        for user_id, record in storage.get_subscriptions().items():
+            self._push(user_id, record, heapify=False)
+        heapq.heapify(self._heap)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _push(self, user_id: str, record: dict, heapify: bool = True):
+        expires = record.get("expires")
+        if expires is None:
+            return
+        self._expires[user_id] = expires
+        events = []
+        if not record.get("reminded"):
+            events.append((expires - REMIND_BEFORE, user_id, expires, "remind"))
+        if not record.get("expired"):
+            events.append((expires, user_id, expires, "expire"))
+        for event in events:
+            if heapify:
+                heapq.heappush(self._heap, event)
+            else:
+                self._heap.append(event)
+
+    async def activate(self, user_id: int, plan: Optional[str]) -> Optional[dict]:
+        # Продлевает подписку по одобренному чеку; None — чек не относится ни к одному плану
+        plan = plan_id(plan)
+        if plan not in PLANS:
+            return None
+        aliases = [name for name, legacy in LEGACY_PLAN_NAMES.items() if legacy == plan]
+        record = await asyncio.to_thread(storage.extend_subscription, user_id, plan, PLANS[plan]["days"], None, aliases)
+        if not self.running:
+            notify_leader("subscriptions")
+        else:
+            self._push(str(user_id), record)
+            self._wakeup.set()
+        return record
+
+    async def _run(self):
+        while True:
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                _, user_id, expires, kind = heapq.heappop(self._heap)
+                if self._expires.get(user_id) != expires:
+                    continue
+                try:
+                    await self._notify(user_id, expires, kind)
+                except Exception as e:
+                    # Одно неудачное событие не должно останавливать все следующие
+                    print(f"Subscription event {kind} for {user_id} failed: {e}")
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _notify(self, user_id: str, expires: float, kind: str):
+        bot = self._bot
+        # Уведомления идут массовым приоритетом через общий лимит отправки
+        with bulk_priority():
+            try:
+                if kind == "remind":
+                    # Если бот был выключен и срок уже прошёл, напоминание не нужно — придёт "expire"
+                    if expires > time.time():
+                        await bot.send_message(
+                            int(user_id),
+                            f"⏳ Ваша подписка заканчивается {format_date(expires)}. "
+                            "Чтобы продлить её, нажмите «Месячная подписка» и пришлите новый чек."
+                        )
+                else:
+                    await bot.send_message(
+                        int(user_id),
+                        "⌛ Срок вашей подписки истёк. Чтобы продлить её, нажмите «Месячная подписка» и пришлите новый чек."
+                    )
+                    for admin_id in tenants.admins():
+                        await bot.send_message(admin_id, f"⌛ Подписка пользователя {user_id} истекла {format_date(expires)}.")
+            except Exception as e:
+                print(f"Ошибка уведомления о подписке {user_id}: {e}")
+        await asyncio.to_thread(storage.mark_subscription, user_id, expires, "reminded" if kind == "remind" else "expired")
+
+
+# У каждого арендатора свой; в обычном запуске он один
+subscription_watcher = tenants.TenantLocal(SubscriptionWatcher)
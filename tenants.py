@@ -0,0 +1,109 @@
+import contextvars
+import os
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+from config import ADMINS
+
+# Несколько ботов в одном процессе (config.TENANTS). У каждого арендатора свой каталог
+# с data.json, button.json и окном update_id и свой список админов; цикл событий,
+# HTTP-сессия, роутеры и планировщик отправок общие. Текущий арендатор живёт в contextvar:
+# его выставляет middleware по боту апдейта, а задачи и asyncio.to_thread наследуют его сами.
+# Без TENANTS арендатора нет, и всё работает как обычный запуск: config.ADMINS, текущий каталог.
+
+
+class Tenant:
+    __slots__ = ("name", "token", "admins", "directory", "bot")
+
+    def __init__(self, name: str, token: str, admins: list[int], directory: str):
+        self.name = name
+        self.token = token
+        self.admins = admins
+        self.directory = directory
+        self.bot = None
+
+
+_current: contextvars.ContextVar[Optional[Tenant]] = contextvars.ContextVar("tenant", default=None)
+_by_bot: dict[int, Tenant] = {}
+
+
+def from_config(entries: list[dict]) -> list[Tenant]:
+    tenants = []
+    names = set()
+    for entry in entries:
+        name = entry["name"]
+        if name in names:
+            raise ValueError(f"Duplicate tenant name: {name}")
+        names.add(name)
+        admins = entry.get("admins", [])
+        if not isinstance(entry.get("token"), str) or not all(isinstance(x, int) for x in admins):
+            raise ValueError(f"Tenant {name}: token must be a string and admins a list of integers")
+        directory = entry.get("dir", os.path.join("tenants", name))
+        os.makedirs(directory, exist_ok=True)
+        tenants.append(Tenant(name, entry["token"], admins, directory))
+    return tenants
+
+
+def register(tenant: Tenant, bot):
+    tenant.bot = bot
+    _by_bot[bot.id] = tenant
+
+
+def registered() -> list[Tenant]:
+    return list(_by_bot.values())
+
+
+def current() -> Optional[Tenant]:
+    return _current.get()
+
+
+def admins() -> list[int]:
+    tenant = _current.get()
+    return tenant.admins if tenant is not None else ADMINS
+
+
+def path(filename: str) -> str:
+    tenant = _current.get()
+    return os.path.join(tenant.directory, filename) if tenant is not None else filename
+
+
+@contextmanager
+def use(tenant: Optional[Tenant]):
+    token = _current.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _current.reset(token)
+
+
+async def tenant_context(handler, event, data):
+    # Внешний middleware апдейтов: дальше всё выполняется от имени арендатора бота апдейта
+    tenant = _by_bot.get(data["bot"].id)
+    if tenant is None:
+        return await handler(event, data)
+    with use(tenant):
+        return await handler(event, data)
+
+
+class TenantLocal:
+    # Своё значение на каждого арендатора, создаётся при первом обращении
+    def __init__(self, factory):
+        self._factory = factory
+        self._values: dict[Optional[str], object] = {}
+        self._lock = threading.Lock()
+
+    def instance(self):
+        tenant = _current.get()
+        key = tenant.name if tenant is not None else None
+        try:
+            return self._values[key]
+        except KeyError:
+            with self._lock:
+                if key not in self._values:
+                    self._values[key] = self._factory()
+                return self._values[key]
+
+    def __getattr__(self, name):
+        # Экземпляр-синглтон (планировщик рассылок и т.п.) ведёт себя как объект текущего арендатора
+        return getattr(self.instance(), name)
@@ -0,0 +1,65 @@
+# Случайная проверка entities_to_html: текст без тегов совпадает с исходным,
+# теги правильно вложены. Набор случаев фиксирован сидом.
+#
+# Запуск из корня развёрнутого бота (пакеты handlers/ и utils/):
+#   python -m pytest -q tests
+import html
+import random
+import re
+
+import pytest
+
+from utils.formatting import entities_to_html
+
+CASES = 2000
+ALPHABET = "абвгд abc <&>😀🎉✅\n"
+TYPES = ("bold", "italic", "underline", "strikethrough", "spoiler", "code", "pre", "text_link",
+         "text_mention", "custom_emoji", "blockquote", "expandable_blockquote", "mention", "url")
+TAG_RE = re.compile(r"<(/?)([a-z-]+)[^>]*>")
+
+
+def utf16_len(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def make_case(rng: random.Random) -> tuple[str, list[dict]]:
+    text = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 40)))
+    total = utf16_len(text)
+    entities = []
+    for _ in range(max(1, int(len(text) * rng.random() / 4))):
+        offset = rng.randrange(total)
+        entities.append({
+            "type": rng.choice(TYPES),
+            "offset": offset,
+            "length": rng.randint(1, min(total - offset, 200)),
+            "url": "https://example.org/?a=1&b=2",
+            "user": {"id": rng.randint(1, 10**9)},
+            "custom_emoji_id": str(rng.randint(1, 10**18)),
+            "language": rng.choice((None, "python")),
+        })
+    return text, entities
+
+
+def check(text: str, entities: list[dict]) -> str:
+    # Возвращает описание ошибки или пустую строку
+    rendered = entities_to_html(text, entities)
+    if not text.strip():
+        return "" if rendered == "" else "непустой результат для пустого текста"
+    if html.unescape(TAG_RE.sub("", rendered)) != text:
+        return "текст без тегов не совпадает с исходным"
+    stack = []
+    for match in TAG_RE.finditer(rendered):
+        if not match.group(1):
+            stack.append(match.group(2))
+        elif not stack or stack.pop() != match.group(2):
+            return f"неправильная вложенность у </{match.group(2)}>"
+    return "незакрытые теги" if stack else ""
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_entities_render_to_balanced_html(seed):
+    rng = random.Random(seed)
+    for number in range(CASES // 5):
+        text, entities = make_case(rng)
+        error = check(text, entities)
+        assert not error, f"case {number}: {error}\n  text={text!r}\n  entities={entities!r}"
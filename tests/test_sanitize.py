@@ -0,0 +1,68 @@
+# Фаззинг sanitize_html: на выходе только разрешённые теги, правильно вложенные,
+# и ни одного неэкранированного "<". Набор случаев фиксирован сидом.
+#
+# Запуск из корня развёрнутого бота (пакеты handlers/ и utils/):
+#   python -m pytest -q tests
+import random
+import re
+
+import pytest
+
+from utils.formatting import ALLOWED_TAGS, sanitize_html
+
+CASES = 2000
+TAG_RE = re.compile(r"<(/?)([a-zA-Z-]+)[^<>]*>")
+PIECES = (
+    "текст ", "text ", "😀", "&", "&amp;", ">", "<", "<b>", "</b>", "<i>", "</i>", "</u>",
+    '<a href="https://example.org/?a=1&b=2">', "</a>", "<a href='x' onclick='y'>", "<script>",
+    "</script>", '<span class="tg-spoiler">', "</span>", "<pre>", "</pre>", "<blockquote expandable>",
+    '<tg-emoji emoji-id="5">', "</tg-emoji>", "<a", "<b href", "<", "</", "<<>>",
+)
+
+
+def random_html(rng: random.Random, size: int) -> str:
+    parts = []
+    length = 0
+    while length < size:
+        piece = rng.choice(PIECES)
+        parts.append(piece)
+        length += len(piece)
+    return "".join(parts)[:size]
+
+
+def check(text: str) -> str:
+    # Возвращает описание ошибки или пустую строку
+    cleaned = sanitize_html(text, limit=None)
+    stack = []
+    for match in TAG_RE.finditer(cleaned):
+        tag = match.group(2)
+        if tag not in ALLOWED_TAGS:
+            return f"недопустимый тег <{tag}>"
+        if not match.group(1):
+            stack.append(tag)
+        elif not stack or stack.pop() != tag:
+            return f"неправильная вложенность у </{tag}>"
+    if stack:
+        return "незакрытые теги"
+    if "<" in TAG_RE.sub("", cleaned):
+        return "неэкранированный <"
+    return ""
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_html_is_sanitized_to_balanced_allowed_tags(seed):
+    rng = random.Random(seed)
+    for number in range(CASES // 5):
+        text = random_html(rng, rng.randint(1, 200))
+        error = check(text)
+        assert not error, f"case {number}: {error}\n  text={text!r}"
+
+
+@pytest.mark.parametrize("text", [
+    "<a" * 500,
+    "<b " + "x" * 1000,
+    "<b><i>" * 100 + "x" + "</i></b>" * 100,
+    '<a href="' + "h" * 1000 + '">x</a>',
+])
+def test_pathological_html_is_sanitized(text):
+    assert check(text) == ""
@@ -0,0 +1,77 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from utils import tenants
+
+# Лимиты по типу апдейта: (токенов в секунду, запас). Типы без лимита не ограничиваются.
+THROTTLE_LIMITS = {
+    "message": (1.0, 5),
+    "callback_query": (2.0, 10),
+    "edited_message": (0.5, 3),
+}
+# Сколько пользователей помнить; самые давние вытесняются
+MAX_TRACKED_USERS = 10000
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    # Ведро токенов на пару (пользователь, тип апдейта). Лишние апдейты молча выбрасываются
+    # ещё до хендлеров и очереди чата: флуд не читает хранилище и ничего не отправляет.
+    def __init__(self, limits: dict = None, max_users: int = MAX_TRACKED_USERS):
+        self.limits = THROTTLE_LIMITS if limits is None else limits
+        self.max_users = max_users
+        self._buckets: OrderedDict = OrderedDict()  # (user_id, тип) -> [токены, время обновления]
+        self.dropped: dict[str, int] = {}
+        self.evicted = 0
+
+    def _allow(self, user_id: int, update_type: str) -> bool:
+        limit = self.limits.get(update_type)
+        if limit is None:
+            return True
+        rate, burst = limit
+        now = time.monotonic()
+        key = (user_id, update_type)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(burst), now]
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or user.id in tenants.admins() or not isinstance(event, Update):
+            return await handler(event, data)
+        update_type = event.event_type
+        if self._allow(user.id, update_type):
+            return await handler(event, data)
+        self.dropped[update_type] = self.dropped.get(update_type, 0) + 1
+        return None
+
+    def get_metrics(self) -> dict:
+        return {
+            "tracked": len(self._buckets),
+            "dropped": dict(self.dropped),
+            "dropped_total": sum(self.dropped.values()),
+            "evicted": self.evicted,
+        }
+
+
+# Общий экземпляр: подключается в main.py раньше очереди чатов, метрики читает админ-панель
+update_throttling = ThrottlingMiddleware()
@@ -4,14 +4,16 @@ from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
-from config import TOKEN, ADMINS
+from utils import tenants
 from handlers.admin import AdminStates
+from utils.formatting import sanitize_html_cached
+from utils.subscriptions import button_plan, plan_title
+from utils.storage import get_buttons, get_user_registry, add_user, add_receipt, add_receipt_history, get_receipt_history, clean_receipt_history
+import asyncio
 import json
 import os
 import time
-import re
 import math
-import html
 
 router = Router()
 
@@ -22,178 +24,99 @@ class UserStates(StatesGroup):
 # Ограничения на отправку чеков
 MAX_RECEIPTS = 3
 RECEIPT_WINDOW = 7200  # 2 часа в секундах
+# Повторно присланный чек (тот же file_unique_id): "reject" — отклонить сразу, "flag" — пометить для админов
+DUPLICATE_RECEIPTS = "reject"
 
-# Функция для очистки и исправления HTML
-def sanitize_html(text: str) -> str:
-    if not text:
-        return text
-    
-    # Список разрешенных тегов Telegram
-    allowed_tags = {'b', 'i', 'u', 's', 'a', 'code', 'pre', 'span', 'blockquote', 'tg-spoiler'}
-    
-    try:
-        # Разбиваем текст на части: теги и содержимое
-        parts = re.split(r'(<[^>]+>)', text)
-        cleaned_text = ''
-        open_tags = []
-        
-        for part in parts:
-            # Если это тег
-            if part.startswith('<'):
-                tag_match = re.match(r'</?([a-zA-Z-]+)(?:\s+[^>]*)?>', part)
-                if tag_match:
-                    tag_name = tag_match.group(1).lower()
-                    is_closing = part.startswith('</')
-                    
-                    if tag_name not in allowed_tags:
-                        continue  # Пропускаем недопустимые теги
-                    
-                    if is_closing:
-                        # Удаляем закрывающий тег из стека, если он соответствует
-                        if open_tags and open_tags[-1] == tag_name:
-                            open_tags.pop()
-                            cleaned_text += part
-                    else:
-                        # Добавляем открывающий тег в стек
-                        open_tags.append(tag_name)
-                        cleaned_text += part
-            else:
-                # Экранируем специальные символы в содержимом
-                cleaned_text += html.escape(part)
-        
-        # Закрываем все незакрытые теги
-        while open_tags:
-            tag_name = open_tags.pop()
-            cleaned_text += f'</{tag_name}>'
-        
-        print(f"Debug: Sanitized HTML: {cleaned_text}")
-        return cleaned_text
-    
-    except Exception as e:
-        print(f"Ошибка очистки HTML: {e}")
-        # В крайнем случае удаляем все теги
-        return html.escape(re.sub(r'<[^>]+>', '', text))
-
-DATA_FILE = "data.json"
 BUTTONS_FILE = "button.json"
+# Как часто проверять, не изменился ли button.json (секунды)
+MENU_CHECK_INTERVAL = 5
 
-def load_data():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            if isinstance(data.get("users"), list):
-                print("Warning: 'users' is a list, converting to dict")
-                data["users"] = {}
-            if "receipt_history" not in data:
-                data["receipt_history"] = {}
-            return data
-    return {"buttons": {}, "users": {}, "receipts": [], "receipt_history": {}}
-
-def load_buttons_menu():
-    try:
-        if os.path.exists(BUTTONS_FILE):
-            with open(BUTTONS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f).get("menu", [])
-        return []
-    except Exception as e:
-        print(f"Error loading buttons menu: {e}")
-        return []
-
-def save_data(data):
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-def get_buttons():
-    return load_data().get("buttons", {})
-
-def get_users():
-    return load_data().get("users", {})
-
-def add_user(user_id):
-    data = load_data()
-    if not isinstance(data["users"], dict):
-        print("Error: 'users' is not a dict, resetting to dict")
-        data["users"] = {}
-    data["users"][str(user_id)] = {"joined": time.time()}
-    save_data(data)
-
-def add_receipt(user_id, file_id, file_type):
-    data = load_data()
-    data["receipts"].append({
-        "user_id": user_id,
-        "file_id": file_id,
-        "type": file_type,
-        "status": "pending",
-        "timestamp": time.time()
-    })
-    save_data(data)
-
-def add_receipt_history(user_id, timestamp):
-    data = load_data()
-    user_id_str = str(user_id)
-    if user_id_str not in data["receipt_history"]:
-        data["receipt_history"][user_id_str] = []
-    data["receipt_history"][user_id_str].append(timestamp)
-    save_data(data)
-
-def get_receipt_history(user_id):
-    data = load_data()
-    return data["receipt_history"].get(str(user_id), [])
+# Раскладка меню загружается один раз и перечитывается только при смене mtime/inode файла.
+# Новая раскладка подменяет старую целиком одним присваиванием. У каждого арендатора своя.
+class _MenuState:
+    def __init__(self):
+        self.layout = ()
+        self.signature = None
+        self.loaded = False
 
-def clean_receipt_history(user_id):
-    data = load_data()
-    user_id_str = str(user_id)
-    if user_id_str not in data["receipt_history"]:
-        return
-    current_time = time.time()
-    data["receipt_history"][user_id_str] = [
-        ts for ts in data["receipt_history"][user_id_str]
-        if current_time - ts < RECEIPT_WINDOW
-    ]
-    save_data(data)
-
-def update_button(button_name, button_data):
-    data = load_data()
-    data["buttons"][button_name] = button_data
-    save_data(data)
+_menu = tenants.TenantLocal(_MenuState)
 
-def add_message_to_button(button_name, message_data):
-    data = load_data()
-    if button_name not in data["buttons"]:
-        data["buttons"][button_name] = {"messages": [], "active": True}
-    data["buttons"][button_name]["messages"].append(message_data)
-    save_data(data)
+def _file_signature(path: str):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_ino, st.st_size)
 
-def toggle_button(button_name, active):
-    data = load_data()
-    if button_name in data["buttons"]:
-        data["buttons"][button_name]["active"] = active
-        save_data(data)
+def validate_menu_layout(layout, buttons: dict) -> list[str]:
+    errors = []
+    if not isinstance(layout, list):
+        return ["menu должен быть списком рядов"]
+    seen = set()
+    for i, row in enumerate(layout, 1):
+        if not isinstance(row, list):
+            errors.append(f"ряд {i} должен быть списком")
+            continue
+        for btn_name in row:
+            if not isinstance(btn_name, str):
+                errors.append(f"ряд {i}: название кнопки должно быть строкой")
+            elif btn_name not in buttons:
+                errors.append(f"ряд {i}: кнопки «{btn_name}» нет")
+            elif btn_name in seen:
+                errors.append(f"ряд {i}: кнопка «{btn_name}» повторяется")
+            else:
+                seen.add(btn_name)
+    return errors
 
-def remove_message_from_button(button_name, index):
-    data = load_data()
-    if button_name in data["buttons"] and 0 <= index < len(data["buttons"][button_name]["messages"]):
-        data["buttons"][button_name]["messages"].pop(index)
-        save_data(data)
+def reload_buttons_menu(force: bool = False) -> bool:
+    menu = _menu.instance()
+    buttons_file = tenants.path(BUTTONS_FILE)
+    signature = _file_signature(buttons_file)
+    if menu.loaded and signature == menu.signature and not force:
+        return False
+    menu.loaded = True
+    menu.signature = signature
+    if signature is None:
+        menu.layout = ()
+        return True
+    try:
+        with open(buttons_file, 'r', encoding='utf-8') as f:
+            layout = json.load(f).get("menu", [])
+    except Exception as e:
+        print(f"Error loading buttons menu: {e}")
+        return False
+    errors = validate_menu_layout(layout, get_buttons())
+    if errors:
+        # Оставляем последнюю рабочую раскладку
+        print(f"Error: button.json rejected: {'; '.join(errors)}")
+        return False
+    menu.layout = tuple(tuple(row) for row in layout)
+    print(f"✅ Раскладка меню обновлена: {len(menu.layout)} рядов")
+    return True
 
-def get_receipts():
-    return load_data().get("receipts", [])
+def load_buttons_menu():
+    menu = _menu.instance()
+    if not menu.loaded:
+        reload_buttons_menu()
+    return menu.layout
 
-def update_receipt_status(user_id, file_id, status):
-    data = load_data()
-    for receipt in data["receipts"]:
-        if receipt["user_id"] == user_id and receipt["file_id"] == file_id:
-            receipt["status"] = status
-            break
-    save_data(data)
+async def watch_buttons_menu(interval: float = MENU_CHECK_INTERVAL):
+    # Дешёвый периодический os.stat вместо чтения файла на каждое меню
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            reload_buttons_menu()
+        except Exception as e:
+            print(f"Error watching buttons menu: {e}")
 
 # Функция для создания главного меню
-def get_main_menu(user_id: int):
+async def get_main_menu(user_id: int):
     buttons = get_buttons()
     menu_layout = load_buttons_menu()
     keyboard = []
-    users = get_users()
-    is_admin = user_id in ADMINS and users.get(str(user_id), {}).get("is_admin_panel_enabled", False)
+    # Реестр может перестраиваться (data.json изменил другой процесс) — не на цикле событий
+    record = (await asyncio.to_thread(get_user_registry)).get(user_id) if user_id in tenants.admins() else None
+    is_admin = record is not None and record.extra.get("is_admin_panel_enabled", False)
     
     if is_admin:
         keyboard.append([KeyboardButton(text="Админ Панель")])
@@ -226,28 +149,48 @@ def get_main_menu(user_id: int):
 @router.message(Command("start"))
 async def cmd_start(message: types.Message, state: FSMContext):
     await state.clear()
-    add_user(message.from_user.id)
+    # Запись в файл выполняется в потоке, чтобы не держать цикл событий
+    await asyncio.to_thread(add_user, message.from_user.id)
     await message.answer(
         "<b>Приветствую</b>",
         parse_mode="HTML",
-        reply_markup=get_main_menu(message.from_user.id)
+        reply_markup=await get_main_menu(message.from_user.id)
     )
 
-@router.message(F.text.in_(get_buttons().keys()), ~F.text.in_(["❌ Отменить"]))
+def is_menu_button(message: types.Message) -> bool:
+    # Названия кнопок берутся из общего снимка хранилища при каждом сообщении:
+    # импорт модуля не читает data.json, а новые кнопки работают сразу после публикации
+    return message.text in get_buttons()
+
+def warm_caches():
+    # Запускается в фоне при старте: раскладка меню, снимок хранилища и очищенный HTML кнопок
+    reload_buttons_menu()
+    texts = 0
+    for button in get_buttons().values():
+        for msg in button.get("messages", []):
+            for key in ("content", "caption"):
+                if msg.get(key):
+                    sanitize_html_cached(msg[key])
+                    texts += 1
+    print(f"✅ Кеши прогреты: {texts} текстов кнопок")
+
+@router.message(is_menu_button, ~F.text.in_(["❌ Отменить"]))
 async def handle_button(message: types.Message, state: FSMContext):
     btn_name = message.text
     buttons = get_buttons()
     if btn_name not in buttons or not buttons[btn_name].get("active", True):
-        await message.answer("❌ Эта кнопка недоступна.", parse_mode="HTML", reply_markup=get_main_menu(message.from_user.id))
+        await message.answer("❌ Эта кнопка недоступна.", parse_mode="HTML", reply_markup=await get_main_menu(message.from_user.id))
         return
     
     messages = buttons[btn_name]["messages"]
     if not messages:
-        await message.answer("❌ Нет сообщений для этой кнопки.", parse_mode="HTML", reply_markup=get_main_menu(message.from_user.id))
+        await message.answer("❌ Нет сообщений для этой кнопки.", parse_mode="HTML", reply_markup=await get_main_menu(message.from_user.id))
         return
     
     inline_keyboard = None
-    if btn_name == "ВХОД В ОТРЯД СВОБОДЫ🗽":
+    plan = button_plan(btn_name, buttons[btn_name])
+    # Кнопки планов заканчиваются предложением прислать чек
+    if plan:
         inline_keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="Я оплатил/прислать чек", callback_data="send_receipt")]
         ])
@@ -255,9 +198,9 @@ async def handle_button(message: types.Message, state: FSMContext):
     for msg in messages:
         try:
             msg_type = msg.get("type")
-            caption = sanitize_html(msg.get("caption", "")) if msg.get("caption") else None
-            content = sanitize_html(msg.get("content", "")) if msg.get("content") else None
-            reply_markup = inline_keyboard if (btn_name == "ВХОД В ОТРЯД СВОБОДЫ🗽" and msg == messages[-1]) else None
+            caption = sanitize_html_cached(msg["caption"]) if msg.get("caption") else None
+            content = sanitize_html_cached(msg["content"]) if msg.get("content") else None
+            reply_markup = inline_keyboard if (plan and msg == messages[-1]) else None
             
             if msg_type == "text":
                 await message.answer(content, parse_mode="HTML", reply_markup=reply_markup)
@@ -276,13 +219,14 @@ async def handle_button(message: types.Message, state: FSMContext):
             await message.answer("❌ Ошибка при отправке сообщения.", parse_mode="HTML")
             continue
     
-    if btn_name == "ВХОД В ОТРЯД СВОБОДЫ🗽":
+    if plan:
         await state.set_state(UserStates.waiting_for_receipt)
+        await state.update_data(plan=plan)
     else:
         await message.answer(
             "Выбери действие:",
             parse_mode="HTML",
-            reply_markup=get_main_menu(message.from_user.id)
+            reply_markup=await get_main_menu(message.from_user.id)
         )
 
 @router.callback_query(F.data == "send_receipt")
@@ -303,7 +247,7 @@ async def handle_receipt(message: types.Message, state: FSMContext, bot: Bot):
     user_id = message.from_user.id
     current_time = time.time()
     
-    clean_receipt_history(user_id)
+    await asyncio.to_thread(clean_receipt_history, user_id)
     
     receipt_history = get_receipt_history(user_id)
     recent_receipts = [ts for ts in receipt_history if current_time - ts < RECEIPT_WINDOW]
@@ -316,20 +260,37 @@ async def handle_receipt(message: types.Message, state: FSMContext, bot: Bot):
             f"❌ Вы достигли лимита ({MAX_RECEIPTS} чека за 2 часа). "
             f"Попробуйте снова через {minutes_left} минут.",
             parse_mode="HTML",
-            reply_markup=get_main_menu(user_id)
+            reply_markup=await get_main_menu(user_id)
         )
         await state.clear()
         return
     
-    file_id = message.photo[-1].file_id if message.photo else message.document.file_id
+    file = message.photo[-1] if message.photo else message.document
+    file_id = file.file_id
     file_type = "photo" if message.photo else "document"
+    plan = (await state.get_data()).get("plan")
     
-    add_receipt(user_id, file_id, file_type)
-    add_receipt_history(user_id, current_time)
+    duplicate = await asyncio.to_thread(
+        add_receipt, user_id, file_id, file_type, file.file_unique_id, DUPLICATE_RECEIPTS != "reject", plan
+    )
+    if duplicate and DUPLICATE_RECEIPTS == "reject":
+        await message.answer(
+            "❌ Этот чек уже был отправлен на проверку. Пришлите, пожалуйста, другой чек.",
+            parse_mode="HTML",
+            reply_markup=await get_main_menu(user_id)
+        )
+        await state.clear()
+        return
+    await asyncio.to_thread(add_receipt_history, user_id, current_time)
     
-    for admin_id in ADMINS:
+    notice = f"Новый чек от пользователя {user_id} (Тип: {file_type})"
+    if plan:
+        notice += f"\nПлан: {plan_title(plan)}"
+    if duplicate:
+        notice += f"\n⚠️ Повтор: такой же чек уже присылал пользователь {duplicate['user_id']} (статус: {duplicate['status']})"
+    for admin_id in tenants.admins():
         try:
-            await bot.send_message(admin_id, f"Новый чек от пользователя {user_id} (Тип: {file_type})")
+            await bot.send_message(admin_id, notice)
             if file_type == "photo":
                 await bot.send_photo(admin_id, file_id)
             elif file_type == "document":
@@ -340,7 +301,7 @@ async def handle_receipt(message: types.Message, state: FSMContext, bot: Bot):
     await message.answer(
         "Ваш чек отправлен на проверку. Ожидайте подтверждения.",
         parse_mode="HTML",
-        reply_markup=get_main_menu(user_id)
+        reply_markup=await get_main_menu(user_id)
     )
     await state.clear()
 
@@ -350,7 +311,7 @@ async def cancel_action(message: types.Message, state: FSMContext):
     await message.answer(
         "Действие отменено.",
         parse_mode="HTML",
-        reply_markup=get_main_menu(message.from_user.id)
+        reply_markup=await get_main_menu(message.from_user.id)
     )
 
 @router.message()
@@ -362,7 +323,5 @@ async def handle_unknown(message: types.Message, state: FSMContext):
     await message.answer(
         "❌ Неизвестная команда. Выбери действие из меню.",
         parse_mode="HTML",
-        reply_markup=get_main_menu(message.from_user.id)
-    )
-
-print("✅ user.py загружен")
\ No newline at end of file
+        reply_markup=await get_main_menu(message.from_user.id)
+    )
\ No newline at end of file